@@ -1,34 +1,67 @@
 # anim.py
 import io
-import os
+import hashlib
 import math
 import base64
 import re
+import struct
 import shutil
-import tempfile
 import subprocess
 from dataclasses import dataclass
-from typing import List, Tuple, Dict, Optional
+from typing import Iterator, List, Tuple, Dict, Optional, Sequence
+from collections import OrderedDict
 from fractions import Fraction
+from bisect import bisect_right
 
-import requests
-from PIL import Image, ImageSequence, ImageDraw, ImageChops
-from apngasm_python.apngasm import APNGAsmBinder  # 使用 apngasm-python 组装 APNG
+import numpy as np
+
+from PIL import Image, ImageSequence, ImageDraw
 
 from utils import Config
+from cache import asset_cache, decoded_asset_key
+from media import media_cache
+from encoders import iter_apng_delta, encode_apng_apngasm, encode_gif_delta, expand_delta_frames, encode_webp_avif
+from quantize import quantize_frames_global
+from timeline import build_timeline
+from metrics import stage, timed_iter, OUTPUT_FRAMES
 
 DATA_URL_RE = re.compile(r'^data:(?P<mime>[\w/+.-]+);base64,(?P<data>.+)$', re.I)
 
 
+class FrameStack(Sequence):
+    """
+    (n, h, w, 4) uint8 连续数组上的只读帧序列：按下标取出时才包装为 PIL 图像，
+    与底层数组（可能是跨进程共享的 mmap）共享内存，不做拷贝
+    """
+
+    def __init__(self, pixels: np.ndarray):
+        self.pixels = pixels
+
+    def __len__(self) -> int:
+        return self.pixels.shape[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return Image.fromarray(self.pixels[i], "RGBA")
+
+
 @dataclass
 class AnimatedAsset:
     placeholder_id: str
     display_size: Tuple[int, int]          # (w, h) 渲染尺寸（已受 CSS max 限制）
-    frames_rgba: List[Image.Image]         # 逐帧 RGBA（已缩放+圆角）
+    frames_rgba: Sequence[Image.Image]     # 逐帧 RGBA（已缩放+圆角；FrameStack）
     durations_frac: List[Fraction]         # 每帧时长（单位：秒，Fraction）
     # 供事件时间线使用（基于全局分母 G 计算）
     cum_ticks: List[int]                   # 单轮内累计 ticks（整数）
     period_ticks: int                      # 单轮总 ticks（整数）
+    content_hash: str = ""                 # 原始字节 sha1（调色板等派生数据的记忆化 key）
+
+
+@dataclass
+class ImageProbe:
+    animated: bool                         # 是否为多帧动图（仅凭容器头判断）
+    size: Tuple[int, int]                  # 原始尺寸 (w, h)
 
 
 # ----------------- 基础工具 -----------------
@@ -40,38 +73,161 @@ def _is_data_url(s: str) -> Optional[re.Match]:
 
 
 def _fetch_bytes_and_mime(src: str) -> Tuple[bytes, Optional[str]]:
-    m = _is_data_url(src)
-    if m:
-        return base64.b64decode(m.group('data')), m.group('mime')
-    resp = requests.get(src, timeout=15, stream=True)
-    resp.raise_for_status()
-    return resp.content, resp.headers.get('Content-Type')
+    with stage("fetch"):
+        m = _is_data_url(src)
+        if m:
+            return base64.b64decode(m.group('data')), m.group('mime')
+        return media_cache.fetch(src)
+
+
+# ----------------- 轻量探测（只读容器头，不解码像素） -----------------
+
+def _skip_gif_subblocks(b: bytes, pos: int) -> int:
+    """跳过数据子块序列（以长度 0 的块结束）；数据截断时返回 len(b)"""
+    end = len(b)
+    while pos < end:
+        n = b[pos]
+        pos += 1
+        if n == 0:
+            return pos
+        pos += n
+    return end
+
+
+def _probe_gif(b: bytes) -> ImageProbe:
+    if len(b) < 13:
+        raise ValueError("truncated GIF header")
+    w, h = struct.unpack_from("<HH", b, 6)
+    flags = b[10]
+    pos = 13
+    if flags & 0x80:
+        pos += 3 * (2 << (flags & 7))
+    frames = 0
+    while pos < len(b):
+        c = b[pos]
+        if c == 0x2C:  # Image Descriptor
+            frames += 1
+            if frames > 1:
+                return ImageProbe(True, (w, h))
+            if pos + 10 > len(b):
+                break  # 截断：只读到半个图像描述符
+            lflags = b[pos + 9]
+            pos += 10
+            if lflags & 0x80:
+                pos += 3 * (2 << (lflags & 7))
+            pos = _skip_gif_subblocks(b, pos + 1)  # +1 跳过 LZW 最小码长
+        elif c == 0x21:  # Extension
+            pos = _skip_gif_subblocks(b, pos + 2)
+        else:  # 0x3B Trailer 或损坏
+            break
+    return ImageProbe(False, (w, h))
+
+
+def _probe_png(b: bytes) -> ImageProbe:
+    if len(b) < 24 or b[12:16] != b"IHDR":
+        raise ValueError("IHDR must be the first PNG chunk")
+    w, h = struct.unpack_from(">II", b, 16)
+    pos = 8
+    while pos + 8 <= len(b):
+        length, ctype = struct.unpack_from(">I4s", b, pos)
+        if ctype == b"acTL":
+            if pos + 12 > len(b):
+                break  # 截断的 acTL：按静态图处理
+            num_frames = struct.unpack_from(">I", b, pos + 8)[0]
+            return ImageProbe(num_frames > 1, (w, h))
+        if ctype in (b"IDAT", b"IEND"):
+            break  # acTL 必须出现在 IDAT 之前
+        pos += 12 + length
+    return ImageProbe(False, (w, h))
+
+
+def _probe_webp(b: bytes) -> ImageProbe:
+    ctype = b[12:16]
+    if ctype == b"VP8X":
+        if len(b) < 30:
+            raise ValueError("truncated VP8X chunk")
+        animated = bool(b[20] & 0x02)
+        w = 1 + int.from_bytes(b[24:27], "little")
+        h = 1 + int.from_bytes(b[27:30], "little")
+        return ImageProbe(animated, (w, h))
+    if ctype == b"VP8 ":
+        if len(b) < 30 or b[23:26] != b"\x9d\x01\x2a":
+            raise ValueError("bad VP8 key frame header")
+        w, h = struct.unpack_from("<HH", b, 26)
+        return ImageProbe(False, (w & 0x3FFF, h & 0x3FFF))
+    if ctype == b"VP8L":
+        if len(b) < 25 or b[20] != 0x2F:
+            raise ValueError("bad VP8L signature")
+        bits = int.from_bytes(b[21:25], "little")
+        return ImageProbe(False, ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1))
+    raise ValueError("unknown WebP chunk")
+
+
+def _probe_with_pillow(content: bytes) -> ImageProbe:
+    im = Image.open(io.BytesIO(content))  # 惰性打开，只解析头部
+    w, h = im.size
+    # 浏览器会按 EXIF Orientation 旋转 JPEG，5~8 时宽高互换
+    try:
+        if im.getexif().get(0x0112) in (5, 6, 7, 8):
+            w, h = h, w
+    except Exception:
+        pass
+    return ImageProbe(bool(getattr(im, "is_animated", False)), (w, h))
+
+
+def probe_image(content: bytes) -> ImageProbe:
+    """
+    只读容器头判断动/静与尺寸：
+    - GIF：遍历块结构数 Image Descriptor（跳过 LZW 数据，不解码）
+    - PNG：IDAT 之前是否有 acTL 且帧数 > 1
+    - WebP：VP8X 的 ANIM 标志位
+    截断在头部之后的数据按已读到的部分判断；头部本身不完整、首个 chunk 不合规或格式未知时退回 Pillow 惰性打开
+    """
+    try:
+        if content[:6] in (b"GIF87a", b"GIF89a"):
+            return _probe_gif(content)
+        if content[:8] == b"\x89PNG\r\n\x1a\n":
+            return _probe_png(content)
+        if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+            return _probe_webp(content)
+    except (IndexError, struct.error, ValueError):
+        pass
+    return _probe_with_pillow(content)
+
+
+def fetch_and_probe(src: str) -> Tuple[bytes, ImageProbe]:
+    content, _ = _fetch_bytes_and_mime(src)
+    return content, probe_image(content)
+
+
+def display_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    """原始尺寸 -> 模板中的实际渲染尺寸"""
+    return _cap_size_to_css(*size)
 
 
 def _load_pillow_image(content: bytes) -> Image.Image:
     return Image.open(io.BytesIO(content))
 
 
-def _extract_frames(im: Image.Image) -> Tuple[List[Image.Image], List[int]]:
+def _iter_source_frames(im: Image.Image) -> Iterator[Tuple[Image.Image, int]]:
     """
     通用动图解析：GIF / APNG / WebP / ...
-    返回：RGBA 帧列表 + 每帧时长（毫秒）
+    逐帧产出 (RGBA 帧, 时长毫秒)，不在内存中保留整段原始帧
     """
-    frames: List[Image.Image] = []
-    durs_ms: List[int] = []
-    if getattr(im, "is_animated", False):
-        for f in ImageSequence.Iterator(im):
-            fr = f.convert("RGBA")
-            dur = int(f.info.get("duration", 100))
-            if dur < 10:
-                dur = 10
-            frames.append(fr)
-            durs_ms.append(dur)
-        # 有些动图的最后一帧 dur 可能为 0，已在上面兜底
-    else:
-        frames = [im.convert("RGBA")]
-        durs_ms = [1000]
-    return frames, durs_ms
+    if not getattr(im, "is_animated", False):
+        yield im.convert("RGBA"), 1000
+        return
+    for f in ImageSequence.Iterator(im):
+        dur = int(f.info.get("duration", 100))
+        # 有些动图的最后一帧 dur 可能为 0，在此兜底
+        yield f.convert("RGBA"), max(dur, 10)
+
+
+def _frame_budget(n_frames: int, size: Tuple[int, int]) -> int:
+    """单个资产允许保留的帧数（帧数上限与解码字节上限取小）"""
+    w, h = size
+    by_bytes = (Config.ASSET_MAX_DECODED_MB * 1024 * 1024) // max(1, w * h * 4)
+    return max(1, min(n_frames, Config.ASSET_MAX_FRAMES, by_bytes))
 
 
 def _cap_size_to_css(orig_w: int, orig_h: int) -> Tuple[int, int]:
@@ -104,42 +260,78 @@ def _lcm_list(vals: List[int]) -> int:
 
 # ----------------- 资产准备 -----------------
 
-def prepare_animated_asset(src: str, placeholder_id: str, border_radius_px: int) -> AnimatedAsset:
+def _decode_frame_stack(im: Image.Image, size: Tuple[int, int], border_radius_px: int,
+                        keep: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    单遍流式解码：逐帧 解码 -> 缩放 -> 圆角 -> 写入预分配的 (keep, h, w, 4) 数组。
+    源帧数超过 keep 时均匀跳帧，被跳过帧的时长并入前一保留帧（总时长不变）
+    """
+    n = max(1, getattr(im, "n_frames", 1))
+    keep = min(keep, n)
+    dw, dh = size
+    mask = _round_mask((dw, dh), border_radius_px)
+    pixels = np.empty((keep, dh, dw, 4), dtype=np.uint8)
+    durs = np.zeros(keep, dtype=np.int32)
+    slot = -1
+    for j, (fr, dur) in enumerate(_iter_source_frames(im)):
+        target = j * keep // n
+        if target >= keep:
+            break  # n_frames 少报时的保护
+        if target != slot:
+            slot = target
+            if fr.size != (dw, dh):
+                fr = fr.resize((dw, dh), resample=Image.LANCZOS)
+            rounded = Image.new("RGBA", (dw, dh))
+            rounded.paste(fr, (0, 0), mask)
+            pixels[slot] = np.asarray(rounded)
+        durs[slot] += dur
+    if slot + 1 < keep:  # n_frames 多报：截掉未填充的槽位
+        pixels, durs = pixels[:slot + 1], durs[:slot + 1]
+    return pixels, durs
+
+
+def prepare_animated_asset(src: str, placeholder_id: str, border_radius_px: int,
+                           content: Optional[bytes] = None) -> AnimatedAsset:
     """
     下载并解析图片（GIF/APNG/WebP/静态）：
     - 统一用 Pillow 提取帧与时长
     - 缩放 + 圆角一次性完成，减少合成时开销
     - 时长以 Fraction(秒) 表示，先做适度分母约束，后续再用“全局分母 G”统一量化
+    - 已由 fetch_and_probe 取得内容时可直接传入 content，避免重复下载
+    - 解码结果按 (内容哈希, 渲染尺寸, 圆角, 帧数预算) 缓存，热门表情不再重复解码
+    - 帧数超出 ASSET_MAX_FRAMES / ASSET_MAX_DECODED_MB 时均匀跳帧
     """
-    content, _ = _fetch_bytes_and_mime(src)
-    im = _load_pillow_image(content)
-    frames, durs_ms = _extract_frames(im)
-
-    # 渲染尺寸
-    ow, oh = frames[0].size
-    dw, dh = _cap_size_to_css(ow, oh)
-    mask = _round_mask((dw, dh), border_radius_px)
-
-    # 缩放+圆角
-    scaled: List[Image.Image] = []
-    for fr in frames:
-        if fr.size != (dw, dh):
-            fr = fr.resize((dw, dh), resample=Image.LANCZOS)
-        rounded = Image.new("RGBA", (dw, dh))
-        rounded.paste(fr, (0, 0), mask)
-        scaled.append(rounded)
+    if content is None:
+        content, _ = _fetch_bytes_and_mime(src)
+    content_hash = hashlib.sha1(content).hexdigest()
+    im = _load_pillow_image(content)  # 只读文件头，像素在解码时才读取
+
+    # 渲染尺寸与帧数预算
+    dw, dh = _cap_size_to_css(*im.size)
+    keep = _frame_budget(max(1, getattr(im, "n_frames", 1)), (dw, dh))
+
+    key = decoded_asset_key(content_hash, (dw, dh), border_radius_px, keep)
+    cached = asset_cache.get(key) if asset_cache is not None else None
+    if cached is not None:
+        pixels, durs_ms = cached
+    else:
+        with stage("decode"):
+            pixels, durs_ms = _decode_frame_stack(im, (dw, dh), border_radius_px, keep)
+        if asset_cache is not None:
+            pixels, durs_ms = asset_cache.put(key, pixels, durs_ms)
 
     # 转 Fraction 秒，并限制分母（防止分母爆炸）
-    durs_frac = [Fraction(ms, 1000).limit_denominator(Config.APNG_MAX_DEN) for ms in durs_ms]
+    durs_frac = [Fraction(int(ms), 1000).limit_denominator(Config.APNG_MAX_DEN) for ms in durs_ms]
 
     # cum_ticks & period_ticks 先占位，稍后由全局 G 统一计算（此处用空值）
     return AnimatedAsset(
         placeholder_id=placeholder_id,
         display_size=(dw, dh),
-        frames_rgba=scaled,
+        frames_rgba=FrameStack(pixels),
         durations_frac=durs_frac,
         cum_ticks=[],
-        period_ticks=0
+        period_ticks=0,
+        content_hash=content_hash,
     )
 
 
@@ -175,37 +367,6 @@ def _fill_ticks_with_G(assets: List[AnimatedAsset], G: int) -> None:
         a.period_ticks = cum[-1] if cum else 0
 
 
-def _build_event_ticks(assets: List[AnimatedAsset], T_ticks: int) -> List[int]:
-    """收集 [0, T_ticks] 内所有资产换帧时刻（tick）并集 + 排序 + 去重 + 限幅"""
-    events = set([0, T_ticks])
-    for a in assets:
-        if a.period_ticks <= 0:
-            continue
-        single = [0] + a.cum_ticks
-        rep = max(1, T_ticks // a.period_ticks)
-        for r in range(rep):
-            base = r * a.period_ticks
-            for e in single:
-                t = base + e
-                if 0 < t < T_ticks:
-                    events.add(t)
-    out = sorted(events)
-    if len(out) > Config.TIMELINE_MAX_EVENTS:
-        keep = set([0, T_ticks])
-        step = max(1, len(out) // (Config.TIMELINE_MAX_EVENTS - 2))
-        for i in range(1, len(out) - 1, step):
-            keep.add(out[i])
-        out = sorted(keep)
-    return out
-
-
-def _images_equal(a: Image.Image, b: Image.Image) -> bool:
-    if a.size != b.size:
-        return False
-    diff = ImageChops.difference(a, b)
-    return diff.getbbox() is None
-
-
 def _rationalize_delay(frac_sec: Fraction) -> Tuple[int, int]:
     """
     将时长（秒，Fraction）转换为 (num, den)：
@@ -234,135 +395,378 @@ def _gif_quantize_delays_ms(durations: List[Fraction]) -> List[int]:
     return out
 
 
+def _ms_grid_delays(durations: List[Fraction]) -> List[int]:
+    """
+    WebP/AVIF：毫秒整数时长。按累计时刻取整再做差，每帧的起始时刻误差 < 0.5ms 且不随帧数累积
+    （逐帧取整在 33.3ms 这类时长上会持续漂移）；区间不足 1ms 的帧得到 0，由编码器丢弃
+    """
+    out, cum, prev = [], Fraction(0), 0
+    for d in durations:
+        cum += d
+        t = int(round(cum * 1000))
+        out.append(t - prev)
+        prev = t
+    return out
+
+
+# ----------------- 脏矩形合成器（NumPy） -----------------
+
+def _frame_index_at(a: AnimatedAsset, t: int) -> int:
+    """t（ticks）时刻资产所处的帧索引（单轮内二分查找）"""
+    if a.period_ticks <= 0:
+        return 0
+    j = bisect_right(a.cum_ticks, t % a.period_ticks)
+    return j if j < len(a.cum_ticks) else 0
+
+
+def _rects_overlap(r1: Tuple[int, int, int, int], r2: Tuple[int, int, int, int]) -> bool:
+    return r1[0] < r2[2] and r2[0] < r1[2] and r1[1] < r2[3] and r2[1] < r1[3]
+
+
+class _TileCompositor:
+    """
+    画布常驻为 (H, W, 4) uint8 数组，每个事件只覆写换帧资产所在的矩形：
+    - 补丁 = 底图裁剪 + 按原顺序 alpha_composite 该组资产的当前帧，与整图合成逐字节一致
+    - 补丁按 (组, 帧索引组合) 记忆化，循环播放时不再重复合成；占位尺寸与资产帧不同（画布被缩小等）时
+      缩放后的资产帧也记忆化。两者共用一个 LRU，总字节数受 patch_budget 限制
+    - 互相重叠的资产归为一组，组内任一换帧时整组外接矩形一起重算
+    """
+
+    def __init__(self, base: Image.Image, placements: Dict[str, Tuple[int, int, int, int]],
+                 assets: List[AnimatedAsset], patch_budget: Optional[int] = None):
+        self.base = base
+        self.patch_budget = patch_budget
+        self.canvas = np.array(base)
+        H, W = self.canvas.shape[:2]
+        self.assets: List[AnimatedAsset] = []
+        self.boxes: List[Tuple[int, int, int, int]] = []
+        clips: List[Tuple[int, int, int, int]] = []
+        for a in assets:
+            if a.placeholder_id not in placements:
+                continue
+            x, y, w, h = placements[a.placeholder_id]
+            clip = (max(0, x), max(0, y), min(W, x + w), min(H, y + h))
+            if clip[0] >= clip[2] or clip[1] >= clip[3]:
+                continue  # 完全在画布外
+            self.assets.append(a)
+            self.boxes.append((x, y, w, h))
+            clips.append(clip)
+
+        # 重叠资产并查集分组（组内保持原合成顺序）
+        parent = list(range(len(clips)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i in range(len(clips)):
+            for j in range(i + 1, len(clips)):
+                if _rects_overlap(clips[i], clips[j]):
+                    parent[find(i)] = find(j)
+        members: Dict[int, List[int]] = {}
+        for i in range(len(clips)):
+            members.setdefault(find(i), []).append(i)
+        self.groups: List[List[int]] = list(members.values())
+        self.group_rects = []
+        for g in self.groups:
+            self.group_rects.append((
+                min(clips[k][0] for k in g), min(clips[k][1] for k in g),
+                max(clips[k][2] for k in g), max(clips[k][3] for k in g),
+            ))
+        self._state: List[Optional[Tuple[int, ...]]] = [None] * len(self.groups)
+        # ("patch", 组, 帧索引组合) -> 补丁数组；("frame", 资产, 帧索引) -> 缩放后的资产帧
+        self._cache: "OrderedDict[tuple, Tuple[object, int]]" = OrderedDict()
+        self._cache_bytes = 0
+
+    def _cached(self, key: tuple):
+        hit = self._cache.get(key)
+        if hit is None:
+            return None
+        self._cache.move_to_end(key)
+        return hit[0]
+
+    def _remember(self, key: tuple, value, nbytes: int) -> None:
+        if self.patch_budget is not None and nbytes > self.patch_budget:
+            return
+        self._cache[key] = (value, nbytes)
+        self._cache_bytes += nbytes
+        while self.patch_budget is not None and self._cache_bytes > self.patch_budget:
+            _, (_, ev) = self._cache.popitem(last=False)
+            self._cache_bytes -= ev
+
+    def _frame(self, k: int, idx: int) -> Image.Image:
+        fr = self.assets[k].frames_rgba[idx]
+        w, h = self.boxes[k][2], self.boxes[k][3]
+        if fr.size == (w, h):
+            return fr
+        out = self._cached(("frame", k, idx))
+        if out is None:
+            out = fr.resize((w, h), resample=Image.LANCZOS)
+            self._remember(("frame", k, idx), out, w * h * 4)
+        return out
+
+    def _patch(self, gi: int, key: Tuple[int, ...]) -> np.ndarray:
+        cached = self._cached(("patch", gi, key))
+        if cached is not None:
+            return cached
+        rx0, ry0, rx1, ry1 = self.group_rects[gi]
+        region = self.base.crop((rx0, ry0, rx1, ry1))
+        for k, idx in zip(self.groups[gi], key):
+            x, y, _, _ = self.boxes[k]
+            src = (max(0, rx0 - x), max(0, ry0 - y))
+            dst = (max(0, x - rx0), max(0, y - ry0))
+            region.alpha_composite(self._frame(k, idx), dst, src)
+        arr = np.asarray(region)
+        self._remember(("patch", gi, key), arr, arr.nbytes)
+        return arr
+
+    def frame_key(self, t: int) -> Tuple[int, ...]:
+        """t 时刻所有资产的帧索引组合；相同组合即相同画面（替代逐像素比较）"""
+        return tuple(_frame_index_at(a, t) for a in self.assets)
+
+    def _changed_groups(self, state: List[Optional[Tuple[int, ...]]], key: Tuple[int, ...]):
+        """逐个产出相对 state 发生变化的组 (组下标, 组内帧索引)，并就地更新 state"""
+        for gi, g in enumerate(self.groups):
+            gk = tuple(key[k] for k in g)
+            if gk != state[gi]:
+                state[gi] = gk
+                yield gi, gk
+
+    def plan_rects(self, keys: List[Tuple[int, ...]]) -> List[Tuple[int, int, int, int]]:
+        """只凭帧索引组合推算每帧的变化矩形（不触碰像素）；第 0 帧为整张画布"""
+        state: List[Optional[Tuple[int, ...]]] = [None] * len(self.groups)
+        rects = []
+        for i, key in enumerate(keys):
+            dirty = None
+            for gi, _ in self._changed_groups(state, key):
+                rx0, ry0, rx1, ry1 = self.group_rects[gi]
+                if dirty is None:
+                    dirty = (rx0, ry0, rx1, ry1)
+                else:
+                    dirty = (min(dirty[0], rx0), min(dirty[1], ry0), max(dirty[2], rx1), max(dirty[3], ry1))
+            rects.append(self.full_rect() if i == 0 or dirty is None else dirty)
+        return rects
+
+    def update(self, key: Tuple[int, ...]) -> Optional[Tuple[int, int, int, int]]:
+        """写入换帧资产的补丁，返回本次变化区域的外接矩形 (x0, y0, x1, y1)，无变化返回 None"""
+        dirty = None
+        for gi, gk in self._changed_groups(self._state, key):
+            rx0, ry0, rx1, ry1 = self.group_rects[gi]
+            self.canvas[ry0:ry1, rx0:rx1] = self._patch(gi, gk)
+            if dirty is None:
+                dirty = (rx0, ry0, rx1, ry1)
+            else:
+                dirty = (min(dirty[0], rx0), min(dirty[1], ry0), max(dirty[2], rx1), max(dirty[3], ry1))
+        return dirty
+
+    def full_rect(self) -> Tuple[int, int, int, int]:
+        return (0, 0, self.canvas.shape[1], self.canvas.shape[0])
+
+    def snapshot(self, rect: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        if rect is None:
+            return Image.fromarray(self.canvas.copy(), "RGBA")
+        x0, y0, x1, y1 = rect
+        return Image.fromarray(self.canvas[y0:y1, x0:x1].copy(), "RGBA")
+
+
 # ----------------- 合成（事件驱动 & 面向格式） -----------------
 
-def compose_animation_event_driven(
+def _fit_canvas(
+    base: Image.Image,
+    placements: Dict[str, Tuple[int, int, int, int]],
+    assets: List[AnimatedAsset],
+) -> Tuple[Image.Image, Dict[str, Tuple[int, int, int, int]], int]:
+    """
+    内存护栏（输出侧）：已解码帧之外的预算留给画布（底图 + 画布数组 + 快照，约 12 B/px）与补丁/缩放帧缓存；
+    画布超出 ANIM_MAX_CANVAS_PIXELS 或预算时整体等比缩小（最小 1/4）。
+    返回 (底图, 占位坐标, 补丁/缩放帧缓存字节预算)
+    """
+    budget = Config.ANIM_MAX_MEMORY_MB * 1024 * 1024
+    asset_bytes = 0
+    for a in assets:
+        stack = getattr(a.frames_rgba, "pixels", None)
+        w, h = a.display_size
+        asset_bytes += stack.nbytes if stack is not None else len(a.frames_rgba) * w * h * 4
+    avail = max(0, budget - asset_bytes)
+    W, H = base.size
+    # 至多一半可用预算给画布，其余给补丁与缩放帧缓存（_TileCompositor 的 LRU）
+    max_px = min(Config.ANIM_MAX_CANVAS_PIXELS, avail // 2 // 12)
+    if W * H > max_px:
+        s = max(0.25, math.sqrt(max_px / float(W * H)))
+        W2, H2 = max(1, int(W * s)), max(1, int(H * s))
+        sx, sy = W2 / float(W), H2 / float(H)
+        base = base.resize((W2, H2), resample=Image.LANCZOS)
+        placements = {
+            k: (int(round(x * sx)), int(round(y * sy)), max(1, int(round(w * sx))), max(1, int(round(h * sy))))
+            for k, (x, y, w, h) in placements.items()
+        }
+        W, H = W2, H2
+    return base, placements, max(0, avail - 12 * W * H)
+
+
+@dataclass
+class _FramePlan:
+    """
+    先只凭帧索引组合规划整条时间线（帧数、变化矩形、时长都已知，APNG 头部需要帧数），
+    像素帧再由 frames() 惰性逐帧产出，编码器消费完即释放
+    """
+    comp: _TileCompositor
+    keys: List[Tuple[int, ...]]
+    rects: List[Tuple[int, int, int, int]]
+    durations: List[Fraction]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.comp.base.size
+
+    def frames(self) -> Iterator[Image.Image]:
+        for key, rect in zip(self.keys, self.rects):
+            self.comp.update(key)
+            yield self.comp.snapshot(rect)
+
+
+def _plan_frames(
+    base: Image.Image,
+    placements: Dict[str, Tuple[int, int, int, int]],
+    assets: List[AnimatedAsset],
+    patch_budget: Optional[int] = None,
+) -> _FramePlan:
+    """按事件时间线规划输出帧（帧索引组合 + 时长），像素留给 _FramePlan.frames 惰性生成"""
+    # 统一刻度：全局分母 G
+    G = _build_global_denominator(assets)
+    _fill_ticks_with_G(assets, G)
+
+    # 时间线：误差最短公共周期 + k 路归并 + 输出帧预算（只针对画布内的资产）
+    comp = _TileCompositor(base, placements, assets, patch_budget=patch_budget)
+    tl = build_timeline(
+        [a.cum_ticks for a in comp.assets],
+        [a.period_ticks for a in comp.assets],
+        max_ticks=int(Config.TIMELINE_MAX_SECONDS * G),
+        tolerance=Config.TIMELINE_MAX_DRIFT,
+        max_frames=Config.TIMELINE_MAX_EVENTS,
+    )
+    keys = tl.keys
+    durations = [Fraction(t, G) for t in tl.ticks]
+    return _FramePlan(comp, keys, comp.plan_rects(keys), durations)
+
+
+def _compose_frames(
+    base: Image.Image,
+    placements: Dict[str, Tuple[int, int, int, int]],
+    assets: List[AnimatedAsset],
+) -> Tuple[List[Image.Image], List[Tuple[int, int, int, int]], List[Fraction]]:
+    """
+    一次性合成全部输出帧，返回 (帧列表, 帧矩形, 每帧时长[秒])（供基准与调试；线上走 _FramePlan.frames 流式）：
+    - 第 0 帧为整张画布
+    - 之后每帧只含相对上一帧变化的外接矩形（子矩形帧，配合 disposal=保留 使用）
+    """
+    plan = _plan_frames(base, placements, assets)
+    return list(plan.frames()), plan.rects, plan.durations
+
+
+def iter_compose_animation(
     base_png: bytes,
     placements: Dict[str, Tuple[int, int, int, int]],   # id -> (x, y, w, h)
     assets: List[AnimatedAsset],
-    fmt: str = "APNG"
-) -> bytes:
+    fmt: str = "APNG",
+    apng_mode: Optional[str] = None,
+    preset: Optional[str] = None,
+) -> Iterator[bytes]:
     """
     事件驱动合成：
     - 全局分母 G 统一时间刻度；T_ticks = lcm(各资源的 period_ticks)
     - 事件点为所有换帧刻度的并集（最小必要帧）
     - 区间时长 = Δticks / G （单位：秒）
+    以字节块形式产出：delta/fast 模式的 APNG 每编码完一帧即产出一块，
+    GIF、apngasm 与 WebP/AVIF 需整体优化，只产出一块。
+    fmt 为 APNG | GIF | WEBP | AVIF；preset 为 WebP/AVIF 的质量/速度预设（ANIM_PRESETS）
     """
-    base = Image.open(io.BytesIO(base_png)).convert("RGBA")
+    apng_mode = apng_mode or Config.APNG_ENCODER
+    level = Config.APNG_FAST_COMPRESS_LEVEL if apng_mode == "fast" else Config.APNG_COMPRESS_LEVEL
+    fmt = fmt.upper()
+    if fmt == "WEBP":
+        preset = preset or Config.WEBP_PRESET
+    elif fmt == "AVIF":
+        preset = preset or Config.AVIF_PRESET
+    base = Image.open(io.BytesIO(base_png))
+    base.load()
+    if base.mode != "RGBA":  # 已是 RGBA 时不再整张复制一份（长图底图可达上百 MB）
+        base = base.convert("RGBA")
 
     # 无动图：单帧输出
     if not assets:
-        if fmt.upper() == "GIF":
+        if fmt in ("WEBP", "AVIF"):
+            with stage("encode"):
+                yield encode_webp_avif(fmt, [base], [1000], preset)
+        elif fmt == "GIF":
             bio = io.BytesIO()
             base.convert("P", palette=Image.ADAPTIVE, colors=Config.GIF_COLORS).save(
                 bio, format="GIF", save_all=True, loop=0, duration=1000, disposal=2
             )
-            return bio.getvalue()
-        # APNG（单帧）
-        with tempfile.TemporaryDirectory() as td:
-            tmp = os.path.join(td, "one.apng")
-            ap = APNGAsmBinder()
-            ap.add_frame_from_pillow(base.convert("RGBA"), delay_num=100, delay_den=1000)
-            ap.set_loops(0)
-            ap.assemble(tmp)
-            return open(tmp, "rb").read()
-
-    # 统一刻度：全局分母 G
-    G = _build_global_denominator(assets)
-    _fill_ticks_with_G(assets, G)
-
-    # 合成周期（ticks）
-    periods = [max(1, a.period_ticks) for a in assets]
-    T_ticks = periods[0]
-    for v in periods[1:]:
-        T_ticks = _lcm(T_ticks, v)
-
-    # 周期秒数（用于护栏）
-    T_sec = T_ticks / float(G)
-    if T_sec > Config.TIMELINE_MAX_SECONDS:
-        T_ticks = int(Config.TIMELINE_MAX_SECONDS * G)
-        T_sec = T_ticks / float(G)
-
-    # 事件集
-    events = _build_event_ticks(assets, T_ticks)
-    if len(events) < 2:
-        events = [0, T_ticks]
-
-    frames: List[Image.Image] = []
-    durations_frac: List[Fraction] = []
-
-    prev_img: Optional[Image.Image] = None
-    for i in range(len(events) - 1):
-        t0 = events[i]
-        t1 = events[i + 1]
-        dt_ticks = t1 - t0
-        if dt_ticks <= 0:
-            continue
-
-        # 区间起点画面
-        canvas = base.copy()
-        for a in assets:
-            pid = a.placeholder_id
-            if pid not in placements:
-                continue
-            x, y, w, h = placements[pid]
-            # 找到 t0 对应的帧索引（单轮）
-            mod = a.period_ticks if a.period_ticks > 0 else 1
-            t_mod = t0 % mod
-            idx = 0
-            for j, c in enumerate(a.cum_ticks):
-                if t_mod < c:
-                    idx = j
-                    break
-            fr = a.frames_rgba[idx]
-            if fr.size != (w, h):
-                fr = fr.resize((w, h), resample=Image.LANCZOS)
-            canvas.alpha_composite(fr, (x, y))
-
-        # 去重：像素一致则累加时长
-        dur_sec = Fraction(dt_ticks, G)
-        if prev_img is not None and _images_equal(prev_img, canvas):
-            durations_frac[-1] += dur_sec
+            yield bio.getvalue()
+        elif apng_mode == "apngasm":
+            yield encode_apng_apngasm([base], [(100, 1000)])
         else:
-            frames.append(canvas)
-            durations_frac.append(dur_sec)
-            prev_img = canvas
-
-    # 输出
-    if fmt.upper() == "GIF":
-        durs_ms = _gif_quantize_delays_ms(durations_frac)
-        first = frames[0].convert("P", palette=Image.ADAPTIVE, colors=Config.GIF_COLORS)
-        rest = [f.convert("P", palette=Image.ADAPTIVE, colors=Config.GIF_COLORS) for f in frames[1:]]
-        bio = io.BytesIO()
-        first.save(
-            bio,
-            format="GIF",
-            save_all=True,
-            append_images=rest,
-            duration=durs_ms,
-            loop=0,
-            disposal=2,
-        )
-        gif_bytes = bio.getvalue()
+            yield from iter_apng_delta([base], [(0, 0) + base.size], [(100, 1000)], base.size, compress_level=level)
+        return
+
+    # 流水线：规划时间线 -> 惰性逐帧合成 -> 增量编码，任一时刻只持有一帧输出像素
+    base, placements, patch_budget = _fit_canvas(base, placements, assets)
+    with stage("timeline"):
+        plan = _plan_frames(base, placements, assets, patch_budget)
+    frames, rects = timed_iter(plan.frames(), "compose"), plan.rects
+    OUTPUT_FRAMES.observe(len(plan.durations), format=fmt.lower())
+
+    # WebP/AVIF：编码器只接受整帧，在子矩形帧上逐帧还原；帧间差分与压缩由 libwebp/libavif 完成
+    if fmt in ("WEBP", "AVIF"):
+        with stage("encode"):
+            out = encode_webp_avif(fmt, expand_delta_frames(frames, rects), _ms_grid_delays(plan.durations), preset)
+        yield out
+        return
+
+    # 输出：子矩形帧，文件体积与编码耗时随动图面积而非整张语录增长
+    if fmt == "GIF":
+        durs_ms = _gif_quantize_delays_ms(plan.durations)
+        with stage("encode"):
+            if Config.GIF_PALETTE == "global":
+                with stage("quantize"):
+                    p_frames, palette = quantize_frames_global(frames, rects, base, placements, assets)
+                p_frames = timed_iter(p_frames, "quantize")
+                gif_bytes = encode_gif_delta(p_frames, rects, durs_ms, base.size, palette=palette)
+            else:
+                gif_bytes = encode_gif_delta(frames, rects, durs_ms, base.size)
 
         # 可选：gifsicle 二次优化（若可用）
         if Config.USE_GIFSICLE and shutil.which("gifsicle"):
             try:
-                p = subprocess.Popen(["gifsicle", "-O3"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                out, _ = p.communicate(gif_bytes, timeout=30)
+                with stage("gifsicle"):
+                    p = subprocess.Popen(["gifsicle", "-O3"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    out, _ = p.communicate(gif_bytes, timeout=30)
                 if p.returncode == 0 and out:
                     gif_bytes = out
             except Exception:
                 pass
-        return gif_bytes
-
-    # APNG（apngasm-python 组装，自动帧优化/压缩）
-    with tempfile.TemporaryDirectory() as td:
-        tmp = os.path.join(td, "out.apng")
-        ap = APNGAsmBinder()
-        ap.set_loops(0)  # 0 = infinite loop
-        for img, d in zip(frames, durations_frac):
-            num, den = _rationalize_delay(d)  # 分数延时
-            ap.add_frame_from_pillow(img.convert("RGBA"), delay_num=num, delay_den=den)
-        ap.assemble(tmp)
-        return open(tmp, "rb").read()
\ No newline at end of file
+        yield gif_bytes
+        return
+
+    delays = [_rationalize_delay(d) for d in plan.durations]  # 分数延时
+    if apng_mode == "apngasm":
+        # apngasm-python 组装（自动帧优化/压缩；只接受整帧）
+        with stage("apngasm"):
+            out = encode_apng_apngasm(expand_delta_frames(frames, rects), delays)
+        yield out
+        return
+    yield from timed_iter(iter_apng_delta(frames, rects, delays, base.size, compress_level=level), "encode")
+
+
+def compose_animation_event_driven(
+    base_png: bytes,
+    placements: Dict[str, Tuple[int, int, int, int]],
+    assets: List[AnimatedAsset],
+    fmt: str = "APNG",
+    apng_mode: Optional[str] = None,
+    preset: Optional[str] = None,
+) -> bytes:
+    return b"".join(iter_compose_animation(base_png, placements, assets, fmt, apng_mode, preset))
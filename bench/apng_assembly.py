@@ -0,0 +1,140 @@
+# bench/apng_assembly.py
+"""
+APNG 组装基准：旧路径（临时目录 + apngasm assemble + 读回文件）vs 内存组装
+（apngasm 写 memfd / 子矩形 delta / fast 低压缩），以及流式输出的首块耗时。
+每种方式在独立子进程中运行，峰值内存 = 编码期间 RSS 采样峰值 - 编码前 RSS。
+
+用法：python bench/apng_assembly.py [--scenario coprime_pair] [--repeat 3]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+os.environ.setdefault("TIMELINE_MAX_SECONDS", "2")
+
+from fixtures import make_assets, make_base_png, layout
+
+SCENARIOS = {
+    "one_sticker": ["sticker_small"],
+    "coprime_pair": ["coprime_a", "coprime_b"],
+    "many_gifs": ["sticker_small", "coprime_a", "coprime_b", "photo_like"],
+}
+MODES = ("legacy_tempfile", "apngasm_memfd", "delta", "fast")
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class _PeakRSS:
+    """后台线程每毫秒采样一次 RSS"""
+
+    def __enter__(self):
+        self.base = _rss_bytes()
+        self.peak = self.base
+        self._stop = threading.Event()
+        self._t = threading.Thread(target=self._run, daemon=True)
+        self._t.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            time.sleep(0.001)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._t.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def _legacy(frames, rects, delays):
+    """user-012 之前 anim.py 中的写法（含未关闭的文件句柄）"""
+    from apngasm_python.apngasm import APNGAsmBinder
+    from encoders import expand_delta_frames
+    with tempfile.TemporaryDirectory() as td:
+        tmp = os.path.join(td, "out.apng")
+        ap = APNGAsmBinder()
+        ap.set_loops(0)
+        for img, (num, den) in zip(expand_delta_frames(frames, rects), delays):
+            ap.add_frame_from_pillow(img.convert("RGBA"), delay_num=num, delay_den=den)
+        ap.assemble(tmp)
+        return [open(tmp, "rb").read()]
+
+
+def _child(scenario: str, mode: str, repeat: int) -> dict:
+    from PIL import Image
+    import anim
+    from encoders import iter_apng_delta, encode_apng_apngasm, expand_delta_frames
+    from utils import Config
+
+    base = Image.open(io.BytesIO(make_base_png((700, 900)))).convert("RGBA")
+    assets = make_assets(SCENARIOS[scenario])
+    frames, rects, durs = anim._compose_frames(base, layout(assets, base.width), assets)
+    delays = [anim._rationalize_delay(d) for d in durs]
+
+    def chunks():
+        if mode == "legacy_tempfile":
+            return iter(_legacy(frames, rects, delays))
+        if mode == "apngasm_memfd":
+            return iter([encode_apng_apngasm(expand_delta_frames(frames, rects), delays)])
+        level = Config.APNG_FAST_COMPRESS_LEVEL if mode == "fast" else Config.APNG_COMPRESS_LEVEL
+        return iter_apng_delta(frames, rects, delays, base.size, compress_level=level)
+
+    samples, ttfb, size, peak = [], [], 0, 0
+    for _ in range(repeat):
+        with _PeakRSS() as m:
+            t0 = time.perf_counter()
+            it = chunks()
+            first = next(it)
+            ttfb.append((time.perf_counter() - t0) * 1000.0)
+            size = len(first) + sum(len(c) for c in it)
+            samples.append((time.perf_counter() - t0) * 1000.0)
+        peak = max(peak, m.peak - m.base)
+    return {
+        "frames": len(frames),
+        "ms": round(min(samples), 1),
+        "first_chunk_ms": round(min(ttfb), 1),
+        "bytes": size,
+        "peak_rss_delta_mb": round(peak / 1048576.0, 1),
+    }
+
+
+def run(names, repeat: int) -> dict:
+    results = {}
+    for name in names:
+        row = {}
+        for mode in MODES:
+            p = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", name, mode, "--repeat", str(repeat)],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            if p.returncode != 0:
+                row[mode] = {"error": p.stderr.strip().splitlines()[-1:]}
+                continue
+            row[mode] = json.loads(p.stdout)
+        results[name] = row
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--child", nargs=2, metavar=("SCENARIO", "MODE"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        print(json.dumps(_child(args.child[0], args.child[1], args.repeat)))
+        return
+    print(json.dumps(run(args.scenario or sorted(SCENARIOS), args.repeat), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench/compositor.py
+"""
+合成器基准：NumPy 脏矩形合成（anim._compose_frames） vs 旧版整图 copy + alpha_composite + 像素 diff。
+同时校验两者输出逐像素一致。
+
+用法：python bench/compositor.py [--repeat 3]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+
+# 旧版会把每个输出帧整图留在内存里，缩短时间线护栏避免基准本身 OOM
+os.environ.setdefault("TIMELINE_MAX_SECONDS", "2")
+
+from fixtures import make_assets, make_base_png, layout
+
+from PIL import Image, ImageChops  # noqa: E402
+import anim  # noqa: E402
+from encoders import expand_delta_frames  # noqa: E402
+
+SCENARIOS = {
+    "one_sticker": ["sticker_small"],
+    "coprime_pair": ["coprime_a", "coprime_b"],
+    "many_gifs": ["sticker_small", "coprime_a", "coprime_b", "photo_like"],
+}
+
+
+def _legacy_compose_frames(base, placements, assets):
+    """
+    旧版逐事件整图合成（仅作对照）。
+    注意：旧版 _images_equal 对 RGBA 差值图调用 getbbox()，只看 alpha 通道，
+    底图不透明时任何两帧都被判为“相同”；此处用 alpha_only=False 还原其本意。
+    """
+    # 时间线与新版共用（时间线本身的对比见 bench/loop_timeline.py），这里只比较合成
+    plan = anim._plan_frames(base, placements, assets)
+    boxes = {a.placeholder_id: placements[a.placeholder_id] for a in plan.comp.assets}
+    frames, durs, prev = [], [], None
+    for key, d in zip(plan.keys, plan.durations):
+        canvas = base.copy()
+        for a, idx in zip(plan.comp.assets, key):
+            x, y, w, h = boxes[a.placeholder_id]
+            fr = a.frames_rgba[idx]
+            if fr.size != (w, h):
+                fr = fr.resize((w, h), resample=Image.LANCZOS)
+            canvas.alpha_composite(fr, (x, y))
+        if prev is not None and ImageChops.difference(prev, canvas).getbbox(alpha_only=False) is None:
+            durs[-1] += d
+        else:
+            frames.append(canvas)
+            durs.append(d)
+            prev = canvas
+    return frames, durs
+
+
+def _best_of(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = (time.perf_counter() - t0) * 1000.0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def run(repeat: int) -> dict:
+    base = Image.open(io.BytesIO(make_base_png((700, 900)))).convert("RGBA")
+    results = {}
+    for name, specs in SCENARIOS.items():
+        assets = make_assets(specs)
+        placements = layout(assets, base.width)
+        legacy_ms, (lf, ld) = _best_of(lambda: _legacy_compose_frames(base, placements, assets), repeat)
+        new_ms, (nf, nr, nd) = _best_of(lambda: anim._compose_frames(base, placements, assets), repeat)
+        nf = list(expand_delta_frames(nf, nr))
+        # 按时间展开比较：两边每个时刻的画面应一致
+        identical = _timeline_equal(lf, ld, nf, nd)
+        results[name] = {
+            "frames_legacy": len(lf),
+            "frames_new": len(nf),
+            "legacy_ms": round(legacy_ms, 1),
+            "new_ms": round(new_ms, 1),
+            "speedup": round(legacy_ms / new_ms, 2) if new_ms else None,
+            "pixel_identical": identical,
+        }
+    return results
+
+
+def _timeline_equal(lf, ld, nf, nd) -> bool:
+    if sum(ld) != sum(nd):
+        return False
+    i = j = 0
+    ti, tj = ld[0], nd[0]
+    while True:
+        if lf[i].tobytes() != nf[j].tobytes():
+            return False
+        if ti == tj:
+            i, j = i + 1, j + 1
+            if i == len(lf) or j == len(nf):
+                return i == len(lf) and j == len(nf)
+            ti, tj = ti + ld[i], tj + nd[j]
+        elif ti < tj:
+            i += 1
+            ti += ld[i]
+        else:
+            j += 1
+            tj += nd[j]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# bench/delta_encode.py
+"""
+动图编码基准：整帧编码（旧版：Pillow GIF disposal=2 / apngasm）vs 子矩形帧编码（encoders.py），
+可选对比 gifsicle -O3 二次优化（需本机安装 gifsicle，否则对应项为 null）。
+
+用法：python bench/delta_encode.py [--scenario coprime_pair]
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+os.environ.setdefault("TIMELINE_MAX_SECONDS", "2")
+
+from fixtures import make_assets, make_base_png, layout
+
+from PIL import Image  # noqa: E402
+import anim  # noqa: E402
+from encoders import encode_apng_delta, encode_gif_delta, expand_delta_frames  # noqa: E402
+from utils import Config  # noqa: E402
+
+SCENARIOS = {
+    "one_sticker": ["sticker_small"],
+    "coprime_pair": ["coprime_a", "coprime_b"],
+    "many_gifs": ["sticker_small", "coprime_a", "coprime_b", "photo_like"],
+}
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, round((time.perf_counter() - t0) * 1000.0, 1)
+
+
+def _gifsicle(data: bytes):
+    if not shutil.which("gifsicle"):
+        return None, None
+    t0 = time.perf_counter()
+    p = subprocess.run(["gifsicle", "-O3"], input=data, capture_output=True, timeout=120)
+    return (p.stdout if p.returncode == 0 else None), round((time.perf_counter() - t0) * 1000.0, 1)
+
+
+def _full_gif(full_frames, durs_ms):
+    qs = [f.convert("P", palette=Image.ADAPTIVE, colors=Config.GIF_COLORS) for f in full_frames]
+    bio = io.BytesIO()
+    qs[0].save(bio, format="GIF", save_all=True, append_images=qs[1:], duration=durs_ms, loop=0, disposal=2)
+    return bio.getvalue()
+
+
+def _full_apngasm(full_frames, delays):
+    from apngasm_python.apngasm import APNGAsmBinder
+    with tempfile.TemporaryDirectory() as td:
+        tmp = os.path.join(td, "out.apng")
+        ap = APNGAsmBinder()
+        ap.set_loops(0)
+        for img, (num, den) in zip(full_frames, delays):
+            ap.add_frame_from_pillow(img.convert("RGBA"), delay_num=num, delay_den=den)
+        ap.assemble(tmp)
+        with open(tmp, "rb") as f:
+            return f.read()
+
+
+def run(names) -> dict:
+    base = Image.open(io.BytesIO(make_base_png((700, 900)))).convert("RGBA")
+    results = {}
+    for name in names:
+        assets = make_assets(SCENARIOS[name])
+        placements = layout(assets, base.width)
+        frames, rects, durs = anim._compose_frames(base, placements, assets)
+        full = list(expand_delta_frames(frames, rects))
+        durs_ms = anim._gif_quantize_delays_ms(durs)
+        delays = [anim._rationalize_delay(d) for d in durs]
+        row = {"frames": len(frames), "animated_area_pct": round(
+            100.0 * sum((r[2] - r[0]) * (r[3] - r[1]) for r in rects[1:]) / max(1, (len(rects) - 1) * base.width * base.height), 2)}
+
+        gif_full, row["gif_full_ms"] = _timed(lambda: _full_gif(full, durs_ms))
+        gif_delta, row["gif_delta_ms"] = _timed(lambda: encode_gif_delta(frames, rects, durs_ms, base.size))
+        row["gif_full_bytes"], row["gif_delta_bytes"] = len(gif_full), len(gif_delta)
+        for label, data in (("gif_full", gif_full), ("gif_delta", gif_delta)):
+            opt, ms = _gifsicle(data)
+            row[f"{label}_gifsicle_bytes"] = len(opt) if opt else None
+            row[f"{label}_gifsicle_ms"] = ms
+
+        apng_full, row["apngasm_full_ms"] = _timed(lambda: _full_apngasm(full, delays))
+        apng_delta, row["apng_delta_ms"] = _timed(lambda: encode_apng_delta(frames, rects, delays, base.size))
+        row["apngasm_full_bytes"], row["apng_delta_bytes"] = len(apng_full), len(apng_delta)
+        results[name] = row
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    args = ap.parse_args()
+    print(json.dumps(run(args.scenario or list(SCENARIOS)), indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# bench/fake_browser.py
+"""
+离线浏览器替身：与 screenshot.Screenshot / ScreenshotPool 同接口，不启动 Firefox。
+- 截图为按内容尺寸缓存的固定 PNG（由 fixtures.make_base_png 生成），占位坐标按模板里的
+  data-anim-id 与宽高从上到下排布，足以驱动真实的合成/编码路径
+- 池语义保留：WORKER_POOL_SIZE 个槽位、获取超时抛 TimeoutError，排队与背压行为与线上一致
+- 可选模拟浏览器耗时（latency_ms 按 navigate/images/capture 约 5:3:2 切分并写入 timings 与阶段指标）
+- navigate 模式经 Flask test client 回访 /quote/?id=...，走真实的模板与共享 payload 存储
+
+须在 import main 之前调用 install()
+"""
+import os
+import re
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from utils import Config  # noqa: E402
+from metrics import record  # noqa: E402
+from fixtures import make_base_png  # noqa: E402
+
+_PLACEHOLDER_RE = re.compile(r'data-anim-id="([^"]+)"\s+style="width:\s*(\d+)px;\s*height:\s*(\d+)px')
+
+CANVAS_W = 900
+DIALOG_H = 120  # 每条消息的大致高度（不含动图）
+
+
+@lru_cache(maxsize=64)
+def _canned_png(w: int, h: int) -> bytes:
+    return make_base_png((w, h))
+
+
+def _layout(html: str):
+    """返回 (画布尺寸, 占位坐标)：动图按行排布在气泡内，画布高度随消息数与动图增长"""
+    dialogs = max(1, html.count('class="dialog"'))
+    boxes: Dict[str, tuple] = {}
+    x, y, row_h = 160, 70, 0
+    for pid, w, h in _PLACEHOLDER_RE.findall(html):
+        w, h = int(w), int(h)
+        if x + w > CANVAS_W - 30:
+            x, y, row_h = 160, y + row_h + 20, 0
+        boxes[pid] = (x, y, w, h)
+        x += w + 20
+        row_h = max(row_h, h)
+    height = max(dialogs * DIALOG_H, y + row_h + 40)
+    # 高度按 64px 取整，canned PNG 才能被复用
+    return (CANVAS_W, (height + 63) // 64 * 64), boxes
+
+
+class FakeScreenshotPool:
+    def __init__(self, size: int = None, min_size: int = None, warmup: int = None,
+                 on_milestone: Optional[Callable[[str], None]] = None, latency_ms: float = None):
+        self.max_size = max(1, size if size is not None else Config.WORKER_POOL_SIZE)
+        self.min_size = self.max_size
+        self.on_milestone = on_milestone
+        self.created = time.monotonic()
+        self.first_render_ms = None
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.environ.get("BENCH_BROWSER_MS") or 0)
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.renders = 0
+
+    @contextmanager
+    def lease(self, timeout=Config.WORKER_ACQUIRE_TIMEOUT_SEC):
+        t0 = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        ok = self._slots.acquire(timeout=timeout)
+        waited = time.monotonic() - t0
+        record("acquire", waited)
+        with self._lock:
+            self._waiting -= 1
+            if not ok:
+                self.timeouts += 1
+            else:
+                self._busy += 1
+                self.acquired += 1
+                self.wait_ms_total += waited * 1000.0
+                self.wait_ms_max = max(self.wait_ms_max, waited * 1000.0)
+        if not ok:
+            raise TimeoutError("No free browser worker")
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self.renders += 1
+                first = self.renders == 1
+                if first:
+                    self.first_render_ms = round((time.monotonic() - self.created) * 1000.0, 1)
+            self._slots.release()
+            if first and self.on_milestone is not None:
+                self.on_milestone("render")
+
+    def _load(self, unique_id: Optional[str], html: Optional[str], timings: dict) -> str:
+        if html is None:
+            import main
+            html = main.app.test_client().get(f"/quote/?id={unique_id}").get_data(as_text=True)
+        for stage, share in (("navigate", 0.5), ("images", 0.3)):
+            if self.latency_ms > 0:
+                time.sleep(self.latency_ms * share / 1000.0)
+            timings[f"{stage}_ms"] = self.latency_ms * share
+            record(stage, self.latency_ms * share / 1000.0)
+        timings["layout_ms"] = 0.0
+        return html
+
+    def _capture(self, html: str, timings: dict):
+        t0 = time.perf_counter()
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms * 0.2 / 1000.0)
+        size, boxes = _layout(html)
+        png = _canned_png(*size)
+        timings["capture_ms"] = (time.perf_counter() - t0) * 1000.0
+        record("capture", timings["capture_ms"] / 1000.0)
+        return png, boxes
+
+    def render_with_boxes(self, unique_id: str = None, html: str = None, timings=None, acquire_timeout=None):
+        timings = {} if timings is None else timings
+        with self.lease(acquire_timeout or Config.WORKER_ACQUIRE_TIMEOUT_SEC):
+            return self._capture(self._load(unique_id, html, timings), timings)
+
+    def render_batch(self, htmls: List[str], timings=None) -> list:
+        timings = {} if timings is None else timings
+        with self.lease():
+            self._load(None, "".join(htmls), timings)
+            return [self._capture(h, {}) for h in htmls]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "total": self.max_size,
+                "busy": self._busy,
+                "idle": self.max_size - self._busy,
+                "starting": 0,
+                "queue_depth": self._waiting,
+                "acquired": self.acquired,
+                "wait_ms_avg": round(self.wait_ms_total / self.acquired, 2) if self.acquired else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 2),
+                "timeouts": self.timeouts,
+                "recycled": 0,
+                "replaced": 0,
+                "spawn_failures": 0,
+                "warmup": self.max_size,
+                "ready": True,
+                "first_browser_ms": 0.0,
+                "first_render_ms": self.first_render_ms,
+                "workers": [],
+            }
+
+    def shutdown(self) -> None:
+        pass
+
+
+    def ready(self) -> bool:
+        return True
+
+
+class FakeScreenshot:
+    def __init__(self, on_milestone: Optional[Callable[[str], None]] = None):
+        self.pool = FakeScreenshotPool(Config.WORKER_POOL_SIZE, Config.WORKER_POOL_MIN, on_milestone=on_milestone)
+        if on_milestone is not None:
+            on_milestone("browser")  # 替身无需启动，构造即就绪
+
+    def screenshot(self, ret_type, unique_id=None, html=None, timings=None, acquire_timeout=None):
+        png, _ = self.pool.render_with_boxes(unique_id, html, timings, acquire_timeout)
+        if ret_type == "base64":
+            import base64
+            return base64.b64encode(png).decode("ascii")
+        return png
+
+
+def install() -> None:
+    """把 screenshot 模块里的真实实现替换为替身（须在 import main 之前）"""
+    if "main" in sys.modules:
+        raise RuntimeError("install() must run before main is imported")
+    import screenshot
+    screenshot.Screenshot = FakeScreenshot
+    screenshot.ScreenshotPool = FakeScreenshotPool
+
+
+def firefox_available() -> bool:
+    """本机是否可启动真实的无头 Firefox（需 firefox 与 geckodriver）"""
+    import shutil
+    return bool(shutil.which("firefox")) and bool(Config.GECKODRIVER_PATH or shutil.which("geckodriver"))
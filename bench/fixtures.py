@@ -0,0 +1,102 @@
+# bench/fixtures.py
+"""
+离线基准用的合成素材：带“别扭”帧时长的动图、类聊天截图底图、占位坐标。
+全部由固定随机种子生成，保证不同提交之间可比。
+"""
+import io
+import os
+import sys
+import base64
+import zlib
+import random
+from typing import List, Tuple, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+# (名称, 尺寸, 每帧时长 ms)：互质/不整齐的时长会让 LCM 与事件数变大
+ANIMATION_SPECS = {
+    "sticker_small": ((120, 120), [70] * 12),
+    "coprime_a": ((240, 180), [30, 70, 110, 130, 170]),
+    "coprime_b": ((200, 200), [40, 90, 60, 20, 130, 50, 80]),
+    "photo_like": ((480, 360), [100] * 24),
+    "long_gif": ((320, 240), [40] * 120),
+    "very_long_gif": ((480, 360), [30] * 300),
+    "ntsc_30fps": ((160, 160), [33, 33, 34] * 10),      # 1/30 s 不是整毫秒；存为 APNG 时保留原值
+    "zero_delays": ((128, 128), [0, 0, 100, 0, 50]),    # 0 时长帧（浏览器/解码器各自兜底）
+}
+
+
+def _frame(size: Tuple[int, int], i: int, n: int, rng: random.Random) -> Image.Image:
+    w, h = size
+    im = Image.new("RGBA", size, (250, 250, 250, 255))
+    d = ImageDraw.Draw(im)
+    # 渐变背景 + 移动的色块，近似表情包/照片的颜色分布
+    for yy in range(0, h, 4):
+        c = int(255 * yy / h)
+        d.rectangle((0, yy, w, yy + 4), fill=(c, (c + i * 20) % 256, 255 - c, 255))
+    cx = int((w - 40) * i / max(1, n - 1))
+    d.ellipse((cx, h // 3, cx + 40, h // 3 + 40), fill=(rng.randrange(256), 40, 40, 255))
+    d.text((8, 8), f"{i}", fill=(0, 0, 0, 255))
+    return im
+
+
+def make_animation_bytes(name: str, fmt: str = "GIF") -> bytes:
+    size, durs = ANIMATION_SPECS[name]
+    rng = random.Random(zlib.crc32(name.encode("utf-8")))
+    frames = [_frame(size, i, len(durs), rng) for i in range(len(durs))]
+    bio = io.BytesIO()
+    if fmt == "GIF":
+        frames = [f.convert("RGB") for f in frames]
+    frames[0].save(bio, format=fmt, save_all=True, append_images=frames[1:], duration=durs, loop=0)
+    return bio.getvalue()
+
+
+def data_url(content: bytes, mime: str = "image/gif") -> str:
+    return f"data:{mime};base64," + base64.b64encode(content).decode("ascii")
+
+
+def make_base_png(size: Tuple[int, int] = (900, 1400), seed: int = 7) -> bytes:
+    """类聊天截图：灰底 + 白色气泡 + 文字噪声"""
+    w, h = size
+    rng = random.Random(seed)
+    im = Image.new("RGBA", size, (241, 241, 241, 255))
+    d = ImageDraw.Draw(im)
+    y = 10
+    while y < h - 60:
+        bh = rng.randrange(60, 220)
+        d.ellipse((20, y + 20, 120, y + 120), fill=(rng.randrange(256), 150, 200, 255))
+        d.rounded_rectangle((140, y + 40, w - 20, y + 40 + bh), radius=10, fill=(255, 255, 255, 255))
+        for ty in range(y + 60, y + 40 + bh - 20, 40):
+            d.text((160, ty), "".join(rng.choice("abcdefghij ") for _ in range(60)), fill=(20, 20, 20, 255))
+        y += bh + 60
+    bio = io.BytesIO()
+    im.save(bio, format="PNG")
+    return bio.getvalue()
+
+
+def make_assets(names: List[str], radius: int = 15):
+    """按名称准备 AnimatedAsset（走真实的 prepare_animated_asset）"""
+    from anim import prepare_animated_asset
+    out = []
+    for i, name in enumerate(names):
+        content = make_animation_bytes(name)
+        out.append(prepare_animated_asset(data_url(content), f"anim-{i}", radius, content=content))
+    return out
+
+
+def layout(assets, canvas_w: int = 900) -> Dict[str, Tuple[int, int, int, int]]:
+    """把资产从上到下排进气泡区域，返回 id -> (x, y, w, h)"""
+    placements = {}
+    x, y, row_h = 160, 70, 0
+    for a in assets:
+        w, h = a.display_size
+        if x + w > canvas_w - 30:
+            x, y, row_h = 160, y + row_h + 20, 0
+        placements[a.placeholder_id] = (x, y, w, h)
+        x += w + 20
+        row_h = max(row_h, h)
+    return placements
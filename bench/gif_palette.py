@@ -0,0 +1,87 @@
+# bench/gif_palette.py
+"""
+GIF 量化基准：逐帧自适应局部调色板（local）vs 全局调色板（global，冷/热调色板缓存）
+vs 全局调色板 + 动图区域有序抖动。指标：量化+编码耗时、字节数、与原始 RGB 帧的平均误差。
+
+用法：python bench/gif_palette.py [--scenario coprime_pair]
+"""
+import io
+import os
+import json
+import time
+import argparse
+
+os.environ.setdefault("TIMELINE_MAX_SECONDS", "2")
+
+from fixtures import make_assets, make_base_png, layout
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageSequence  # noqa: E402
+import anim  # noqa: E402
+import quantize  # noqa: E402
+from encoders import encode_gif_delta, expand_delta_frames  # noqa: E402
+
+SCENARIOS = {
+    "one_sticker": ["sticker_small"],
+    "coprime_pair": ["coprime_a", "coprime_b"],
+    "many_gifs": ["sticker_small", "coprime_a", "coprime_b", "photo_like"],
+}
+
+
+def _mean_error(gif_bytes: bytes, full_frames) -> float:
+    """逐帧解码输出，与合成得到的 RGB 整帧比较（每通道平均绝对误差）"""
+    errs = []
+    im = Image.open(io.BytesIO(gif_bytes))
+    for dec, ref in zip(ImageSequence.Iterator(im), full_frames):
+        a = np.asarray(dec.convert("RGB"), dtype=np.int16)
+        b = np.asarray(ref.convert("RGB"), dtype=np.int16)
+        errs.append(float(np.abs(a - b).mean()))
+    return round(sum(errs) / max(1, len(errs)), 3)
+
+
+def _run_one(label, fn, full_frames):
+    t0 = time.perf_counter()
+    data = fn()
+    ms = round((time.perf_counter() - t0) * 1000.0, 1)
+    return {"ms": ms, "bytes": len(data), "mean_abs_err": _mean_error(data, full_frames)}
+
+
+def run(names) -> dict:
+    base = Image.open(io.BytesIO(make_base_png((700, 900)))).convert("RGBA")
+    results = {}
+    for name in names:
+        assets = make_assets(SCENARIOS[name])
+        placements = layout(assets, base.width)
+        frames, rects, durs = anim._compose_frames(base, placements, assets)
+        full = list(expand_delta_frames(frames, rects))
+        durs_ms = anim._gif_quantize_delays_ms(durs)
+
+        def local():
+            return encode_gif_delta(frames, rects, durs_ms, base.size)
+
+        def global_(dither=False):
+            def go():
+                p_frames, pal = quantize.quantize_frames_global(frames, rects, base, placements, assets, dither=dither)
+                return encode_gif_delta(p_frames, rects, durs_ms, base.size, palette=pal)
+            return go
+
+        row = {"frames": len(frames), "local": _run_one("local", local, full)}
+        quantize._asset_palettes._data.clear()
+        row["global_cold"] = _run_one("global_cold", global_(), full)
+        # 热：资产调色板已记忆化（同一张 GIF 的后续请求）
+        row["global_warm"] = _run_one("global_warm", global_(), full)
+        row["global_dither"] = _run_one("global_dither", global_(True), full)
+        row["speedup_warm"] = round(row["local"]["ms"] / max(0.1, row["global_warm"]["ms"]), 2)
+        results[name] = row
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    args = ap.parse_args()
+    print(json.dumps(run(args.scenario or sorted(SCENARIOS)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# bench/load.py
+"""
+端到端负载测试：经真实 HTTP（werkzeug 多线程服务器，进程内）并发压测 Flask 应用。
+- 浏览器：fake（默认，fake_browser 替身：固定 PNG + 占位坐标，--browser-ms 模拟浏览器耗时）|
+  real（本机无头 Firefox + geckodriver）| auto（可用则 real，否则 fake）
+- 场景按 --mix 权重混合：text_png / image_png / gif / apng / batch，素材全部来自 fixtures（离线 data URL）
+- 结果缓存默认关闭（测真实渲染）；动图解码缓存保持线上默认
+- 报告：总吞吐、各场景 p50/p95/p99、状态码分布、池等待、各阶段平均自身耗时（qq_stage_seconds）、启动里程碑
+
+用法：python bench/load.py [-c 8] [-n 200] [--browser fake|real|auto] [--browser-ms 0]
+                           [--mix text_png=3,image_png=2,gif=2,apng=2,batch=1] [--pool 2] [--encode-workers N]
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("RENDER_CACHE_MAX_BYTES", "0")  # 关闭结果缓存，测的是真实渲染
+os.environ.setdefault("METRICS_DIR", "")              # 只读本进程指标，不写快照文件
+
+from fixtures import make_animation_bytes, data_url  # noqa: E402
+
+DEFAULT_MIX = {"text_png": 3, "image_png": 2, "gif": 2, "apng": 2, "batch": 1}
+
+
+def _static_png_url() -> str:
+    import io
+    from PIL import Image
+    b = io.BytesIO()
+    Image.new("RGB", (320, 240), (90, 140, 200)).save(b, "PNG")
+    return data_url(b.getvalue(), "image/png")
+
+
+def build_scenarios() -> dict:
+    """场景名 -> (路径, 请求体生成函数 i -> json)；消息带序号，内容各不相同"""
+    sticker = data_url(make_animation_bytes("sticker_small"))
+    coprime = data_url(make_animation_bytes("coprime_a"))
+    awkward = data_url(make_animation_bytes("ntsc_30fps", "PNG"), "image/png")
+    static = _static_png_url()
+
+    def text(i):
+        return [{"user_id": 10000 + i % 7, "user_nickname": f"用户{i % 7}", "message": f"第 {i} 条：" + "负载测试消息。" * (1 + i % 5)}]
+
+    def image(i):
+        return [{"user_id": 10001, "user_nickname": "图片", "message": f"#{i}", "image": [static]}]
+
+    def anim(i):
+        return [{"user_id": 10002, "user_nickname": "动图", "message": f"#{i}", "image": [sticker, coprime]},
+                {"user_id": 10003, "user_nickname": "回复", "message": "30fps", "image": [awkward]}]
+
+    def batch(i):
+        return [{"format": "png" if k % 2 else "gif", "data": anim(i * 8 + k) if k % 4 == 0 else text(i * 8 + k)}
+                for k in range(8)]
+
+    return {
+        "text_png": ("/png/", text),
+        "image_png": ("/png/", image),
+        "gif": ("/gif/", anim),
+        "apng": ("/apng/", anim),
+        "batch": ("/batch/", batch),
+    }
+
+
+def _parse_mix(s: str) -> dict:
+    mix = {}
+    for part in s.split(","):
+        name, _, w = part.partition("=")
+        mix[name.strip()] = float(w or 1)
+    return mix
+
+
+def _summary(samples) -> dict:
+    if not samples:
+        return {"n": 0}
+    s = sorted(samples)
+
+    def pct(p):
+        return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+    return {
+        "n": len(s),
+        "mean_ms": round(sum(s) / len(s), 2),
+        "p50_ms": round(pct(50), 2),
+        "p95_ms": round(pct(95), 2),
+        "p99_ms": round(pct(99), 2),
+        "max_ms": round(s[-1], 2),
+    }
+
+
+def _stage_totals(metrics) -> dict:
+    """qq_stage_seconds 的 {阶段: (次数, 总秒数)}"""
+    out = {}
+    for name, labels, v in metrics._snapshot()["values"]:
+        if name == "qq_stage_seconds":
+            out[dict(labels)["stage"]] = (sum(v[:-1]), v[-1])
+    return out
+
+
+def _stage_summary(after: dict, before: dict) -> dict:
+    out = {}
+    for stage, (n, total) in sorted(after.items()):
+        n0, total0 = before.get(stage, (0, 0.0))
+        if n > n0:
+            out[stage] = {"count": n - n0, "mean_ms": round((total - total0) / (n - n0) * 1000.0, 3)}
+    return out
+
+
+def run(concurrency: int = 8, requests_n: int = 200, browser: str = "fake", browser_ms: float = 0.0,
+        mix: dict = None, warmup: int = 2, seed: int = 1) -> dict:
+    import fake_browser
+    if browser == "auto":
+        browser = "real" if fake_browser.firefox_available() else "fake"
+    if browser == "fake":
+        os.environ["BENCH_BROWSER_MS"] = str(browser_ms)
+        fake_browser.install()
+
+    import requests
+    from werkzeug.serving import make_server
+    import main as srv
+    import metrics
+    import native
+    from utils import Config
+
+    mix = {k: v for k, v in (mix or DEFAULT_MIX).items() if v > 0}
+    scenarios = build_scenarios()
+    unknown = set(mix) - set(scenarios)
+    if unknown:
+        raise SystemExit(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    # 真实浏览器回访 /quote/ 与 /media/ 走固定端口；替身不需要
+    port = Config.FLASK_RUN_PORT if browser == "real" else 0
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # 不逐条打印访问日志
+    httpd = make_server("127.0.0.1", port, srv.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_port}"
+
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    schedule = [rng.choices(names, weights)[0] for _ in range(requests_n)]
+    results = {name: [] for name in names}
+    statuses, sizes = {}, {name: [] for name in names}
+    lock = threading.Lock()
+    cursor = iter(enumerate(schedule))
+
+    def one(session, name, i):
+        path, make = scenarios[name]
+        t0 = time.perf_counter()
+        try:
+            r = session.post(base + path, json=make(i), timeout=Config.WORKER_ACQUIRE_TIMEOUT_SEC + 60)
+            status, body = r.status_code, r.content
+        except Exception as e:
+            status, body = type(e).__name__, b""
+        return status, body, (time.perf_counter() - t0) * 1000.0
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                nxt = next(cursor, None)
+            if nxt is None:
+                return
+            i, name = nxt
+            status, body, ms = one(session, name, i)
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    results[name].append(ms)
+                    sizes[name].append(len(body))
+
+    try:
+        with requests.Session() as s:
+            for name in names:
+                for k in range(warmup):
+                    one(s, name, -1 - k)
+        stages_before = _stage_totals(metrics)  # 扣除预热
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+        pool = srv.ss.pool.stats()
+        encode = srv.encode_pool.stats() if srv.encode_pool is not None else None
+    finally:
+        httpd.shutdown()
+        srv.ss.pool.shutdown()
+        if srv.encode_pool is not None:
+            srv.encode_pool.shutdown()
+
+    ok = sum(len(v) for v in results.values())
+    return {
+        "meta": {
+            "browser": browser,
+            "browser_ms": browser_ms if browser == "fake" else None,
+            "concurrency": concurrency,
+            "requests": requests_n,
+            "pool_size": Config.WORKER_POOL_SIZE,
+            "encode_workers": Config.ENCODE_WORKERS,
+            "render_mode": Config.RENDER_MODE,
+            "native_engine": Config.RENDER_ENGINE != "browser" and native.available(),
+            "mix": mix,
+        },
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(ok / wall, 2) if wall else 0.0,
+        "errors": requests_n - ok,
+        "status": statuses,
+        "scenarios": {
+            name: dict(_summary(results[name]),
+                       bytes_avg=int(sum(sizes[name]) / len(sizes[name])) if sizes[name] else 0)
+            for name in names
+        },
+        "pool": {k: pool.get(k) for k in ("wait_ms_avg", "wait_ms_max", "timeouts")},
+        "encode": {k: encode[k] for k in ("jobs", "rejected", "timeouts", "crashes")} if encode else None,
+        "stages": _stage_summary(_stage_totals(metrics), stages_before),
+        "startup_ms": {k: round(v * 1000.0, 1) for k, v in srv._startup.items()},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-c", "--concurrency", type=int, default=8)
+    ap.add_argument("-n", "--requests", type=int, default=200)
+    ap.add_argument("--browser", choices=("fake", "real", "auto"), default="fake")
+    ap.add_argument("--browser-ms", type=float, default=0.0, help="替身模拟的单次浏览器耗时（毫秒）")
+    ap.add_argument("--mix", help="场景权重，如 text_png=3,gif=1")
+    ap.add_argument("--pool", type=int, help="覆盖 WORKER_POOL_SIZE")
+    ap.add_argument("--encode-workers", type=int, help="覆盖 ENCODE_WORKERS（0 = 在请求线程内合成）")
+    ap.add_argument("--warmup", type=int, default=2, help="每个场景的预热请求数")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="结果另存为 JSON 文件")
+    args = ap.parse_args()
+    if args.pool:
+        os.environ["WORKER_POOL_SIZE"] = str(args.pool)
+    if args.encode_workers is not None:
+        os.environ["ENCODE_WORKERS"] = str(args.encode_workers)
+    result = run(args.concurrency, args.requests, args.browser, args.browser_ms,
+                 _parse_mix(args.mix) if args.mix else None, args.warmup, args.seed)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
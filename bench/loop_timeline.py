@@ -0,0 +1,175 @@
+# bench/loop_timeline.py
+"""
+时间线基准（纯整数 ticks，不涉及像素）：旧版（LCM 超长硬截断 + set 收集事件 + 每 N 个取一个 +
+逐事件线性扫描 cum_ticks）vs timeline.build_timeline（误差最短公共周期 + k 路归并 + 最短区间优先合并）。
+
+指标：
+- frames / build_ms / loop_s
+- seam_jump_pct：旧版截断处各资产被切掉的周期比例（最大值），循环时表现为跳帧
+- drift_pct：新版为凑整循环而微调的播放速度（最大值）
+- budget_error_pct：受帧预算影响、与不限帧数的同一时间线相比显示错帧的时间占比
+
+用法：python bench/loop_timeline.py [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from math import gcd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from timeline import build_timeline  # noqa: E402
+
+G = 1000  # 帧时长均为整毫秒 -> 1 tick = 1 ms
+
+# 每个场景：各资产的逐帧时长（ms）+ (最长循环秒数, 输出帧预算)
+SCENARIOS = {
+    "coprime_3": ([[30, 70, 110, 130, 170], [40, 90, 60, 20, 130, 50, 80], [70] * 12], (60.0, 5000)),
+    "near_equal_periods": ([[100] * 10, [101] * 10], (60.0, 5000)),
+    "prime_periods": ([[53, 60], [97, 30], [61, 70]], (60.0, 5000)),
+    "many_assets": ([[30, 70], [40, 90, 60], [110, 20], [130, 50, 80], [170], [90, 30, 30]], (60.0, 5000)),
+    "frame_budget": ([[20] * 50, [30] * 7, [70] * 3], (60.0, 300)),
+}
+
+
+def _lcm(a, b):
+    return a // gcd(a, b) * b
+
+
+def _cum(durs):
+    out, acc = [], 0
+    for d in durs:
+        acc += d
+        out.append(acc)
+    return out
+
+
+# ----------------- 旧版（对照） -----------------
+
+def _legacy_event_ticks(cums, periods, T_ticks, max_events):
+    events = set([0, T_ticks])
+    for cum, P in zip(cums, periods):
+        single = [0] + cum
+        rep = max(1, T_ticks // P)
+        for r in range(rep):
+            base = r * P
+            for e in single:
+                t = base + e
+                if 0 < t < T_ticks:
+                    events.add(t)
+    out = sorted(events)
+    if max_events and len(out) > max_events:
+        keep = set([0, T_ticks])
+        step = max(1, len(out) // (max_events - 2))
+        for i in range(1, len(out) - 1, step):
+            keep.add(out[i])
+        out = sorted(keep)
+    return out
+
+
+def _legacy_timeline(cums, periods, max_seconds, max_events):
+    T = 1
+    for p in periods:
+        T = _lcm(T, p)
+    if T / float(G) > max_seconds:
+        T = int(max_seconds * G)
+    events = _legacy_event_ticks(cums, periods, T, max_events)
+    keys, ticks = [], []
+    for t0, t1 in zip(events, events[1:]):
+        if t1 <= t0:
+            continue
+        key = []
+        for cum, P in zip(cums, periods):
+            t_mod = t0 % P
+            idx = 0
+            for j, c in enumerate(cum):
+                if t_mod < c:
+                    idx = j
+                    break
+            key.append(idx)
+        key = tuple(key)
+        if keys and keys[-1] == key:
+            ticks[-1] += t1 - t0
+        else:
+            keys.append(key)
+            ticks.append(t1 - t0)
+    jump = max(min(T % p, p - T % p) / float(p) for p in periods)
+    return keys, ticks, T, jump
+
+
+# ----------------- 指标 -----------------
+
+def _mismatch(ka, ta, kb, tb) -> float:
+    """两条总长相同的阶梯时间线中，画面不同的时间占比"""
+    total = sum(ta)
+    i = j = 0
+    ea, eb = ta[0], tb[0]
+    t = bad = 0
+    while i < len(ka) and j < len(kb):
+        e = min(ea, eb)
+        if ka[i] != kb[j]:
+            bad += e - t
+        t = e
+        if ea == e:
+            i += 1
+            ea += ta[i] if i < len(ta) else 0
+        if eb == e:
+            j += 1
+            eb += tb[j] if j < len(tb) else 0
+    return bad / float(total) if total else 0.0
+
+
+def _best(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = (time.perf_counter() - t0) * 1000.0
+        best = dt if best is None else min(best, dt)
+    return round(best, 2), out
+
+
+def run(repeat: int) -> dict:
+    results = {}
+    for name, (durs, (max_s, budget)) in SCENARIOS.items():
+        cums = [_cum(d) for d in durs]
+        periods = [c[-1] for c in cums]
+
+        legacy_ms, (lk, lt, lT, jump) = _best(lambda: _legacy_timeline(cums, periods, max_s, budget), repeat)
+        lk_full, lt_full, _, _ = _legacy_timeline(cums, periods, max_s, None)
+
+        new_ms, tl = _best(lambda: build_timeline(cums, periods, int(max_s * G), 0.02, budget), repeat)
+        full = build_timeline(cums, periods, int(max_s * G), 0.02, None)
+
+        results[name] = {
+            "legacy": {
+                "frames": len(lk),
+                "build_ms": legacy_ms,
+                "loop_s": lT / float(G),
+                "seam_jump_pct": round(100 * jump, 2),
+                "budget_error_pct": round(100 * _mismatch(lk, lt, lk_full, lt_full), 2),
+            },
+            "new": {
+                "frames": len(tl.keys),
+                "build_ms": new_ms,
+                "loop_s": tl.loop_ticks / float(G),
+                "drift_pct": round(100 * tl.drift, 2),
+                "budget_error_pct": round(100 * _mismatch(tl.keys, tl.ticks, full.keys, full.ticks), 2),
+            },
+        }
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    print(json.dumps(run(args.repeat), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
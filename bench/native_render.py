@@ -0,0 +1,118 @@
+# bench/native_render.py
+"""
+Pillow 原生渲染（native.render_png）的延迟/吞吐，以及与浏览器输出的像素对比（视觉回归）。
+- 默认只测原生渲染（离线，头像用生成图），报告每条语料的 p50/p95 与单线程 quotes/s
+- --browser：再经本机 Firefox（/png/?engine=browser）渲染同一批语料，报告尺寸是否一致、
+  平均绝对差、差异像素占比与两者延迟；--out 目录下写出 native/browser/diff 三张图
+  （两边头像都走 /media 同一份下载缓存；离线时都画成灰底占位）
+
+用法：python bench/native_render.py [-n 30] [--font PATH] [--browser] [--out DIR]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WORKER_POOL_SIZE", "1")
+os.environ.setdefault("RENDER_CACHE_MAX_BYTES", "0")  # 关闭结果缓存，测的是真实渲染
+
+from tests.native_corpus import CORPUS, image_diff  # noqa: E402
+
+
+def _summary(samples):
+    s = sorted(samples)
+
+    def pct(p):
+        return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+    return {"p50_ms": round(pct(50), 2), "p95_ms": round(pct(95), 2)}
+
+
+def _fake_avatar() -> bytes:
+    from PIL import Image
+    b = io.BytesIO()
+    Image.new("RGB", (640, 640), (90, 140, 200)).save(b, "PNG")
+    return b.getvalue()
+
+
+def _time(fn, n: int, warmup: int = 2):
+    out = None
+    for _ in range(warmup):
+        out = fn()
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples, out
+
+
+def run(n: int, browser: bool, out_dir: str = None) -> dict:
+    import native
+    if not native.available():
+        raise SystemExit(f"font not found: {native.Config.NATIVE_FONT_PATH} (use --font)")
+    avatar = _fake_avatar()
+    fetch = None if browser else (lambda url: avatar)
+    results, total_ms, total_quotes = {}, 0.0, 0
+    for name, payload in CORPUS.items():
+        if not native.supports(payload):
+            results[name] = {"supported": False}
+            continue
+        samples, _ = _time(lambda: native.render_png(payload, fetch=fetch), n)
+        results[name] = {"supported": True, "native": _summary(samples)}
+        total_ms += sum(samples)
+        total_quotes += len(samples)
+    results["native_quotes_per_sec"] = round(total_quotes / (total_ms / 1000.0), 1) if total_ms else 0.0
+    if not browser:
+        return results
+
+    srv = importlib.import_module("main")
+    from utils import Config
+    from werkzeug.serving import make_server
+    Config.RENDER_MODE = "inject"
+    httpd = make_server("127.0.0.1", Config.FLASK_RUN_PORT, srv.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = srv.app.test_client()
+    try:
+        for name, payload in CORPUS.items():
+            if not results[name]["supported"]:
+                continue
+
+            def via_browser():
+                r = client.post("/png/?engine=browser", json=json.loads(json.dumps(payload)))
+                if r.status_code != 200:
+                    raise RuntimeError(f"{name}: HTTP {r.status_code}")
+                return r.data
+
+            samples, browser_png = _time(via_browser, max(3, n // 5))
+            native_png = native.render_png(payload)
+            results[name]["browser"] = _summary(samples)
+            results[name]["speedup_p50"] = round(
+                results[name]["browser"]["p50_ms"] / max(0.01, results[name]["native"]["p50_ms"]), 1)
+            results[name]["diff"] = image_diff(native_png, browser_png, out_dir, name)
+    finally:
+        httpd.shutdown()
+        srv.ss.pool.shutdown()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("-n", type=int, default=30)
+    ap.add_argument("--font", help="覆盖 NATIVE_FONT_PATH")
+    ap.add_argument("--browser", action="store_true", help="与本机 Firefox 输出对比")
+    ap.add_argument("--out", help="写出 native/browser/diff 图片的目录")
+    args = ap.parse_args()
+    if args.font:
+        os.environ["NATIVE_FONT_PATH"] = args.font
+    print(json.dumps(run(args.n, args.browser, args.out), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
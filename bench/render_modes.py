@@ -0,0 +1,86 @@
+# bench/render_modes.py
+"""
+navigate（导航 /quote/ 回环）与 inject（常驻外壳页 + execute_script）单请求延迟对比。
+需要本机可用的 Firefox + geckodriver。
+
+用法：python bench/render_modes.py [-n 30] [--warmup 3] [--payload assets/data_example.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WORKER_POOL_SIZE", "1")
+os.environ.setdefault("RENDER_CACHE_MAX_BYTES", "0")  # 关闭结果缓存，测的是真实渲染
+
+DEFAULT_PAYLOAD = [
+    {"user_id": 5435486, "user_nickname": "竹林里有冰", "message": "请大家多多 star 本项目！"},
+    {"user_id": 5435486, "user_nickname": "竹林里有冰", "message": "你好啊，我是你的小可爱",
+     "reply": {"user_nickname": "竹林里没冰", "message": "你好啊，我不是你的小可爱"}},
+]
+
+
+def _summary(samples):
+    s = sorted(samples)
+
+    def pct(p):
+        return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+    return {
+        "n": len(s),
+        "mean_ms": round(sum(s) / len(s), 2),
+        "p50_ms": round(pct(50), 2),
+        "p95_ms": round(pct(95), 2),
+        "max_ms": round(s[-1], 2),
+    }
+
+
+def run(n: int, warmup: int, payload) -> dict:
+    srv = importlib.import_module("main")
+    from utils import Config
+    from werkzeug.serving import make_server
+
+    httpd = make_server("127.0.0.1", Config.FLASK_RUN_PORT, srv.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = srv.app.test_client()
+    results = {}
+    try:
+        for mode in ("navigate", "inject"):
+            Config.RENDER_MODE = mode
+            samples = []
+            for i in range(warmup + n):
+                t0 = time.perf_counter()
+                r = client.post("/png/", json=payload)
+                dt = (time.perf_counter() - t0) * 1000.0
+                if r.status_code != 200:
+                    raise RuntimeError(f"{mode}: HTTP {r.status_code}")
+                if i >= warmup:
+                    samples.append(dt)
+            results[mode] = _summary(samples)
+        results["speedup_p50"] = round(results["navigate"]["p50_ms"] / results["inject"]["p50_ms"], 2)
+    finally:
+        httpd.shutdown()
+        srv.ss.pool.shutdown()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("-n", type=int, default=30)
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--payload", help="JSON 文件路径，默认使用内置纯文本语录")
+    args = ap.parse_args()
+    payload = DEFAULT_PAYLOAD
+    if args.payload:
+        with open(args.payload, encoding="utf-8") as f:
+            payload = json.load(f)
+    print(json.dumps(run(args.n, args.warmup, payload), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
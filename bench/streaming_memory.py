@@ -0,0 +1,153 @@
+# bench/streaming_memory.py
+"""
+大动图内存基准：长语录（900x6000）里放一张 300 帧 GIF + 一张互质时长贴纸，
+对比“整段物化”（旧式：原始帧列表 -> 缩放帧列表 -> 全部输出帧列表 -> 编码）
+与流式流水线（单遍解码 -> 惰性合成 -> 增量编码），以及收紧护栏后的降级效果。
+每种方式在独立子进程中运行，报告进程峰值 RSS（VmHWM）与耗时。
+
+用法：python bench/streaming_memory.py [--fmt APNG|GIF]
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+os.environ.setdefault("TIMELINE_MAX_SECONDS", "10")
+
+from fixtures import make_animation_bytes, make_base_png, data_url
+
+SCENARIO = ["very_long_gif", "coprime_b"]
+CANVAS = (900, 6000)
+MODES = {
+    "materialized": {},
+    "streaming": {},
+    "streaming_capped": {"ASSET_MAX_FRAMES": "100", "ASSET_MAX_DECODED_MB": "64",
+                         "ANIM_MAX_MEMORY_MB": "160", "ANIM_MAX_CANVAS_PIXELS": "2000000"},
+}
+
+
+def _peak_rss_mb() -> float:
+    # VmHWM 随 exec 重置；ru_maxrss 在 Linux 上会沿用 fork 出来时父进程的峰值
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def _legacy_asset(content: bytes, pid: str):
+    """旧式资产准备：原始帧列表 + 缩放帧列表（PIL 图像）"""
+    from fractions import Fraction
+    from PIL import Image, ImageSequence
+    import anim
+    im = Image.open(io.BytesIO(content))
+    raw, durs = [], []
+    for f in ImageSequence.Iterator(im):
+        raw.append(f.convert("RGBA"))
+        durs.append(max(10, int(f.info.get("duration", 100))))
+    dw, dh = anim._cap_size_to_css(*raw[0].size)
+    mask = anim._round_mask((dw, dh), 15)
+    scaled = []
+    for fr in raw:
+        r = Image.new("RGBA", (dw, dh))
+        r.paste(fr.resize((dw, dh), resample=Image.LANCZOS), (0, 0), mask)
+        scaled.append(r)
+    return anim.AnimatedAsset(pid, (dw, dh), scaled, [Fraction(d, 1000) for d in durs], [], 0)
+
+
+def _placements(assets):
+    out, y = {}, 200
+    for a in assets:
+        w, h = a.display_size
+        out[a.placeholder_id] = (160, y, w, h)
+        y += h + 2000
+    return out
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _child(mode: str, fmt: str, fixture_dir: str) -> dict:
+    import anim
+    from PIL import Image
+    from encoders import encode_apng_delta, encode_gif_delta
+    # 素材由父进程预先生成，避免生成过程本身抬高子进程峰值 RSS
+    base_png = _read(os.path.join(fixture_dir, "base.png"))
+    contents = [_read(os.path.join(fixture_dir, f"{n}.gif")) for n in SCENARIO]
+    rss_before = _peak_rss_mb()
+    t0 = time.perf_counter()
+    if mode == "materialized":
+        assets = [_legacy_asset(c, f"anim-{i}") for i, c in enumerate(contents)]
+        base = Image.open(io.BytesIO(base_png)).convert("RGBA")
+        frames, rects, durs = anim._compose_frames(base, _placements(assets), assets)
+        full = [frames[0]] + frames[1:]  # 全部输出帧常驻
+        if fmt == "GIF":
+            out = encode_gif_delta(full, rects, anim._gif_quantize_delays_ms(durs), base.size)
+        else:
+            out = encode_apng_delta(full, rects, [anim._rationalize_delay(d) for d in durs], base.size)
+        n_frames, size = len(full), base.size
+    else:
+        assets = [anim.prepare_animated_asset(data_url(c), f"anim-{i}", 15, content=c) for i, c in enumerate(contents)]
+        out = anim.compose_animation_event_driven(base_png, _placements(assets), assets, fmt=fmt)
+        im = Image.open(io.BytesIO(out))
+        n_frames, size = getattr(im, "n_frames", 1), im.size
+    return {
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        "bytes": len(out),
+        "frames": n_frames,
+        "canvas": list(size),
+        "asset_frames": [len(a.frames_rgba) for a in assets],
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run(fmt: str) -> dict:
+    td = tempfile.mkdtemp(prefix="qq-stream-bench-")
+    results = {}
+    try:
+        with open(os.path.join(td, "base.png"), "wb") as f:
+            f.write(make_base_png(CANVAS))
+        for n in SCENARIO:
+            with open(os.path.join(td, f"{n}.gif"), "wb") as f:
+                f.write(make_animation_bytes(n))
+        for mode, extra in MODES.items():
+            env = dict(os.environ, ASSET_CACHE_MAX_BYTES="0", ASSET_CACHE_DIR="", USE_GIFSICLE="0", **extra)
+            p = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, "--fmt", fmt, "--fixtures", td],
+                capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            if p.returncode != 0:
+                results[mode] = {"error": p.stderr.strip().splitlines()[-1:]}
+                continue
+            results[mode] = json.loads(p.stdout)
+    finally:
+        shutil.rmtree(td, ignore_errors=True)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--fmt", choices=("APNG", "GIF"), default="APNG")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--fixtures", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        print(json.dumps(_child(args.child, args.fmt, args.fixtures)))
+        return
+    print(json.dumps(run(args.fmt), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# bench/suite.py
+"""
+可复现的离线基准套件：微基准 + 端到端负载，结果为 JSON，可在提交之间对比。
+
+微基准（fixtures 以固定随机种子生成的动图，帧时长互质/非整毫秒/含 0 时长帧）：
+- prepare_animated_asset：cold（绕过解码帧缓存）/ warm（命中内存帧缓存）
+- timeline：anim._plan_frames 的事件时间线（全局分母 G + build_timeline + 变化矩形），不含像素
+- compose：compose_animation_event_driven 的 GIF、APNG（delta / fast / apngasm）与 WebP/AVIF 各预设，含输出字节数
+  （--table 以 Markdown 表格输出各格式的体积与耗时）
+- quantize：全局调色板构建 + 逐帧映射（输入为预先合成好的子矩形帧；资产调色板记忆化为热态）
+端到端：bench/load.py 的场景混合（默认 fake 浏览器，--browser auto 时有 Firefox 就用真的）
+
+耗时为 1 次预热后 --repeat 次的中位数（*_ms）与最小值（*_min_ms）。
+
+用法：
+  python bench/suite.py [--repeat 5] [--quick] [--skip-load] [--browser fake|real|auto] [--out result.json] [--table]
+  python bench/suite.py --compare base.json [new.json] [--threshold 10] [--min-ms 1]
+    只给基线时先跑一遍当前代码再比较；存在超过阈值的退化时退出码为 1
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("RENDER_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("ASSET_CACHE_DIR", "")
+os.environ.setdefault("METRICS_DIR", "")
+
+from fixtures import ANIMATION_SPECS, make_animation_bytes, make_base_png, data_url, layout  # noqa: E402
+
+# 名称或 (名称, 容器)：APNG 容器保留非整 10ms 的帧时长
+PREPARE = ["sticker_small", "coprime_a", "coprime_b", "long_gif", "zero_delays",
+           ("ntsc_30fps", "PNG"), "very_long_gif"]
+SCENARIOS = {
+    "one_sticker": ["sticker_small"],
+    "coprime_pair": ["coprime_a", "coprime_b"],
+    "awkward_mix": [("ntsc_30fps", "PNG"), "zero_delays", "coprime_b"],
+    "long_gif": ["long_gif", "sticker_small"],
+}
+QUICK_SKIP = {"very_long_gif", "long_gif"}
+QUICK_SKIP_PRESETS = {"small", "high"}  # WebP/AVIF 最慢的两档
+
+
+def _spec(item):
+    return (item, "GIF") if isinstance(item, str) else tuple(item)
+
+
+def _label(item) -> str:
+    name, fmt = _spec(item)
+    return name if fmt == "GIF" else f"{name}.{fmt.lower()}"
+
+
+def _timed(fn, repeat: int):
+    out = fn()  # 预热
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return {"ms": round(median(samples), 3), "min_ms": round(min(samples), 3)}, out
+
+
+def _assets(items):
+    from anim import prepare_animated_asset
+    out = []
+    for i, item in enumerate(items):
+        name, fmt = _spec(item)
+        content = make_animation_bytes(name, fmt)
+        mime = "image/gif" if fmt == "GIF" else "image/png"
+        out.append(prepare_animated_asset(data_url(content, mime), f"anim-{i}", 15, content=content))
+    return out
+
+
+def bench_prepare(repeat: int, quick: bool) -> dict:
+    import anim
+    results = {}
+    for item in PREPARE:
+        name, fmt = _spec(item)
+        if quick and name in QUICK_SKIP:
+            continue
+        content = make_animation_bytes(name, fmt)
+        src = data_url(content, "image/gif" if fmt == "GIF" else "image/png")
+        cache = anim.asset_cache
+        try:
+            anim.asset_cache = None
+            cold, asset = _timed(lambda: anim.prepare_animated_asset(src, "a", 15, content=content), repeat)
+        finally:
+            anim.asset_cache = cache
+        row = {"cold_ms": cold["ms"], "cold_min_ms": cold["min_ms"],
+               "frames_in": len(ANIMATION_SPECS[name][1]), "frames_kept": len(asset.frames_rgba)}
+        if cache is not None:
+            warm, _ = _timed(lambda: anim.prepare_animated_asset(src, "a", 15, content=content), repeat)
+            row.update(warm_ms=warm["ms"], warm_min_ms=warm["min_ms"])
+        results[_label(item)] = row
+    return results
+
+
+def bench_pipeline(repeat: int, quick: bool) -> dict:
+    """timeline / compose / quantize 共用同一组资产与底图"""
+    import io
+    from PIL import Image
+    import anim
+    from encoders import APNG_MODES, ANIM_PRESETS, format_available
+    from quantize import quantize_frames_global
+
+    base_png = make_base_png()
+    base = Image.open(io.BytesIO(base_png)).convert("RGBA")
+    out = {"timeline": {}, "compose": {}, "quantize": {}}
+    for scn, items in SCENARIOS.items():
+        if quick and any(_spec(i)[0] in QUICK_SKIP for i in items):
+            continue
+        assets = _assets(items)
+        placements = layout(assets)
+
+        t, plan = _timed(lambda: anim._plan_frames(base, placements, assets), repeat)
+        out["timeline"][scn] = dict(t, frames=len(plan.keys), loop_s=round(float(sum(plan.durations)), 3))
+
+        compose = {}
+        # apngasm 整帧优化慢一到两个数量级，--quick 时跳过
+        modes = [m for m in APNG_MODES if not (quick and m == "apngasm")]
+        variants = [("gif", "GIF", None, None)] + [(f"apng_{m}", "APNG", m, None) for m in modes]
+        for fmt in ("WEBP", "AVIF"):
+            if format_available(fmt):
+                variants += [(f"{fmt.lower()}_{p}", fmt, None, p) for p in ANIM_PRESETS[fmt]
+                             if not (quick and p in QUICK_SKIP_PRESETS)]
+        for key, fmt, mode, preset in variants:
+            try:
+                c, data = _timed(lambda: anim.compose_animation_event_driven(base_png, placements, assets, fmt, mode, preset),
+                                 max(1, repeat // 2))
+            except ImportError:
+                continue  # apngasm 未安装
+            compose[key] = dict(c, bytes=len(data))
+        out["compose"][scn] = compose
+
+        frames, rects, _ = anim._compose_frames(base, placements, assets)
+
+        def quantize():
+            p_frames, _ = quantize_frames_global(frames, rects, base, placements, assets)
+            return sum(1 for _ in p_frames)
+
+        q, n = _timed(quantize, repeat)
+        out["quantize"][scn] = dict(q, frames=n)
+    return out
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _meta(repeat: int, quick: bool) -> dict:
+    import numpy
+    import PIL
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD") or None,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "quick": quick,
+    }
+
+
+def run(repeat: int, quick: bool, skip_load: bool, browser: str, load_args: dict) -> dict:
+    result = {"meta": _meta(repeat, quick), "micro": {}}
+    result["micro"]["prepare_animated_asset"] = bench_prepare(repeat, quick)
+    result["micro"].update(bench_pipeline(repeat, quick))
+    if not skip_load:
+        import load
+        result["load"] = load.run(browser=browser, **load_args)
+    return result
+
+
+# ----------------- 对比 -----------------
+
+def _flatten(d, prefix="") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def _direction(key: str) -> int:
+    """+1 越小越好，-1 越大越好，0 仅提示变化"""
+    leaf = key.rsplit(".", 1)[-1]
+    if leaf.endswith("_ms") or leaf in ("bytes", "bytes_avg", "wall_s"):
+        return 1
+    if leaf.endswith("_rps"):
+        return -1
+    return 0
+
+
+def compare(base: dict, new: dict, threshold_pct: float, min_ms: float) -> dict:
+    a, b = _flatten({k: v for k, v in base.items() if k != "meta"}), _flatten({k: v for k, v in new.items() if k != "meta"})
+    regressions, improvements, changed = [], [], []
+    for key in sorted(set(a) & set(b)):
+        old, cur = a[key], b[key]
+        sign = _direction(key)
+        if sign == 0:
+            if old != cur:
+                changed.append({"metric": key, "base": old, "new": cur})
+            continue
+        if key.endswith("_ms") and abs(cur - old) < min_ms:
+            continue  # 亚毫秒级抖动
+        pct = 100.0 * (cur - old) / old if old else (0.0 if cur == old else float("inf"))
+        row = {"metric": key, "base": old, "new": cur, "change_pct": round(pct, 1)}
+        if sign * pct > threshold_pct:
+            regressions.append(row)
+        elif sign * pct < -threshold_pct:
+            improvements.append(row)
+    return {
+        "base": base.get("meta", {}).get("commit"),
+        "new": new.get("meta", {}).get("commit"),
+        "threshold_pct": threshold_pct,
+        "regressions": sorted(regressions, key=lambda r: -abs(r["change_pct"])),
+        "improvements": sorted(improvements, key=lambda r: -abs(r["change_pct"])),
+        "changed": changed,
+        "only_in_base": sorted(set(a) - set(b)),
+        "only_in_new": sorted(set(b) - set(a)),
+    }
+
+
+# ----------------- 格式对比表 -----------------
+
+def format_table(result: dict) -> str:
+    """micro.compose -> Markdown 表格：各场景按体积升序，附相对 GIF 的体积比"""
+    lines = ["| scenario | format | bytes | vs gif | ms |", "|---|---|---:|---:|---:|"]
+    for scn, rows in result["micro"]["compose"].items():
+        gif = rows.get("gif", {}).get("bytes")
+        for key, r in sorted(rows.items(), key=lambda kv: kv[1]["bytes"]):
+            ratio = f"{r['bytes'] / gif:.2f}" if gif else "-"
+            lines.append(f"| {scn} | {key} | {r['bytes']} | {ratio} | {r['ms']:.1f} |")
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--quick", action="store_true", help="跳过超长动图与 apngasm，负载请求数上限 60，适合 CI 冒烟")
+    ap.add_argument("--skip-load", action="store_true", help="只跑微基准")
+    ap.add_argument("--browser", choices=("fake", "real", "auto"), default="fake")
+    ap.add_argument("--browser-ms", type=float, default=0.0)
+    ap.add_argument("-c", "--concurrency", type=int, default=8)
+    ap.add_argument("-n", "--requests", type=int, default=200)
+    ap.add_argument("--out", help="结果写入 JSON 文件")
+    ap.add_argument("--table", action="store_true", help="输出各格式体积/耗时对比表（Markdown）而非 JSON")
+    ap.add_argument("--compare", nargs="+", metavar="JSON", help="基线 [新结果]")
+    ap.add_argument("--threshold", type=float, default=10.0, help="判定退化/改进的变化百分比")
+    ap.add_argument("--min-ms", type=float, default=1.0, help="忽略小于该绝对值的毫秒级变化")
+    args = ap.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        ap.error("--compare takes BASE [NEW]")
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1], encoding="utf-8") as f:
+            result = json.load(f)
+    else:
+        if args.quick:
+            args.requests = min(args.requests, 60)
+        load_args = {"concurrency": args.concurrency, "requests_n": args.requests, "browser_ms": args.browser_ms}
+        result = run(args.repeat, args.quick, args.skip_load, args.browser, load_args)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+
+    if not args.compare:
+        print(format_table(result) if args.table else json.dumps(result, indent=2, ensure_ascii=False))
+        return
+    with open(args.compare[0], encoding="utf-8") as f:
+        base = json.load(f)
+    report = compare(base, result, args.threshold, args.min_ms)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+# cache.py
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Dict, Tuple, List
+
+from utils import Config
+
+if TYPE_CHECKING:
+    import numpy as np  # 仅类型标注；numpy 在首次用到动图帧缓存时才导入
+
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def _dir_digest(path: str) -> str:
+    h = hashlib.sha256()
+    try:
+        for name in sorted(os.listdir(path)):
+            with open(os.path.join(path, name), "rb") as f:
+                h.update(name.encode("utf-8"))
+                h.update(f.read())
+    except OSError:
+        return "none"
+    return h.hexdigest()[:16]
+
+
+# 模板内容变化即视为新版本，旧缓存自然失效
+TEMPLATE_VERSION = _dir_digest(_TEMPLATE_DIR)
+
+
+class ByteLRU:
+    """线程安全、按字节数限额的内存 LRU"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            v = self._data.get(key)
+            if v is not None:
+                self._data.move_to_end(key)
+            return v
+
+    def put(self, key: str, value: bytes) -> None:
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                _, ev = self._data.popitem(last=False)
+                self._bytes -= len(ev)
+                self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    目录式磁盘缓存（可被多个 gunicorn worker 共享）：
+    - 原子写入（临时文件 + os.replace）
+    - 超出字节预算时按 mtime 从旧到新清理
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._approx_bytes = None  # 首次写入时扫描
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        p = self._path(key)
+        try:
+            with open(p, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(p, None)  # 近似 LRU：命中即刷新 mtime
+        except OSError:
+            pass
+        return data
+
+    def locate(self, key: str) -> Optional[str]:
+        """条目存在则刷新 mtime 并返回文件路径（供 mmap 等按路径读取的调用方）"""
+        p = self._path(key)
+        try:
+            os.utime(p, None)
+        except OSError:
+            return None
+        return p
+
+    def put(self, key: str, value: bytes) -> None:
+        self.put_parts(key, [value])
+
+    def put_parts(self, key: str, parts: List) -> Optional[str]:
+        """依次写入多个 bytes-like 片段（免去拼接大块内存），成功返回文件路径"""
+        size = sum(memoryview(v).nbytes for v in parts)
+        if size > self.max_bytes:
+            return None
+        p = self._path(key)
+        d = os.path.dirname(p)
+        try:
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                for v in parts:
+                    f.write(v)
+            os.replace(tmp, p)
+        except OSError:
+            return None
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_bytes()
+            else:
+                self._approx_bytes += size
+            if self._approx_bytes > self.max_bytes:
+                self._prune()
+        return p
+
+    def _entries(self):
+        out = []
+        for sub in os.listdir(self.root):
+            sd = os.path.join(self.root, sub)
+            if not os.path.isdir(sd):
+                continue
+            for name in os.listdir(sd):
+                if name.startswith(".tmp-"):
+                    continue
+                fp = os.path.join(sd, name)
+                try:
+                    st = os.stat(fp)
+                except OSError:
+                    continue
+                out.append((st.st_mtime, st.st_size, fp))
+        return out
+
+    def _scan_bytes(self) -> int:
+        try:
+            return sum(s for _, s, _ in self._entries())
+        except OSError:
+            return 0
+
+    def _prune(self) -> None:
+        try:
+            entries = sorted(self._entries())
+        except OSError:
+            return
+        total = sum(s for _, s, _ in entries)
+        # 清到预算的 90%，避免每次写入都触发扫描
+        target = int(self.max_bytes * 0.9)
+        for _, size, fp in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(fp)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+        self._approx_bytes = total
+
+
+class TieredCache:
+    """内存 LRU + 可选磁盘层；带命中/未命中/淘汰计数"""
+
+    def __init__(self, mem_max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.mem = ByteLRU(mem_max_bytes)
+        self.disk = DiskCache(disk_dir, disk_max_bytes) if disk_dir else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        v = self.mem.get(key)
+        if v is not None:
+            with self._lock:
+                self.hits += 1
+            return v
+        if self.disk is not None:
+            v = self.disk.get(key)
+            if v is not None:
+                self.mem.put(key, v)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return v
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        self.mem.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "mem_evictions": self.mem.evictions,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+            "mem_entries": len(self.mem),
+            "mem_bytes": self.mem.nbytes,
+            "mem_max_bytes": self.mem.max_bytes,
+        }
+
+
+class FrameStackCache:
+    """
+    已解码动图帧缓存：value = (pixels (n, h, w, 4) uint8 连续数组, durations_ms (n,) int32)
+    - 内存层按字节预算 LRU；数组只读，可在并发请求间直接共享
+    - 可选磁盘层：写入定长头 + 时长 + 像素的单文件，再以只读 mmap 映射回来，
+      多个 gunicorn worker 共享同一份页缓存，热门表情零解码
+    """
+
+    _MAGIC = b"QQFS"
+    _HEADER = struct.Struct("<4sIIII")  # magic, 帧数, 高, 宽, 像素区偏移
+    _ALIGN = 64
+
+    def __init__(self, mem_max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max(0, int(mem_max_bytes))
+        self.disk = DiskCache(disk_dir, disk_max_bytes) if disk_dir else None
+        self._data: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, value: "Tuple[np.ndarray, np.ndarray]") -> None:
+        size = value[0].nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0].nbytes
+            self._data[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                _, ev = self._data.popitem(last=False)
+                self._bytes -= ev[0].nbytes
+                self.evictions += 1
+
+    def _map(self, path: str) -> "Optional[Tuple[np.ndarray, np.ndarray]]":
+        import numpy as np
+        try:
+            with open(path, "rb") as f:
+                head = f.read(self._HEADER.size)
+                magic, n, h, w, offset = self._HEADER.unpack(head)
+                if magic != self._MAGIC:
+                    return None
+                durs = np.frombuffer(f.read(4 * n), dtype=np.int32)
+            pixels = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(n, h, w, 4))
+        except (OSError, ValueError, struct.error):
+            return None
+        return pixels, durs
+
+    def get(self, key: str) -> "Optional[Tuple[np.ndarray, np.ndarray]]":
+        with self._lock:
+            v = self._data.get(key)
+            if v is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return v
+        if self.disk is not None:
+            path = self.disk.locate(key)
+            v = self._map(path) if path else None
+            if v is not None:
+                self._remember(key, v)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return v
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, pixels: "np.ndarray", durations_ms: "np.ndarray") -> "Tuple[np.ndarray, np.ndarray]":
+        """写入并返回应当使用的数组（启用磁盘层时为 mmap 视图，其余进程可直接映射）"""
+        import numpy as np
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        durs = np.ascontiguousarray(durations_ms, dtype=np.int32)
+        value = (pixels, durs)
+        if self.disk is not None:
+            n, h, w = pixels.shape[:3]
+            offset = -(-(self._HEADER.size + durs.nbytes) // self._ALIGN) * self._ALIGN
+            head = self._HEADER.pack(self._MAGIC, n, h, w, offset) + durs.tobytes()
+            path = self.disk.put_parts(key, [head.ljust(offset, b"\x00"), pixels])
+            mapped = self._map(path) if path else None
+            if mapped is not None:
+                value = mapped
+        if not isinstance(value[0], np.memmap):
+            pixels.flags.writeable = False
+        self._remember(key, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "mem_evictions": self.evictions,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+            "mem_entries": len(self._data),
+            "mem_bytes": self._bytes,
+            "mem_max_bytes": self.max_bytes,
+        }
+
+
+def decoded_asset_key(content_hash: str, size: Tuple[int, int], border_radius_px: int, frames: int) -> str:
+    return f"{content_hash}-{size[0]}x{size[1]}-r{border_radius_px}-f{frames}"
+
+
+def _build_asset_cache() -> Optional[FrameStackCache]:
+    if Config.ASSET_CACHE_MAX_BYTES <= 0 and not Config.ASSET_CACHE_DIR:
+        return None
+    return FrameStackCache(
+        Config.ASSET_CACHE_MAX_BYTES,
+        Config.ASSET_CACHE_DIR or None,
+        Config.ASSET_CACHE_DISK_MAX_BYTES,
+    )
+
+
+asset_cache: Optional[FrameStackCache] = _build_asset_cache()
+
+
+# ----------------- 渲染结果缓存 -----------------
+
+def render_cache_key(payload, ret_format: str, variant: str = "") -> str:
+    """
+    内容寻址 key = sha256(规范化 JSON + 输出格式 + 编码变体 + 模板版本 + 影响输出的 Config)
+    png 与 base64 共享同一份 PNG 字节，故统一归为 png
+    """
+    fmt = "png" if ret_format in ("png", "base64") else ret_format
+    knobs = (
+        Config.IMAGE_BORDER_RADIUS_PX,
+        Config.MAX_IMAGE_RENDER_W,
+        Config.MAX_IMAGE_RENDER_H,
+        Config.GIF_COLORS,
+        Config.GIF_PALETTE,
+        Config.GIF_DITHER,
+        Config.GIF_DITHER_STRENGTH,
+        Config.GIF_PALETTE_SAMPLE,
+        Config.GIF_ASSET_PALETTE_COLORS,
+        Config.GIF_MIN_DELAY_MS,
+        Config.GIF_ROUND_TO_MS,
+        Config.USE_GIFSICLE,
+        Config.APNG_COMPRESS_LEVEL,
+        Config.APNG_FAST_COMPRESS_LEVEL,
+        Config.APNG_MAX_DEN,
+        Config.APNG_DELAY_TOL_MS,
+        Config.ASSET_MAX_FRAMES,
+        Config.ASSET_MAX_DECODED_MB,
+        Config.ANIM_MAX_CANVAS_PIXELS,
+        Config.ANIM_MAX_MEMORY_MB,
+        Config.TIMELINE_MAX_SECONDS,
+        Config.TIMELINE_MAX_EVENTS,
+        Config.TIMELINE_MAX_DRIFT,
+        Config.RENDER_MODE,
+        Config.CAPTURE_VIEWPORT_WIDTH,
+        Config.CAPTURE_TILE_HEIGHT,
+        Config.CAPTURE_TILE_THRESHOLD_PX,
+        Config.CAPTURE_MAX_HEIGHT,
+        Config.CAPTURE_MAX_PIXELS,
+        Config.CAPTURE_OVERSIZE,
+        Config.RENDER_ENGINE,
+        Config.NATIVE_FONT_PATH,
+        Config.NATIVE_MAX_MESSAGES,
+        Config.NATIVE_PNG_COMPRESS_LEVEL,
+    )
+    canon = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    h = hashlib.sha256()
+    h.update(canon.encode("utf-8"))
+    h.update(f"|{fmt}|{variant}|{TEMPLATE_VERSION}|{knobs!r}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _build_render_cache() -> Optional[TieredCache]:
+    if Config.RENDER_CACHE_MAX_BYTES <= 0 and not Config.RENDER_CACHE_DIR:
+        return None
+    return TieredCache(
+        Config.RENDER_CACHE_MAX_BYTES,
+        Config.RENDER_CACHE_DIR or None,
+        Config.RENDER_CACHE_DISK_MAX_BYTES,
+    )
+
+
+render_cache: Optional[TieredCache] = _build_render_cache()
@@ -0,0 +1,381 @@
+# encode_pool.py
+"""
+动图合成/编码进程池：iter_compose_animation 在独立子进程中执行，合成吞吐随 CPU 核数扩展，
+不再与浏览器池和 gunicorn worker 的 GIL 争用。
+- 输入经共享内存：底图 PNG 与各资产的 (n, h, w, 4) 帧数组拷入同一块 SharedMemory，
+  子进程按偏移建只读 numpy 视图（不拷贝）还原 AnimatedAsset；管道上只传坐标、时长等描述信息
+- 输出按块回传：delta/fast APNG 仍是边编码边产出，流式响应语义不变
+- 有界：每个 gunicorn worker 最多 ENCODE_WORKERS 个子进程；等待空闲子进程的任务超过 ENCODE_MAX_QUEUED
+  或等待超过 ENCODE_ACQUIRE_TIMEOUT_SEC 时抛 EncodeBusy
+- 单任务超时 ENCODE_TIMEOUT_SEC（只计子进程计算时间，不含消费方写出）：超时即杀掉子进程，按需补位
+- 崩溃隔离：子进程段错误/被 OOM kill 只让当前任务失败（EncodeWorkerDied），不影响 gunicorn worker
+- 子进程以独立解释器启动（而非 fork：gunicorn worker 内已有线程与浏览器连接），首次使用时按需创建，
+  处理 ENCODE_WORKER_MAX_JOBS 个任务后回收；其指标与阶段耗时随任务结果回传并入父进程
+"""
+import os
+import sys
+import time
+import signal
+import builtins
+import threading
+import subprocess
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Connection, Pipe
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from utils import Config
+import metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_ALIGN = 64
+
+
+class EncodeBusy(TimeoutError):
+    """没有空闲的编码子进程（排队已满或等待超时）"""
+
+
+class EncodeTimeout(TimeoutError):
+    """任务在子进程内超过 ENCODE_TIMEOUT_SEC，子进程已被杀掉"""
+
+
+class EncodeWorkerDied(RuntimeError):
+    """子进程在任务中途退出（崩溃、被杀）"""
+
+
+def _frame_pixels(frames) -> "np.ndarray":
+    """FrameStack 直接取底层数组；其它帧序列逐帧堆叠"""
+    import numpy as np
+    pixels = getattr(frames, "pixels", None)
+    if pixels is None:
+        pixels = np.stack([np.asarray(im.convert("RGBA")) for im in frames])
+    return pixels
+
+
+# ----------------- 子进程 -----------------
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name)
+    # 段归父进程所有：子进程自己的 resource_tracker 不应在退出时清理它
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _run_job(conn: Connection, job: dict) -> None:
+    from fractions import Fraction
+    import numpy as np
+    from anim import AnimatedAsset, FrameStack, iter_compose_animation
+
+    shm = _attach(job["shm"])
+    tr, token = metrics.begin_trace()
+    try:
+        off, n = job["base"]
+        base_png = bytes(shm.buf[off:off + n])
+        assets = []
+        for a in job["assets"]:
+            pixels = np.ndarray(a["shape"], dtype=np.uint8, buffer=shm.buf, offset=a["offset"])
+            pixels.flags.writeable = False
+            assets.append(AnimatedAsset(
+                placeholder_id=a["placeholder_id"],
+                display_size=a["display_size"],
+                frames_rgba=FrameStack(pixels),
+                durations_frac=[Fraction(p, q) for p, q in a["durations"]],
+                cum_ticks=list(a["cum_ticks"]),
+                period_ticks=a["period_ticks"],
+                content_hash=a["content_hash"],
+            ))
+        try:
+            for chunk in iter_compose_animation(base_png, job["placements"], assets, job["fmt"], job["apng_mode"],
+                                                job["preset"]):
+                conn.send(("chunk", chunk))
+        except Exception as e:
+            conn.send(("error", type(e).__name__, str(e), metrics.drain(), dict(tr.stages)))
+            return
+        conn.send(("done", metrics.drain(), dict(tr.stages)))
+    finally:
+        metrics.end_trace(token)
+        assets = pixels = None
+        try:
+            shm.close()
+        except BufferError:
+            pass  # 仍有帧视图被引用（记忆化缓存等）：映射随子进程回收释放
+
+
+def _child_main(fd: int) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 随父进程退出（管道关闭），不单独响应终端 Ctrl-C
+    conn = Connection(fd)
+    import anim  # noqa: F401  预先导入，首个任务不承担导入耗时
+    conn.send(("ready", os.getpid()))
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return  # 父进程已退出
+        if job is None:
+            return
+        try:
+            _run_job(conn, job)
+        except (BrokenPipeError, EOFError, OSError):
+            return
+
+
+# ----------------- 父进程 -----------------
+
+class _Worker:
+    __slots__ = ("proc", "conn", "jobs")
+
+    def __init__(self):
+        parent, child = Pipe(duplex=True)
+        env = dict(os.environ, METRICS_DIR="", PROFILE_SAMPLE_RATE="0")  # 指标随任务结果回传，子进程不写快照
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(child.fileno())],
+                pass_fds=(child.fileno(),), env=env, stdin=subprocess.DEVNULL,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+        finally:
+            child.close()
+        self.conn = parent
+        self.jobs = 0
+        if not parent.poll(Config.ENCODE_TIMEOUT_SEC):
+            self.kill()
+            raise EncodeWorkerDied("encode worker did not start")
+        try:
+            parent.recv()  # ("ready", pid)
+        except (EOFError, OSError):
+            self.kill()
+            raise EncodeWorkerDied("encode worker exited during startup")
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def kill(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.conn.close()
+
+    def stop(self) -> None:
+        """正常回收：通知退出，不等待"""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+        threading.Thread(target=self._reap, daemon=True).start()
+
+    def _reap(self) -> None:
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def _raise_remote(name: str, message: str):
+    """子进程内的内置异常按原类型重新抛出（如 apngasm 未安装的 ImportError），其余包装为 RuntimeError"""
+    exc = getattr(builtins, name, None)
+    if isinstance(exc, type) and issubclass(exc, Exception):
+        raise exc(message)
+    raise RuntimeError(f"{name}: {message}")
+
+
+class EncodePool:
+    def __init__(self, size: int, max_queued: int):
+        self.size = max(1, size)
+        self.max_queued = max(0, max_queued)
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._idle: List[_Worker] = []
+        self._total = 0          # 含正在启动的
+        self._busy = 0
+        self._waiting = 0
+        self._closed = False
+        self.jobs = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.recycled = 0
+
+    # ---------- 获取 / 归还 ----------
+
+    def _acquire(self, timeout: float) -> _Worker:
+        t0 = time.monotonic()
+        end = t0 + timeout
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()  # 创建后被 fork：子进程与管道属于父进程
+            if self._closed:
+                raise RuntimeError("EncodePool is shut down")
+            if not self._idle and self._total >= self.size and self._waiting >= self.max_queued:
+                self.rejected += 1
+                raise EncodeBusy("encode queue is full")
+            self._waiting += 1
+            try:
+                while not self._idle and self._total >= self.size:
+                    remain = end - time.monotonic()
+                    if remain <= 0:
+                        self.rejected += 1
+                        raise EncodeBusy("No free encode worker")
+                    self._cond.wait(remain)
+            finally:
+                self._waiting -= 1
+            w = self._idle.pop() if self._idle else None
+            if w is None:
+                self._total += 1
+            self._busy += 1
+        if w is None:
+            try:
+                w = _Worker()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._busy -= 1
+                    self._cond.notify()
+                raise
+        metrics.record("encode_wait", time.monotonic() - t0)
+        return w
+
+    def _release(self, w: _Worker, broken: bool) -> None:
+        w.jobs += 1
+        with self._cond:
+            self._busy -= 1
+            self.jobs += 1
+            if broken or self._closed or self._pid != os.getpid():
+                self._total -= 1
+                w.kill()
+            elif w.jobs >= Config.ENCODE_WORKER_MAX_JOBS or not w.alive():
+                self._total -= 1
+                self.recycled += 1
+                w.stop()
+            else:
+                self._idle.append(w)
+            self._cond.notify()
+
+    # ---------- 提交 ----------
+
+    @staticmethod
+    def _pack(base_png: bytes, assets) -> Tuple[shared_memory.SharedMemory, dict]:
+        """底图与帧数组按 64 字节对齐拷入一块共享内存，返回 (段, 描述)"""
+        import numpy as np
+        stacks = [_frame_pixels(a.frames_rgba) for a in assets]
+        layout, off = [], len(base_png)
+        for px in stacks:
+            off = (off + _ALIGN - 1) // _ALIGN * _ALIGN
+            layout.append(off)
+            off += px.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(1, off))
+        try:
+            shm.buf[:len(base_png)] = base_png
+            for px, o in zip(stacks, layout):
+                view = np.ndarray(px.shape, dtype=np.uint8, buffer=shm.buf, offset=o)
+                view[...] = px
+                del view
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        desc = {
+            "shm": shm.name,
+            "base": (0, len(base_png)),
+            "assets": [{
+                "placeholder_id": a.placeholder_id,
+                "display_size": tuple(a.display_size),
+                "shape": px.shape,
+                "offset": o,
+                "durations": [(d.numerator, d.denominator) for d in a.durations_frac],
+                "cum_ticks": list(a.cum_ticks),
+                "period_ticks": a.period_ticks,
+                "content_hash": a.content_hash,
+            } for a, px, o in zip(assets, stacks, layout)],
+        }
+        return shm, desc
+
+    def compose(
+        self,
+        base_png: bytes,
+        placements: Dict[str, Tuple[int, int, int, int]],
+        assets: list,
+        fmt: str = "APNG",
+        apng_mode: Optional[str] = None,
+        preset: Optional[str] = None,
+        acquire_timeout: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[bytes]:
+        """与 anim.iter_compose_animation 同参数同产出；迭代器被提前关闭（客户端断开）时杀掉子进程"""
+        limit = budget = Config.ENCODE_TIMEOUT_SEC if timeout is None else timeout
+        w = self._acquire(Config.ENCODE_ACQUIRE_TIMEOUT_SEC if acquire_timeout is None else acquire_timeout)
+        shm, broken = None, True
+        try:
+            shm, job = self._pack(base_png, assets)
+            job.update(placements=dict(placements), fmt=fmt, apng_mode=apng_mode, preset=preset)
+            w.conn.send(job)
+            while True:
+                t0 = time.monotonic()
+                ready = w.conn.poll(max(0.0, budget))
+                budget -= time.monotonic() - t0
+                if not ready:
+                    with self._cond:
+                        self.timeouts += 1
+                    raise EncodeTimeout(f"encode job exceeded {limit:g}s")
+                try:
+                    msg = w.conn.recv()
+                except (EOFError, OSError):
+                    with self._cond:
+                        self.crashes += 1
+                    w.proc.wait()
+                    raise EncodeWorkerDied(f"encode worker exited with code {w.proc.returncode}")
+                if msg[0] == "chunk":
+                    yield msg[1]
+                    continue
+                broken = False
+                if msg[0] == "error":
+                    metrics.merge(msg[3], msg[4])
+                    _raise_remote(msg[1], msg[2])
+                metrics.merge(msg[1], msg[2])
+                return
+        finally:
+            self._release(w, broken)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_size": self.size,
+                "total": self._total,
+                "busy": self._busy,
+                "idle": len(self._idle),
+                "queue_depth": self._waiting,
+                "max_queued": self.max_queued,
+                "jobs": self.jobs,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes,
+                "recycled": self.recycled,
+            }
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for w in idle:
+            w.stop()
+
+
+encode_pool: Optional[EncodePool] = (
+    EncodePool(Config.ENCODE_WORKERS, Config.ENCODE_MAX_QUEUED) if Config.ENCODE_WORKERS > 0 else None
+)
+
+
+if __name__ == "__main__":
+    _child_main(int(sys.argv[1]))
@@ -0,0 +1,381 @@
+# encoders.py
+import io
+import os
+import zlib
+import struct
+import tempfile
+import itertools
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+from PIL import Image, TiffImagePlugin
+
+from utils import Config
+
+# 帧矩形：(x0, y0, x1, y1)，相对整张画布
+Rect = Tuple[int, int, int, int]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# APNG 编码方式：delta（子矩形帧）| fast（子矩形帧 + 低压缩级别）| apngasm（整帧交给 apngasm 优化）
+APNG_MODES = ("delta", "fast", "apngasm")
+
+# APNG fcTL 常量
+APNG_DISPOSE_OP_NONE = 0
+APNG_BLEND_OP_SOURCE = 0
+
+# GIF Graphic Control Extension：disposal 1 = 保留（下一帧叠加在其上）
+GIF_DISPOSAL_KEEP = 1
+
+
+# ----------------- APNG（子矩形帧） -----------------
+
+def _png_chunk(ctype: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data) & 0xFFFFFFFF)
+
+
+def _png_idat_payload(im: Image.Image, compress_level: int) -> bytes:
+    """借用 Pillow 的 PNG 编码器（含逐行滤波），取出拼接后的 IDAT 数据"""
+    bio = io.BytesIO()
+    im.save(bio, format="PNG", compress_level=compress_level)
+    b = bio.getvalue()
+    pos, out = 8, []
+    while pos + 8 <= len(b):
+        length, ctype = struct.unpack_from(">I4s", b, pos)
+        if ctype == b"IDAT":
+            out.append(b[pos + 8:pos + 8 + length])
+        elif ctype == b"IEND":
+            break
+        pos += 12 + length
+    return b"".join(out)
+
+
+def _fit_u16_delay(num: int, den: int) -> Tuple[int, int]:
+    """fcTL 的 delay_num/delay_den 均为 u16"""
+    while num > 0xFFFF or den > 0xFFFF:
+        num, den = (num + 1) // 2, max(1, den // 2)
+    return num, den
+
+
+def _frames_mode(first: Image.Image) -> str:
+    """底图完全不透明时用 RGB 输出（体积约小 1/4）"""
+    if first.mode != "RGBA":
+        return "RGB"
+    lo, _ = first.getchannel("A").getextrema()
+    return "RGB" if lo == 255 else "RGBA"
+
+
+def iter_apng_delta(
+    frames: Iterable[Image.Image],
+    rects: List[Rect],
+    delays: List[Tuple[int, int]],
+    canvas_size: Tuple[int, int],
+    loops: int = 0,
+    compress_level: int = None,
+) -> Iterator[bytes]:
+    """
+    子矩形 APNG，逐帧产出字节块（可直接作为 HTTP 流式响应体）；frames 可为惰性迭代器，
+    帧数取自 delays（acTL 需预先写入）：
+    - 第 0 帧为整张画布（同时作为默认图 IDAT）
+    - 其余帧只含变化区域，fcTL 写入偏移；dispose=NONE + blend=SOURCE，
+      即直接覆盖该矩形（补丁已含底图，无需混合）
+    """
+    if compress_level is None:
+        compress_level = Config.APNG_COMPRESS_LEVEL
+    W, H = canvas_size
+    frames = iter(frames)
+    first = next(frames)
+    mode = _frames_mode(first)
+    color_type = 6 if mode == "RGBA" else 2
+    yield (PNG_SIGNATURE
+           + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", W, H, 8, color_type, 0, 0, 0))
+           + _png_chunk(b"acTL", struct.pack(">II", len(delays), loops)))
+    frames = itertools.chain([first], frames)
+    seq = 0
+    for i, (im, (x0, y0, x1, y1), (num, den)) in enumerate(zip(frames, rects, delays)):
+        num, den = _fit_u16_delay(num, den)
+        fctl = _png_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", seq, x1 - x0, y1 - y0, x0, y0, num, den,
+            APNG_DISPOSE_OP_NONE, APNG_BLEND_OP_SOURCE,
+        ))
+        seq += 1
+        payload = _png_idat_payload(im.convert(mode) if im.mode != mode else im, compress_level)
+        if i == 0:
+            yield fctl + _png_chunk(b"IDAT", payload)
+        else:
+            yield fctl + _png_chunk(b"fdAT", struct.pack(">I", seq) + payload)
+            seq += 1
+    yield _png_chunk(b"IEND", b"")
+
+
+def encode_apng_delta(
+    frames: Iterable[Image.Image],
+    rects: List[Rect],
+    delays: List[Tuple[int, int]],
+    canvas_size: Tuple[int, int],
+    loops: int = 0,
+    compress_level: int = None,
+) -> bytes:
+    return b"".join(iter_apng_delta(frames, rects, delays, canvas_size, loops, compress_level))
+
+
+def _assemble_in_memory(binder) -> bytes:
+    """
+    apngasm 只能 assemble 到文件路径：Linux 下写入匿名内存文件（memfd，经 /proc/self/fd 访问），
+    不落盘、不产生目录项；其他平台退回临时目录
+    """
+    if hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd"):
+        fd = os.memfd_create("apng", os.MFD_CLOEXEC)
+        try:
+            if not binder.assemble(f"/proc/self/fd/{fd}"):
+                raise RuntimeError("apngasm assemble failed")
+            return os.pread(fd, os.fstat(fd).st_size, 0)
+        finally:
+            os.close(fd)
+    with tempfile.TemporaryDirectory() as td:
+        tmp = os.path.join(td, "out.apng")
+        if not binder.assemble(tmp):
+            raise RuntimeError("apngasm assemble failed")
+        with open(tmp, "rb") as f:
+            return f.read()
+
+
+def encode_apng_apngasm(full_frames: Iterable[Image.Image], delays: List[Tuple[int, int]], loops: int = 0) -> bytes:
+    """整帧交给 apngasm（自带帧间优化与调色板/色彩类型缩减），结果直接取回内存"""
+    from apngasm_python.apngasm import APNGAsmBinder
+
+    ap = APNGAsmBinder()
+    ap.set_loops(loops)  # 0 = infinite loop
+    for img, (num, den) in zip(full_frames, delays):
+        ap.add_frame_from_pillow(img.convert("RGBA"), delay_num=num, delay_den=den)
+    return _assemble_in_memory(ap)
+
+
+# ----------------- GIF（子矩形帧） -----------------
+
+def _skip_subblocks(b: bytes, pos: int) -> int:
+    while True:
+        n = b[pos]
+        pos += 1
+        if n == 0:
+            return pos
+        pos += n
+
+
+def _gif_image_block(p_img: Image.Image, optimize: bool = True) -> Tuple[bytes, bytes, int]:
+    """
+    用 Pillow 编码单帧 GIF，拆出 (调色板, LZW 数据块, 隔行标志位)，
+    以便重新封装为带偏移与局部调色板的帧。
+    optimize=False 时 Pillow 不会裁剪/重排调色板，下标与输入一致（全局调色板依赖这一点）
+    """
+    bio = io.BytesIO()
+    p_img.save(bio, format="GIF", interlace=False, optimize=optimize)
+    b = bio.getvalue()
+    flags = b[10]
+    pos = 13
+    palette = b""
+    if flags & 0x80:
+        n = 3 * (2 << (flags & 7))
+        palette = b[pos:pos + n]
+        pos += n
+    while b[pos] == 0x21:  # 跳过 Pillow 写入的扩展块
+        pos = _skip_subblocks(b, pos + 2)
+    if b[pos] != 0x2C:
+        raise ValueError("unexpected GIF layout")
+    lflags = b[pos + 9]
+    pos += 10
+    if lflags & 0x80:
+        n = 3 * (2 << (lflags & 7))
+        palette = b[pos:pos + n]
+        pos += n
+    end = _skip_subblocks(b, pos + 1)
+    return palette, b[pos:end], lflags & 0x40
+
+
+def _palette_size_bits(palette: bytes) -> int:
+    entries = max(2, len(palette) // 3)
+    bits = max(0, (entries - 1).bit_length() - 1)
+    return min(bits, 7)
+
+
+def quantize_frame(im: Image.Image, colors: int = None) -> Image.Image:
+    return im.convert("RGB").convert("P", palette=Image.ADAPTIVE, colors=colors or Config.GIF_COLORS)
+
+
+def encode_gif_delta(
+    frames: Iterable[Image.Image],
+    rects: List[Rect],
+    delays_ms: List[int],
+    canvas_size: Tuple[int, int],
+    loops: int = 0,
+    quantize=quantize_frame,
+    palette: bytes = None,
+) -> bytes:
+    """
+    子矩形 GIF：每帧带 (left, top) 偏移，disposal=1（保留上一帧），
+    因此第 1 帧之后只需编码变化区域。
+    - palette=None：每帧用 quantize 单独量化，写局部调色板
+    - palette 给定：写一份全局调色板，frames 须为已映射到该调色板的 P 模式帧
+    """
+    W, H = canvas_size
+    if palette is None:
+        out = [b"GIF89a", struct.pack("<HHBBB", W, H, 0, 0, 0)]
+    else:
+        gbits = _palette_size_bits(palette)
+        palette = palette.ljust(3 * (2 << gbits), b"\x00")
+        out = [b"GIF89a", struct.pack("<HHBBB", W, H, 0x80 | (7 << 4) | gbits, 0, 0), palette]
+    # NETSCAPE2.0 循环扩展
+    out.append(b"\x21\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", loops) + b"\x00")
+    for im, (x0, y0, x1, y1), ms in zip(frames, rects, delays_ms):
+        cs = max(0, int(round(ms / 10.0)))
+        out.append(b"\x21\xF9\x04" + struct.pack("<BHB", GIF_DISPOSAL_KEEP << 2, cs, 0) + b"\x00")
+        if palette is not None:
+            _, lzw, interlace = _gif_image_block(im, optimize=False)
+            out.append(b"\x2C" + struct.pack("<HHHHB", x0, y0, x1 - x0, y1 - y0, interlace))
+            out.append(lzw)
+            continue
+        p_img = im if im.mode == "P" else quantize(im)
+        local, lzw, interlace = _gif_image_block(p_img)
+        bits = _palette_size_bits(local)
+        local = local.ljust(3 * (2 << bits), b"\x00")
+        out.append(b"\x2C" + struct.pack("<HHHHB", x0, y0, x1 - x0, y1 - y0, 0x80 | interlace | bits))
+        out.append(local)
+        out.append(lzw)
+    out.append(b"\x3B")
+    return b"".join(out)
+
+
+# ----------------- 工具 -----------------
+
+def expand_delta_frames(frames: Iterable[Image.Image], rects: List[Rect]):
+    """把子矩形帧还原为整图帧序列（供只接受整帧的编码器，如 apngasm）"""
+    import numpy as np
+    frames = iter(frames)
+    first = next(frames)
+    canvas = np.array(first)
+    yield first
+    for im, (x0, y0, x1, y1) in zip(frames, rects[1:]):
+        canvas[y0:y1, x0:x1] = np.asarray(im)
+        yield Image.fromarray(canvas.copy(), first.mode)
+
+
+# ----------------- 长图拼接（逐条带写 PNG） -----------------
+
+class StitchedPng:
+    """
+    按从上到下的条带增量写出一张 PNG：每条带滤波（Up）后立即送入同一个 zlib 流，
+    内存只持有当前条带与已压缩的输出，与整图高度无关。
+    条带宽度须等于 width，总行数须恰为 height
+    """
+
+    def __init__(self, width: int, height: int, mode: str = "RGB", compress_level: int = 6):
+        if mode not in ("RGB", "RGBA"):
+            raise ValueError(f"unsupported mode: {mode}")
+        self.width, self.height, self.mode = width, height, mode
+        self.rows = 0
+        self._z = zlib.compressobj(compress_level)
+        self._prev = None  # 上一条带的最后一行，供下一条带首行做 Up 滤波
+        color_type = 6 if mode == "RGBA" else 2
+        ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+        self._out = [PNG_SIGNATURE, _png_chunk(b"IHDR", ihdr)]
+
+    def add(self, strip: Image.Image) -> None:
+        import numpy as np
+        if strip.width != self.width:
+            raise ValueError(f"strip width {strip.width} != {self.width}")
+        if self.rows + strip.height > self.height:
+            raise ValueError("strips exceed the declared height")
+        px = np.asarray(strip if strip.mode == self.mode else strip.convert(self.mode))
+        h = px.shape[0]
+        rows = px.reshape(h, -1)
+        above = np.empty_like(rows)
+        above[0] = self._prev if self._prev is not None else 0
+        above[1:] = rows[:-1]
+        raw = np.empty((h, rows.shape[1] + 1), dtype=np.uint8)
+        raw[:, 0] = 2  # 滤波类型 Up：语录背景纵向大片相同，逐行差分后几乎全零
+        np.subtract(rows, above, out=raw[:, 1:])
+        self._prev = rows[-1].copy()
+        self.rows += h
+        data = self._z.compress(raw.tobytes())
+        if data:
+            self._out.append(_png_chunk(b"IDAT", data))
+
+    def finish(self) -> bytes:
+        if self.rows != self.height:
+            raise ValueError(f"stitched {self.rows} rows, expected {self.height}")
+        self._out.append(_png_chunk(b"IDAT", self._z.flush()))
+        self._out.append(_png_chunk(b"IEND", b""))
+        out = b"".join(self._out)
+        self._out = []
+        return out
+
+
+# ----------------- WebP / AVIF（整帧，交给 libwebp / libavif 的动画编码器） -----------------
+
+# 质量/速度预设：fast（编码最快）| balanced（默认）| small（最慢、体积最小）| high（WebP 无损；AVIF 高质量 4:4:4）
+# WebP 关闭周期关键帧（kmax=0）：语录里只有动图区域在变，关键帧会反复整张重编码，体积翻数倍；
+# allow_mixed 让 libwebp 逐帧在有损/无损间取小者（平涂的表情包常是无损更小）；minimize_size 慢一个数量级，不用
+_WEBP_NO_KEYFRAMES = {"kmin": 0, "kmax": 0}
+ANIM_PRESETS = {
+    "WEBP": {
+        "fast": {"quality": 75, "method": 0, **_WEBP_NO_KEYFRAMES},
+        "balanced": {"quality": 80, "method": 4, "allow_mixed": True, **_WEBP_NO_KEYFRAMES},
+        "small": {"quality": 70, "method": 6, "allow_mixed": True, **_WEBP_NO_KEYFRAMES},
+        "high": {"lossless": True, "quality": 50, "method": 1, **_WEBP_NO_KEYFRAMES},
+    },
+    "AVIF": {
+        "fast": {"quality": 60, "speed": 10},
+        "balanced": {"quality": 65, "speed": 8},
+        "small": {"quality": 55, "speed": 5},
+        "high": {"quality": 90, "speed": 6, "subsampling": "4:4:4"},
+    },
+}
+
+
+def format_available(fmt: str) -> bool:
+    """本机 Pillow 是否带对应编码器（AVIF 需 Pillow 11.2+ 且编译了 libavif）"""
+    from PIL import features
+    name = fmt.lower()
+    return name in features.modules and features.check_module(name)  # 旧版 Pillow 不认识 avif，check() 会告警
+
+
+@contextmanager
+def _spooled_frames(frames: Iterable[Image.Image]) -> Iterator[Image.Image]:
+    """
+    整帧逐页写入临时的未压缩多页 TIFF，再作为 Pillow 的多帧图像打开交给 save_all：
+    编码器 seek 到哪页才读哪页，任一时刻只持有一帧（append_images 会被 list() 物化，不能用于长动画）
+    """
+    with tempfile.TemporaryFile(prefix="qq-quote-frames-") as spool:
+        with TiffImagePlugin.AppendingTiffWriter(spool, new=True) as tf:
+            for im in frames:
+                im.save(tf, "TIFF")
+                tf.newFrame()
+        spool.seek(0)
+        with Image.open(spool) as seq:
+            yield seq
+
+
+def encode_webp_avif(
+    fmt: str,
+    full_frames: Iterable[Image.Image],
+    durations_ms: List[int],
+    preset: str = "balanced",
+    loop: int = 0,
+) -> bytes:
+    """
+    整帧序列 -> 动画 WebP / AVIF（帧间优化由 libwebp / libavif 完成）。
+    durations_ms 为毫秒整数；0ms 的帧直接丢弃（其后一帧在同一时刻替换它），不改变其余帧的时刻
+    """
+    fmt = fmt.upper()
+    keep = [d > 0 for d in durations_ms]
+    if not any(keep):
+        keep[0], durations_ms = True, [1] + list(durations_ms[1:])
+    frames = (im for im, k in zip(full_frames, keep) if k)
+    durs = [d for d, k in zip(durations_ms, keep) if k]
+    bio = io.BytesIO()
+    if len(durs) == 1:
+        next(frames).save(bio, format=fmt, **ANIM_PRESETS[fmt][preset])
+        return bio.getvalue()
+    with _spooled_frames(frames) as seq:
+        seq.save(bio, format=fmt, save_all=True, duration=durs, loop=loop, **ANIM_PRESETS[fmt][preset])
+    return bio.getvalue()
@@ -0,0 +1,217 @@
+# jobs.py
+"""
+异步任务：POST /jobs 入队即返回 id，GET /jobs/<id> 轮询/长轮询结果。
+- 进程内有界优先级队列：interactive 先于 bulk，同级 FIFO；排满时抛 QueueFull（附 Retry-After 估计）
+- 动图任务（合成 + 编码耗时长）同时执行数受限，始终留出执行线程给静态 PNG，慢任务不会饿死快任务
+- 每个任务有绝对截止时间：开始前已过期直接 expired；浏览器获取等待不超过剩余时间；阶段之间检查截止与取消
+- 状态与结果写入共享 job_store，轮询/取消可落到任意 gunicorn worker；执行只发生在接收任务的 worker 内
+"""
+import math
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from utils import Config
+from store import JOB_FINAL
+
+PRIORITIES = ("interactive", "bulk")
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobExpired(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    fmt: str
+    payload: Any
+    priority: str = "interactive"
+    deadline: float = 0.0        # time.time() 绝对时间
+    animated: bool = False
+    options: Dict[str, Any] = field(default_factory=dict)
+    done: threading.Event = field(default_factory=threading.Event)
+    cancelled: bool = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.time()
+
+    def checkpoint(self, store) -> None:
+        """阶段之间调用：取消（含其它 worker 写入的取消标记）或过期则中止"""
+        if self.cancelled or store.cancel_requested(self.id):
+            raise JobCancelled()
+        if self.remaining() <= 0:
+            raise JobExpired()
+
+
+class JobQueue:
+    """
+    runner(job) -> (body, mimetype)：在任务线程内执行真正的渲染，可多次调用 job.checkpoint(store)
+    执行线程在首次提交时才启动（gunicorn fork 之后）
+    """
+
+    def __init__(self, runner: Callable[[Job], Tuple[bytes, str]], store, workers: int = None,
+                 max_queued: int = None, max_animated: int = None):
+        self.runner = runner
+        self.store = store
+        # 至少 2 个执行线程、动图至多占 workers - 1 个：任何时候都留有一个线程给静态 PNG
+        self.workers = max(2, workers if workers is not None else Config.JOBS_WORKERS)
+        self.max_queued = max(1, max_queued if max_queued is not None else Config.JOBS_MAX_QUEUED)
+        cap = max_animated if max_animated is not None else Config.JOBS_MAX_ANIMATED
+        self.max_animated = min(self.workers - 1, cap) if cap > 0 else self.workers - 1
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[Job]] = {p: deque() for p in PRIORITIES}
+        self._local: Dict[str, Job] = {}  # 本进程排队中/执行中的任务
+        self._running = 0
+        self._running_animated = 0
+        self._threads_started = False
+        self._durations: Deque[float] = deque(maxlen=64)
+        # 指标
+        self.submitted = 0
+        self.rejected = 0
+        self.finished = {s: 0 for s in JOB_FINAL}
+
+    # ---------- 提交 / 取消 ----------
+
+    def _queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def retry_after(self) -> int:
+        """按近期平均耗时估算排空一个位置所需秒数"""
+        avg = sum(self._durations) / len(self._durations) if self._durations else 2.0
+        return max(1, int(math.ceil(avg * (self._queued() + 1) / self.workers)))
+
+    def submit(self, job: Job) -> None:
+        if job.priority not in PRIORITIES:
+            raise ValueError(f"unknown priority: {job.priority}")
+        with self._cond:
+            if self._queued() >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+            self.store.create(job.id, {"format": job.fmt, "priority": job.priority, "deadline": job.deadline})
+            self._queues[job.priority].append(job)
+            self._local[job.id] = job
+            self.submitted += 1
+            self._ensure_threads()
+            self._cond.notify()
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        取消任务：排队中的直接出队；执行中的打标记，在下一个检查点中止（浏览器/编码调用本身不可打断）。
+        返回取消前的状态；任务不存在为 None
+        """
+        status = self.store.request_cancel(job_id)
+        with self._cond:
+            job = self._local.get(job_id)
+            if job is None:
+                return status
+            job.cancelled = True
+            dequeued = False
+            for q in self._queues.values():
+                if job in q:
+                    q.remove(job)
+                    self._local.pop(job_id, None)
+                    dequeued = True
+                    break
+        if dequeued:
+            self._finish(job, "cancelled", http_status=410, error="cancelled")  # 写 store 可能落盘，不持锁
+            return "queued"
+        return status
+
+    def local(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._local.get(job_id)
+
+    # ---------- 执行 ----------
+
+    def _ensure_threads(self) -> None:
+        """调用方须持有 self._cond"""
+        if self._threads_started:
+            return
+        self._threads_started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"job-{i}", daemon=True).start()
+
+    def _next(self) -> Optional[Job]:
+        """优先级从高到低取第一个可执行任务；动图名额已满时跳过动图任务。调用方须持有 self._cond"""
+        for p in PRIORITIES:
+            q = self._queues[p]
+            for job in q:
+                if job.animated and self._running_animated >= self.max_animated:
+                    continue
+                q.remove(job)
+                return job
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = self._next()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next()
+                self._running += 1
+                if job.animated:
+                    self._running_animated += 1
+            t0 = time.monotonic()
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if job.animated:
+                        self._running_animated -= 1
+                    self._local.pop(job.id, None)
+                    self._durations.append(time.monotonic() - t0)
+                    self._cond.notify_all()  # 释放的动图名额可能让其它线程取到任务
+
+    def _run(self, job: Job) -> None:
+        try:
+            job.checkpoint(self.store)
+            self.store.update(job.id, "running")
+            body, mimetype = self.runner(job)
+        except JobCancelled:
+            self._finish(job, "cancelled", http_status=410, error="cancelled")
+        except JobExpired:
+            self._finish(job, "expired", http_status=504, error="deadline exceeded")
+        except TimeoutError as e:
+            self._finish(job, "failed", http_status=503, error=str(e) or "timeout")
+        except Exception as e:
+            self._finish(job, "failed", http_status=500, error=str(e) or type(e).__name__)
+        else:
+            self._finish(job, "done", result=body, http_status=200, mimetype=mimetype)
+
+    def _finish(self, job: Job, status: str, result: Optional[bytes] = None, **fields) -> None:
+        try:
+            self.store.update(job.id, status, result=result, **fields)
+        finally:
+            self.finished[status] += 1
+            job.payload = None
+            job.done.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "max_animated": self.max_animated,
+                "queued": {p: len(q) for p, q in self._queues.items()},
+                "running": self._running,
+                "running_animated": self._running_animated,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "finished": dict(self.finished),
+                "avg_sec": round(sum(self._durations) / len(self._durations), 3) if self._durations else 0.0,
+            }
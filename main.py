@@ -1,15 +1,54 @@
+import time
+
+_STARTED = time.monotonic()  # 启动计时起点：main 开始导入
+
 import io
+import os
+import re
+import sys
+import json
+import base64
+import zipfile
+import threading
 from uuid import uuid4
-from flask import Flask, render_template, request, send_file
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional
+from flask import Flask, Response, render_template, request, send_file, jsonify, abort, make_response
 
 from utils import Config
-from screenshot import Screenshot
-from anim import prepare_animated_asset, compose_animation_event_driven
+from cache import render_cache, render_cache_key, asset_cache
+from media import media_cache, is_remote, MediaTooLarge
+from store import payload_store, job_store, JOB_FINAL
+from jobs import Job, JobQueue, JobExpired, QueueFull, PRIORITIES
+from screenshot import Screenshot, CaptureTooLarge
+import native
+import metrics
+from metrics import stage, RENDERS, OUTPUT_BYTES, REQUEST_SECONDS
+from encode_pool import encode_pool, EncodeBusy
+from encoders import APNG_MODES, ANIM_PRESETS, format_available
+# anim（连带 numpy、timeline、quantize）在首次遇到图片时才导入，见 _prepare_one / _compose_chunks
 
 app = Flask(__name__)
 
-data_dict = {}
-ss = Screenshot()  # 复用内部的 ScreenshotPool
+_startup = {}  # 启动里程碑 -> 距 main 开始导入的秒数（每种只记首次）
+_startup_lock = threading.Lock()
+
+
+def _startup_mark(phase: str) -> None:
+    """记录并打印启动里程碑：app（可接受请求）/ browser（首个浏览器就绪）/ render（首次浏览器渲染完成）"""
+    with _startup_lock:
+        if phase in _startup:
+            return
+        _startup[phase] = time.monotonic() - _STARTED
+    print(f"[startup] pid={os.getpid()} {phase} ready in {_startup[phase] * 1000.0:.0f} ms", file=sys.stderr, flush=True)
+
+
+ss = Screenshot(on_milestone=_startup_mark)  # 复用内部的 ScreenshotPool；浏览器在后台并行预热
+# 资产准备（下载/解码/缩放）全局线程池，大小即全局并发上限
+_asset_executor = ThreadPoolExecutor(max_workers=Config.ASSET_PREPARE_WORKERS, thread_name_prefix="asset")
+# 批量渲染的页面任务（每个任务租用一个浏览器 worker），大小与浏览器池上限一致
+_batch_executor = ThreadPoolExecutor(max_workers=max(1, Config.WORKER_POOL_SIZE), thread_name_prefix="batch")
 
 
 @app.after_request
@@ -18,70 +57,289 @@ def set_headers(response):
     return response
 
 
+_inflight = 0
+_inflight_lock = threading.Lock()
+
+
+@app.before_request
+def _begin_trace():
+    global _inflight
+    with _inflight_lock:
+        _inflight += 1
+    # 存于 WSGI environ（按请求隔离）：/quote/ 回访可能嵌套在同一应用上下文中
+    request.environ['qq.trace'] = metrics.begin_trace() + (metrics.profiler.start(),)
+
+
+@app.after_request
+def _finish_trace(response):
+    """
+    Server-Timing 只含响应头发出前的阶段（流式 APNG 的后续编码只进直方图）；
+    请求耗时与剖析在响应体发送完后记录
+    """
+    state = request.environ.pop('qq.trace', None)
+    if state is None:
+        return response
+    tr, token, tid = state
+    metrics.end_trace(token)
+    if Config.SERVER_TIMING:
+        response.headers["Server-Timing"] = tr.server_timing()
+    endpoint, method, status = request.endpoint or 'none', request.method, response.status_code
+
+    def done():
+        global _inflight
+        with _inflight_lock:
+            _inflight -= 1
+        elapsed = time.perf_counter() - tr.started
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=method, status=status)
+        if tid is not None:
+            metrics.profiler.stop(tid, elapsed * 1000.0, endpoint)
+    if response.direct_passthrough:
+        done()  # send_file 的直通响应不会触发 call_on_close；其响应体已在内存中，此刻即记录
+    else:
+        response.call_on_close(done)
+    return response
+
+
+@app.template_filter('media')
+def media_filter(src):
+    """远程图片改写为本地 /media/<key>，让浏览器与 anim 共用同一份下载缓存"""
+    if not Config.MEDIA_PROXY or not is_remote(src):
+        return src
+    return f"/media/{media_cache.register(src)}"
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     return 'see https://github.com/zhullyb/qq-quote-generator/blob/main/README.md'
 
 
+def _prepare_one(src: str):
+    """
+    先探测容器头：静态图只返回渲染尺寸（不解码像素），
+    仅真正的动图才做完整的逐帧提取。
+    返回 (AnimatedAsset 或 None, 渲染尺寸)
+    """
+    from anim import prepare_animated_asset, fetch_and_probe, display_size
+    content, probe = fetch_and_probe(src)
+    size = display_size(probe.size)
+    if not probe.animated:
+        return None, size
+    pid = f"anim-{uuid4().hex[:8]}"
+    asset = prepare_animated_asset(src, pid, border_radius_px=Config.IMAGE_BORDER_RADIUS_PX, content=content)
+    if len(asset.frames_rgba) <= 1:
+        return None, asset.display_size  # 容器声明动图但实际只有一帧
+    return asset, asset.display_size
+
+
 def _prepare_placeholders_and_assets(data_list):
     """
     遍历消息，下载并识别动图：
     - 静态图：保持字符串 URL
     - 动图(帧数>1)：替换为占位 dict {"id", "width", "height"}，并收集 AnimatedAsset
+    - 静态图的探测尺寸写入 block["image_sizes"]（与 image 对齐），供模板预先布局
+    下载/解码/缩放在全局线程池中并发执行：
+    - 单请求同时在途数 <= ASSET_PREPARE_PER_REQUEST
+    - 整体截止 ASSET_PREPARE_DEADLINE_SEC，超时未完成的图片退回静态
+    - 结果按原顺序回填
     """
-    assets = {}
+    jobs = []  # (block, index, src)
     for block in data_list:
         if "image" not in block:
             continue
-        new_images = []
-        for img in block["image"]:
-            if not isinstance(img, str):
-                new_images.append(img)
-                continue
+        block["image"] = list(block["image"])
+        block.pop("image_sizes", None)
+        for i, img in enumerate(block["image"]):
+            if isinstance(img, str):
+                jobs.append((block, i, img))
+    if not jobs:
+        return {}
+
+    results = [(None, None)] * len(jobs)
+    deadline = time.monotonic() + Config.ASSET_PREPARE_DEADLINE_SEC
+    limit = max(1, Config.ASSET_PREPARE_PER_REQUEST)
+    pending = {}
+    next_job = 0
+    while next_job < len(jobs) or pending:
+        while next_job < len(jobs) and len(pending) < limit:
+            fut = _asset_executor.submit(metrics.bind(_prepare_one), jobs[next_job][2])
+            pending[fut] = next_job
+            next_job += 1
+        remain = deadline - time.monotonic()
+        if remain <= 0:
+            break
+        done, _ = wait(pending, timeout=remain, return_when=FIRST_COMPLETED)
+        for fut in done:
+            j = pending.pop(fut)
             try:
-                pid = f"anim-{uuid4().hex[:8]}"
-                asset = prepare_animated_asset(img, pid, border_radius_px=Config.IMAGE_BORDER_RADIUS_PX)
-                if len(asset.frames_rgba) <= 1:
-                    new_images.append(img)  # 静态
-                else:
-                    w, h = asset.display_size
-                    new_images.append({"id": pid, "width": w, "height": h})
-                    assets[pid] = asset
+                results[j] = fut.result()
             except Exception:
                 # 下载/解析失败则退回静态
-                new_images.append(img)
-        block["image"] = new_images
+                results[j] = (None, None)
+    for fut in pending:
+        fut.cancel()
+
+    assets = {}
+    for (block, i, _), (asset, size) in zip(jobs, results):
+        if asset is None:
+            if size is not None:
+                block.setdefault("image_sizes", [None] * len(block["image"]))[i] = size
+            continue
+        w, h = asset.display_size
+        block["image"][i] = {"id": asset.placeholder_id, "width": w, "height": h}
+        assets[asset.placeholder_id] = asset
     return assets
 
 
-def _render_and_maybe_compose(ret_format: str):
+_MIMETYPES = {'png': 'image/png', 'apng': 'image/apng', 'gif': 'image/gif', 'webp': 'image/webp', 'avif': 'image/avif'}
+# 动图输出格式 -> iter_compose_animation 的 fmt；AVIF 仅在本机 Pillow 带编码器时提供
+_ANIMATED = {'apng': 'APNG', 'gif': 'GIF', 'webp': 'WEBP'}
+if format_available('AVIF'):
+    _ANIMATED['avif'] = 'AVIF'
+
+
+def _respond(ret_format: str, out: bytes):
+    if ret_format == 'base64':
+        return base64.b64encode(out).decode('ascii')
+    return send_file(io.BytesIO(out), mimetype=_MIMETYPES[ret_format])
+
+
+def _respond_stream(ret_format: str, first: bytes, rest, cache_key):
+    """
+    分块写回（APNG_STREAM=1）；全部发送完后再整体写入结果缓存（客户端中途断开则不缓存）。
+    状态码 200 已随首块发出，后续帧出错时无法再改为错误响应：异常继续向上抛出，
+    由 WSGI 服务器中断连接（分块传输缺少结束块），客户端据此识别为失败而非拿到截断的图片
+    """
+    def gen():
+        parts = [first]
+        yield first
+        for chunk in rest:
+            parts.append(chunk)
+            yield chunk
+        OUTPUT_BYTES.observe(sum(len(p) for p in parts), format=ret_format)
+        if cache_key is not None:
+            render_cache.put(cache_key, b"".join(parts))
+    return Response(gen(), mimetype=_MIMETYPES[ret_format])
+
+
+def _use_native(payload, ret_format: str, engine=None) -> bool:
+    """纯文本语录的静态输出交给 Pillow 原生渲染；engine=browser 或不支持的 payload 走浏览器"""
+    if ret_format not in ('png', 'base64') or (engine or Config.RENDER_ENGINE) == 'browser':
+        return False
+    return native.supports(payload)
+
+
+def _render_native(payload):
+    """原生渲染失败（字体/头像解码等意外）返回 None，由调用方退回浏览器"""
+    try:
+        with stage("native"):
+            return native.render_png(payload)
+    except Exception:
+        return None
+
+
+def _compose_chunks(base_png, boxes_map, assets, ret_format: str, encoder, acquire_timeout=None):
+    """动图合成与编码：启用编码进程池时在子进程内执行，否则在当前线程内执行"""
+    fmt = _ANIMATED[ret_format]
+    opts = {'preset': encoder} if fmt in ('WEBP', 'AVIF') else {'apng_mode': encoder}
+    if encode_pool is not None:
+        return encode_pool.compose(base_png, boxes_map, assets, fmt=fmt, acquire_timeout=acquire_timeout, **opts)
+    from anim import iter_compose_animation
+    return iter_compose_animation(base_png, boxes_map, assets, fmt=fmt, **opts)
+
+
+def _render_chunks(payload, ret_format: str, encoder=None, checkpoint=None, acquire_timeout=None, engine=None):
+    """
+    渲染一条语录，返回 (首块, 其余块迭代器)；静态图只有首块。
+    动图是惰性合成的：GIF/WebP/AVIF/apngasm 的首块即完整文件，合成与编码异常都在此抛出；
+    delta/fast APNG 的首块只含文件头与首帧，后续帧的合成/编码异常（含 EncodeTimeout、EncodeWorkerDied）
+    在迭代其余块时才抛出。调用方须先把其余块全部取完再发出响应，或接受流式响应中途中断（见 _respond_stream）。
+    checkpoint 在浏览器阶段之后、合成之前调用（异步任务借此响应取消/截止）
+    """
+    if _use_native(payload, ret_format, engine):
+        out = _render_native(payload)
+        if out is not None:
+            RENDERS.inc(format=ret_format, source='native')
+            return out, iter(())
+
     unique_id = str(uuid4())
-    payload = request.get_json(force=True, silent=False) or []
-    # 保存原始数据供模板渲染
-    data_dict[unique_id] = payload
 
-    # 用于替换占位与收集资产
-    assets_map = _prepare_placeholders_and_assets(data_dict[unique_id])
+    # 替换占位与收集资产
+    assets_map = _prepare_placeholders_and_assets(payload)
 
+    # inject：服务端直接渲染 #app 片段交给常驻页；navigate：写入共享存储供 /quote/ 回访
+    html = None
+    if Config.RENDER_MODE == 'inject':
+        with stage("template"):
+            html = render_template('quote-fragment.html', data_list=payload)
+    else:
+        payload_store.put(unique_id, payload)
+
+    RENDERS.inc(format=ret_format, source='browser')
     try:
-        # 静态路径：原样返回
+        # 静态路径：base64 与 png 共用同一份 PNG 字节
         if ret_format in ('png', 'base64'):
-            out = ss.screenshot(ret_format, unique_id)
-            if ret_format == 'png':
-                return send_file(io.BytesIO(out), mimetype='image/png')
-            return out
-
+            return ss.screenshot('png', unique_id, html=html, acquire_timeout=acquire_timeout), iter(())
         # 动图路径：先拿到底图 + 占位坐标
-        base_png, boxes_map = ss.pool.render_with_boxes(unique_id)
-        fmt = 'APNG' if ret_format == 'apng' else 'GIF'
-        composed = compose_animation_event_driven(base_png, boxes_map, list(assets_map.values()), fmt=fmt)
-        if ret_format == 'apng':
-            return send_file(io.BytesIO(composed), mimetype='image/apng')
-        else:
-            return send_file(io.BytesIO(composed), mimetype='image/gif')
-
+        base_png, boxes_map = ss.pool.render_with_boxes(unique_id, html=html, acquire_timeout=acquire_timeout)
+        if checkpoint is not None:
+            checkpoint()
+        chunks = _compose_chunks(base_png, boxes_map, list(assets_map.values()), ret_format, encoder, acquire_timeout)
+        return next(chunks), chunks
     finally:
-        data_dict.pop(unique_id, None)
+        if html is None:
+            payload_store.delete(unique_id)
+
+
+def _encoder(ret_format: str, options) -> Optional[str]:
+    """
+    编码选项可按请求选择（options 为查询参数或请求体）：
+    APNG 为 encoder=delta|fast|apngasm，WebP/AVIF 为 preset=fast|balanced|small|high；其它格式返回 None。
+    取值非法时抛 ValueError
+    """
+    if ret_format == 'apng':
+        mode = options.get('encoder') or Config.APNG_ENCODER
+        if mode not in APNG_MODES:
+            raise ValueError(f'unsupported encoder: {mode}')
+        return mode
+    if ret_format in ('webp', 'avif'):
+        mode = options.get('preset') or (Config.WEBP_PRESET if ret_format == 'webp' else Config.AVIF_PRESET)
+        if mode not in ANIM_PRESETS[_ANIMATED[ret_format]]:
+            raise ValueError(f'unsupported preset: {mode}')
+        return mode
+    return None
+
+
+def _render_and_maybe_compose(ret_format: str):
+    payload = request.get_json(force=True, silent=False) or []
+    try:
+        encoder = _encoder(ret_format, request.args)
+    except ValueError:
+        abort(400)
+    # 渲染引擎可按请求选择：?engine=auto|browser
+    engine = request.args.get('engine') or Config.RENDER_ENGINE
+    if engine not in ('auto', 'browser'):
+        abort(400)
+
+    # 结果缓存：须在占位替换（会原地修改 payload）之前计算 key
+    cache_key = None
+    if render_cache is not None:
+        # 引擎与配置默认一致时不计入 key，与 /batch/、/jobs 共享缓存条目
+        cache_key = render_cache_key(payload, ret_format, encoder or ('' if engine == Config.RENDER_ENGINE else engine))
+        cached = render_cache.get(cache_key)
+        if cached is not None:
+            RENDERS.inc(format=ret_format, source='cache')
+            metrics.note('cache', 'hit')
+            return _respond(ret_format, cached)
+
+    first, rest = _render_chunks(payload, ret_format, encoder, engine=engine)
+    if ret_format == 'apng' and Config.APNG_STREAM:
+        return _respond_stream(ret_format, first, rest, cache_key)
+    out = first + b"".join(rest)
+    OUTPUT_BYTES.observe(len(out), format=ret_format)
+
+    if cache_key is not None:
+        render_cache.put(cache_key, out)
+    return _respond(ret_format, out)
 
 
 @app.route('/base64/', methods=['POST'])
@@ -104,12 +362,551 @@ def gif_handler_trigger():
     return _render_and_maybe_compose('gif')
 
 
+@app.route('/webp/', methods=['POST'])
+def webp_handler_trigger():
+    return _render_and_maybe_compose('webp')
+
+
+@app.route('/avif/', methods=['POST'])
+def avif_handler_trigger():
+    if 'avif' not in _ANIMATED:
+        abort(404)  # 本机 Pillow 未编译 AVIF 编码器
+    return _render_and_maybe_compose('avif')
+
+
+@app.route('/anim/', methods=['POST'])
+def anim_handler_trigger():
+    """
+    按 Accept 协商动图格式：候选为 ANIM_FORMAT_ORDER 中本机支持的格式，客户端偏好相同时取靠前者；
+    未带 Accept 时取第一个，没有可接受（或本机可用）的格式返回 406。?preset= / ?encoder= 作用于选中的格式
+    """
+    offered = {_MIMETYPES[f]: f for f in Config.ANIM_FORMAT_ORDER if f in _ANIMATED}
+    if 'apng' in offered.values():
+        offered['image/png'] = 'apng'  # APNG 即合法 PNG，只认 image/png 的客户端也可接受
+    if not request.accept_mimetypes:
+        mimetype = next(iter(offered), None)  # 未带 Accept：任何格式均可
+    else:
+        mimetype = request.accept_mimetypes.best_match(list(offered))
+    if mimetype is None:
+        abort(406)
+    response = make_response(_render_and_maybe_compose(offered[mimetype]))
+    response.vary.add('Accept')
+    return response
+
+
+# ---------- 批量渲染 ----------
+
+_BATCH_EXT = {'png': 'png', 'base64': 'txt', **{f: 'png' if f == 'apng' else f for f in _ANIMATED}}
+
+
+def _parse_batch_items(raw_items) -> list:
+    """规范化条目 {"format", "data", "name"?, "encoder"?, "preset"?}；非法条目直接记为 400，不影响其余条目"""
+    items, names = [], set()
+    for i, raw in enumerate(raw_items):
+        item = {'index': i, 'format': 'png', 'encoder': None, 'data': None, 'status': 200, 'error': None,
+                'done': False, 'body': None, 'cached': False, 'cache_key': None, 'html': None, 'assets': None}
+        items.append(item)
+        name = f'{i:04d}'
+        if isinstance(raw, dict) and raw.get('name'):
+            name = re.sub(r'[^\w.-]', '_', str(raw['name']))[:64]
+        fmt = str(raw.get('format') or 'png') if isinstance(raw, dict) else 'png'
+        filename = f'{name}.{_BATCH_EXT.get(fmt, "bin")}'
+        if filename in names:
+            filename = f'{name}-{i:04d}.{_BATCH_EXT.get(fmt, "bin")}'
+        names.add(filename)
+        item['filename'] = filename
+        if not isinstance(raw, dict) or not isinstance(raw.get('data'), list):
+            item.update(status=400, error='item must be an object with a "data" list', done=True)
+            continue
+        if fmt not in _BATCH_EXT:
+            item.update(format=fmt, status=400, error=f'unsupported format: {fmt}', done=True)
+            continue
+        item['format'] = fmt
+        try:
+            item['encoder'] = _encoder(fmt, raw)
+        except ValueError as e:
+            item.update(status=400, error=str(e), done=True)
+            continue
+        item['data'] = raw['data']
+    return items
+
+
+def _batch_prepare(item) -> None:
+    """结果缓存查询 + 资产准备 + 模板片段渲染（须在请求上下文内执行）"""
+    data = item.pop('data')
+    if render_cache is not None:
+        item['cache_key'] = render_cache_key(data, item['format'], item['encoder'] or '')
+        cached = render_cache.get(item['cache_key'])
+        if cached is not None:
+            RENDERS.inc(format=item['format'], source='cache')
+            item.update(body=cached, cached=True, done=True)
+            return
+    if _use_native(data, item['format']):
+        out = _render_native(data)
+        if out is not None:
+            RENDERS.inc(format=item['format'], source='native')
+            OUTPUT_BYTES.observe(len(out), format=item['format'])
+            if item['cache_key'] is not None:
+                render_cache.put(item['cache_key'], out)
+            item.update(body=out, done=True)
+            return
+    item['assets'] = list(_prepare_placeholders_and_assets(data).values())
+    with stage("template"):
+        item['html'] = render_template('quote-fragment.html', data_list=data)
+
+
+def _batch_finish(item, shot) -> None:
+    """拿到该条截图后按格式产出最终字节并写入结果缓存"""
+    if isinstance(shot, Exception):
+        raise shot
+    png, boxes_map = shot
+    out = png
+    if item['format'] in _ANIMATED:
+        out = b"".join(_compose_chunks(png, boxes_map, item['assets'], item['format'], item['encoder']))
+    RENDERS.inc(format=item['format'], source='browser')
+    OUTPUT_BYTES.observe(len(out), format=item['format'])
+    if item['cache_key'] is not None:
+        render_cache.put(item['cache_key'], out)
+    item['body'] = out
+
+
+def _iter_batch(items):
+    """
+    按条目顺序产出已完成的条目。需要浏览器的条目每 BATCH_PAGE_ITEMS 条装入一个页面，
+    单次请求最多 BATCH_PARALLEL_PAGES 个页面同时在途；缓存命中/非法条目不占 worker
+    """
+    todo = [it for it in items if not it['done']]
+    size = max(1, Config.BATCH_PAGE_ITEMS)
+    pages = [todo[k:k + size] for k in range(0, len(todo), size)]
+    inflight = deque()
+    next_page = emitted = 0
+    try:
+        while True:
+            while next_page < len(pages) and len(inflight) < max(1, Config.BATCH_PARALLEL_PAGES):
+                page = pages[next_page]
+                inflight.append((page, _batch_executor.submit(metrics.bind(ss.pool.render_batch), [it['html'] for it in page])))
+                next_page += 1
+            while emitted < len(items) and items[emitted]['done']:
+                yield items[emitted]
+                emitted += 1
+            if not inflight:
+                return
+            page, fut = inflight.popleft()
+            try:
+                shots = fut.result()
+            except Exception as e:
+                shots = [e] * len(page)  # 页面装载失败：整页条目失败
+            for it, shot in zip(page, shots):
+                try:
+                    _batch_finish(it, shot)
+                except Exception as e:
+                    status = 503 if isinstance(e, TimeoutError) else 413 if isinstance(e, CaptureTooLarge) else 500
+                    it.update(status=status, error=str(e) or type(e).__name__)
+                it.update(done=True, html=None, assets=None)
+    finally:
+        for _, fut in inflight:
+            fut.cancel()
+
+
+def _batch_entry(item) -> dict:
+    return {
+        'index': item['index'], 'name': item['filename'], 'format': item['format'],
+        'status': item['status'], 'error': item['error'], 'cached': item['cached'],
+        'bytes': len(item['body']) if item['body'] is not None else 0,
+    }
+
+
+def _batch_payload(item) -> bytes:
+    return base64.b64encode(item['body']) if item['format'] == 'base64' else item['body']
+
+
+class _ChunkSink:
+    """zipfile 的只写输出：无 seek/tell 时 zipfile 改用数据描述符，写入的字节由生成器分块取走"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        out, self._parts = b"".join(self._parts), []
+        return out
+
+
+def _stream_zip(results):
+    """逐条写入 zip（不压缩，图片本身已压缩），末尾附 manifest.json 记录每条状态"""
+    sink = _ChunkSink()
+    manifest = []
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for item in results:
+            entry = _batch_entry(item)
+            manifest.append(entry)
+            if item['status'] == 200:
+                zf.writestr(zipfile.ZipInfo(entry['name'], time.localtime()[:6]), _batch_payload(item))
+            yield sink.take()
+        zf.writestr(zipfile.ZipInfo('manifest.json', time.localtime()[:6]),
+                    json.dumps(manifest, ensure_ascii=False))
+    yield sink.take()
+
+
+def _stream_multipart(results, boundary: str):
+    """multipart/mixed：每条一段（失败条目为 JSON 错误），段头带 X-Item-Index / X-Item-Status，末尾附 manifest"""
+    manifest = []
+
+    def part(ctype: str, filename: str, body: bytes, extra: str = '') -> bytes:
+        head = (f'--{boundary}\r\nContent-Type: {ctype}\r\n'
+                f'Content-Disposition: attachment; filename="{filename}"\r\n{extra}\r\n')
+        return head.encode() + body + b'\r\n'
+
+    for item in results:
+        entry = _batch_entry(item)
+        manifest.append(entry)
+        extra = f'X-Item-Index: {entry["index"]}\r\nX-Item-Status: {entry["status"]}\r\n'
+        if item['status'] == 200:
+            ctype = 'text/plain' if item['format'] == 'base64' else _MIMETYPES[item['format']]
+            yield part(ctype, entry['name'], _batch_payload(item), extra)
+        else:
+            yield part('application/json', entry['name'] + '.error.json', json.dumps(entry).encode(), extra)
+    yield part('application/json', 'manifest.json', json.dumps(manifest, ensure_ascii=False).encode())
+    yield f'--{boundary}--\r\n'.encode()
+
+
+@app.route('/batch/', methods=['POST'])
+def batch_handler_trigger():
+    """
+    批量渲染：body 为 [{"format": "png|base64|apng|gif", "data": [...], "name"?, "encoder"?}, ...]
+    或 {"items": [...]}。同一页面装入多条语录、一次就绪等待后逐个截图，结果按条目顺序流式写回：
+    - 默认 zip，末尾附 manifest.json（每条的 status/error/bytes/cached）
+    - ?packaging=multipart 或 Accept: multipart/mixed 时为 multipart/mixed，每段带 X-Item-Status
+    """
+    body = request.get_json(force=True, silent=False)
+    raw_items = body.get('items') if isinstance(body, dict) else body
+    if not isinstance(raw_items, list) or not raw_items:
+        abort(400)
+    if len(raw_items) > Config.BATCH_MAX_ITEMS:
+        abort(413)
+    packaging = request.args.get('packaging') \
+        or ('multipart' if 'multipart/mixed' in request.headers.get('Accept', '') else 'zip')
+    if packaging not in ('zip', 'multipart'):
+        abort(400)
+
+    items = _parse_batch_items(raw_items)
+    for item in items:
+        if item['done']:
+            continue
+        try:
+            _batch_prepare(item)
+        except Exception as e:
+            item.update(status=400, error=str(e) or type(e).__name__, done=True)
+
+    results = _iter_batch(items)
+    headers = {'X-Batch-Items': str(len(items))}
+    if packaging == 'multipart':
+        boundary = uuid4().hex
+        return Response(_stream_multipart(results, boundary), headers=headers,
+                        mimetype=f'multipart/mixed; boundary={boundary}')
+    headers['Content-Disposition'] = 'attachment; filename="batch.zip"'
+    return Response(_stream_zip(results), headers=headers, mimetype='application/zip')
+
+
+# ---------- 异步任务 ----------
+
+def _run_job(job: Job):
+    """任务线程内执行：没有请求上下文，模板渲染需手动进入应用上下文"""
+    try:
+        with app.app_context():
+            first, rest = _render_chunks(
+                job.payload, job.fmt, job.options.get('encoder'),
+                checkpoint=lambda: job.checkpoint(job_store),
+                acquire_timeout=max(0.01, job.remaining()),
+            )
+        out = first + b"".join(rest)
+        OUTPUT_BYTES.observe(len(out), format=job.fmt)
+    except TimeoutError:
+        if job.remaining() <= 0:
+            raise JobExpired()  # 截止前没等到浏览器
+        raise
+    if job.options.get('cache_key') is not None:
+        render_cache.put(job.options['cache_key'], out)
+    return _job_body(job.fmt, out)
+
+
+def _job_body(ret_format: str, out: bytes):
+    if ret_format == 'base64':
+        return base64.b64encode(out), 'text/plain'
+    return out, _MIMETYPES[ret_format]
+
+
+job_queue = JobQueue(_run_job, job_store)
+
+
+def _job_view(rec: dict) -> dict:
+    out = dict(rec)
+    out['status_url'] = f"/jobs/{rec['id']}"
+    out['result_url'] = f"/jobs/{rec['id']}/result"
+    return out
+
+
+def _wait_job(job_id: str):
+    """?wait=秒 长轮询：本进程的任务等待其完成事件，其它 worker 的任务定期查询共享存储"""
+    rec = job_store.get(job_id)
+    try:
+        wait = min(float(request.args.get('wait') or 0), Config.JOBS_MAX_WAIT_SEC)
+    except ValueError:
+        abort(400)
+    end = time.monotonic() + wait
+    while rec is not None and rec['status'] not in JOB_FINAL:
+        remain = end - time.monotonic()
+        if remain <= 0:
+            break
+        job = job_queue.local(job_id)
+        if job is not None:
+            job.done.wait(remain)
+        else:
+            time.sleep(min(remain, 0.2))
+        rec = job_store.get(job_id)
+    if rec is None:
+        abort(404)
+    return rec
+
+
+@app.route('/jobs', methods=['POST'])
+def job_submit():
+    """
+    提交异步任务：{"format": "png|base64|apng|gif|webp|avif", "data": [...], "priority"?: "interactive|bulk",
+    "deadline"?: 秒, "encoder"?, "preset"?}。返回 202 + 任务状态；队列已满返回 429 + Retry-After。
+    结果缓存命中时任务直接以 done 状态创建
+    """
+    body = request.get_json(force=True, silent=False)
+    if not isinstance(body, dict) or not isinstance(body.get('data'), list):
+        abort(400)
+    fmt = body.get('format') or 'png'
+    priority = body.get('priority') or 'interactive'
+    if fmt not in _BATCH_EXT or priority not in PRIORITIES:
+        abort(400)
+    try:
+        deadline_sec = float(body.get('deadline') or Config.JOBS_DEFAULT_DEADLINE_SEC)
+    except (TypeError, ValueError):
+        abort(400)
+    if deadline_sec <= 0:
+        abort(400)
+    deadline = time.time() + min(deadline_sec, Config.JOBS_MAX_DEADLINE_SEC)
+    try:
+        encoder = _encoder(fmt, body)
+    except ValueError:
+        abort(400)
+    payload = body['data']
+    job_id = uuid4().hex
+
+    cache_key = None
+    if render_cache is not None:
+        cache_key = render_cache_key(payload, fmt, encoder or '')
+        cached = render_cache.get(cache_key)
+        if cached is not None:
+            RENDERS.inc(format=fmt, source='cache')
+            out, mimetype = _job_body(fmt, cached)
+            job_store.create(job_id, {'format': fmt, 'priority': priority, 'deadline': deadline, 'status': 'done'})
+            job_store.update(job_id, 'done', result=out, http_status=200, mimetype=mimetype)
+            return jsonify(_job_view(job_store.get(job_id))), 202, {'Location': f'/jobs/{job_id}'}
+
+    job = Job(job_id, fmt, payload, priority=priority, deadline=deadline, animated=fmt in _ANIMATED,
+              options={'encoder': encoder, 'cache_key': cache_key})
+    try:
+        job_queue.submit(job)
+    except QueueFull as e:
+        return jsonify({'error': 'queue full', 'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+    return jsonify(_job_view(job_store.get(job_id))), 202, {'Location': f'/jobs/{job_id}'}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    return jsonify(_job_view(_wait_job(job_id)))
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """完成则直接返回图片；未完成返回 202 + 状态（可带 ?wait= 长轮询）；失败/取消/过期返回对应状态码"""
+    rec = _wait_job(job_id)
+    if rec['status'] not in JOB_FINAL:
+        return jsonify(_job_view(rec)), 202
+    if rec['status'] != 'done':
+        return jsonify(_job_view(rec)), rec['http_status'] or 500
+    body = job_store.result(job_id)
+    if body is None:
+        abort(404)
+    return Response(body, mimetype=rec['mimetype'])
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def job_cancel(job_id):
+    """排队中的任务立即取消；执行中的任务在下一个阶段边界中止；已结束的返回 409"""
+    before = job_queue.cancel(job_id)
+    if before is None:
+        abort(404)
+    rec = job_store.get(job_id)
+    if rec is None:
+        abort(404)
+    return jsonify(_job_view(rec)), 409 if before in JOB_FINAL else 202
+
+
+@app.route('/stats/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(job_queue.stats())
+
+
+@app.route('/media/<key>', methods=['GET'])
+def media(key):
+    url = media_cache.lookup_url(key)
+    if url is None:
+        abort(404)
+    try:
+        body, mime = media_cache.fetch(url)
+    except MediaTooLarge:
+        abort(413)
+    except Exception:
+        abort(502)
+    return send_file(io.BytesIO(body), mimetype=mime or 'application/octet-stream', max_age=Config.MEDIA_DEFAULT_TTL_SEC)
+
+
+def _palette_stats() -> dict:
+    """quantize 未导入（本进程尚未合成过动图）时调色板缓存必然为空，不为统计去导入 numpy"""
+    quantize = sys.modules.get('quantize')
+    return quantize.palette_cache_stats() if quantize is not None else {'assets': {}}
+
+
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'render': render_cache.stats() if render_cache is not None else {},
+        'media': media_cache.stats(),
+        'assets': asset_cache.stats() if asset_cache is not None else {},
+        'palette': _palette_stats(),
+    })
+
+
+@app.route('/stats/pool', methods=['GET'])
+def pool_stats():
+    return jsonify(ss.pool.stats())
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活探针：进程能响应即可，不依赖浏览器"""
+    return jsonify({'status': 'ok', 'uptime_sec': round(time.monotonic() - _STARTED, 1)})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪探针：至少一个浏览器可用时 200，预热中或全部启动失败时 503"""
+    st = ss.pool.stats()
+    body = {
+        'ready': st['ready'],
+        'browsers': {k: st[k] for k in ('total', 'starting', 'warmup', 'spawn_failures')},
+        'startup_ms': {k: round(v * 1000.0, 1) for k, v in _startup.items()},
+    }
+    return jsonify(body), 200 if st['ready'] else 503
+
+
+@app.route('/stats/encode', methods=['GET'])
+def encode_stats():
+    return jsonify(encode_pool.stats() if encode_pool is not None else {'max_size': 0})
+
+
+@app.errorhandler(EncodeBusy)
+def encode_busy(e):
+    """编码进程池排满：与 /jobs 排满一致，提示客户端稍后重试"""
+    return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+
+
+@app.errorhandler(CaptureTooLarge)
+def capture_too_large(e):
+    """语录超出 CAPTURE_MAX_HEIGHT / CAPTURE_MAX_PIXELS（CAPTURE_OVERSIZE=error 或缩小也放不下）"""
+    return jsonify({'error': str(e)}), 413
+
+
+# ---------- 指标 ----------
+
+def _cache_rows(field: str):
+    stats = {
+        'render': render_cache.stats() if render_cache is not None else {},
+        'media': media_cache.stats(),
+        'assets': asset_cache.stats() if asset_cache is not None else {},
+        'palette': _palette_stats()['assets'],
+    }
+    rows = []
+    for name, st in stats.items():
+        if field == 'hits':
+            rows.append(({'cache': name, 'tier': 'memory'}, st.get('hits', 0) - st.get('disk_hits', 0)))
+            if 'disk_hits' in st:
+                rows.append(({'cache': name, 'tier': 'disk'}, st['disk_hits']))
+        elif field in st:
+            rows.append(({'cache': name}, st[field]))
+    return rows
+
+
+def _pool_rows(fields):
+    st = ss.pool.stats()
+    return [({'state': f}, st[f]) for f in fields]
+
+
+metrics.register_callback('qq_cache_hits_total', 'counter', 'Cache hits by cache and tier', lambda: _cache_rows('hits'))
+metrics.register_callback('qq_cache_misses_total', 'counter', 'Cache misses', lambda: _cache_rows('misses'))
+metrics.register_callback('qq_cache_bytes', 'gauge', 'In-memory cache size', lambda: _cache_rows('mem_bytes'))
+metrics.register_callback('qq_pool_workers', 'gauge', 'Browser workers by state',
+                          lambda: _pool_rows(('busy', 'idle', 'starting')))
+metrics.register_callback('qq_pool_queue_depth', 'gauge', 'Requests waiting for a browser worker',
+                          lambda: [({}, ss.pool.stats()['queue_depth'])])
+metrics.register_callback('qq_pool_events_total', 'counter', 'Browser pool acquire timeouts and worker replacements',
+                          lambda: [({'event': k}, v) for k, v in ss.pool.stats().items()
+                                   if k in ('timeouts', 'recycled', 'replaced', 'spawn_failures')])
+metrics.register_callback('qq_jobs_queued', 'gauge', 'Queued async jobs by priority',
+                          lambda: [({'priority': p}, n) for p, n in job_queue.stats()['queued'].items()])
+metrics.register_callback('qq_jobs_running', 'gauge', 'Async jobs being executed',
+                          lambda: [({}, job_queue.stats()['running'])])
+metrics.register_callback('qq_jobs_finished_total', 'counter', 'Finished async jobs by final status (rejected = refused with 429)',
+                          lambda: [({'status': k}, v) for k, v in job_queue.stats()['finished'].items()]
+                          + [({'status': 'rejected'}, job_queue.rejected)])
+if encode_pool is not None:
+    metrics.register_callback('qq_encode_workers', 'gauge', 'Encode worker processes by state',
+                              lambda: [({'state': k}, encode_pool.stats()[k]) for k in ('busy', 'idle')])
+    metrics.register_callback('qq_encode_queue_depth', 'gauge', 'Animations waiting for an encode worker',
+                              lambda: [({}, encode_pool.stats()['queue_depth'])])
+    metrics.register_callback('qq_encode_events_total', 'counter', 'Encode pool rejections, job timeouts, worker crashes and recycles',
+                              lambda: [({'event': k}, v) for k, v in encode_pool.stats().items()
+                                       if k in ('rejected', 'timeouts', 'crashes', 'recycled')])
+metrics.register_callback('qq_requests_in_flight', 'gauge', 'Requests being served', lambda: [({}, _inflight)])
+metrics.register_callback('qq_startup_seconds', 'gauge', 'Seconds from import to app, first browser and first render ready',
+                          lambda: [({'phase': k}, v) for k, v in list(_startup.items())])
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式；汇总本机所有 gunicorn worker（经 METRICS_DIR）"""
+    if not Config.METRICS_ENABLED:
+        abort(404)
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/quote/', methods=['GET', 'POST'])
 def quote():
     unique_id = request.args.get('id')
-    data = data_dict.get(unique_id, [])
+    data = payload_store.get(unique_id) or []
     return render_template('main-template.html', data_list=data)
 
 
+@app.route('/shell/', methods=['GET'])
+def shell():
+    """inject 模式的常驻外壳页：只含样式与空 #app"""
+    return render_template('main-template.html', data_list=[])
+
+
+_startup_mark('app')  # 路由与回调注册完毕，可开始接受请求（浏览器可能仍在预热）
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=Config.FLASK_RUN_PORT)
\ No newline at end of file
@@ -0,0 +1,208 @@
+# media.py
+import json
+import time
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Tuple, Optional, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import Config
+from cache import TieredCache
+
+_META_LEN = struct.Struct(">I")
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+def media_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:40]
+
+
+def _pack(meta: dict, body: bytes) -> bytes:
+    mb = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return _META_LEN.pack(len(mb)) + mb + body
+
+
+def _unpack(blob: bytes) -> Tuple[dict, bytes]:
+    (n,) = _META_LEN.unpack_from(blob, 0)
+    meta = json.loads(blob[4:4 + n].decode("utf-8"))
+    return meta, blob[4 + n:]
+
+
+def _freshness_deadline(headers, now: float) -> Optional[float]:
+    """
+    根据响应头计算过期时刻：
+    - no-store：返回 None（不缓存）
+    - no-cache：立即过期（下次使用前必须条件请求）
+    - max-age / Expires：按头部
+    - 均无：默认 TTL
+    """
+    cc = (headers.get("Cache-Control") or "").lower()
+    directives = {}
+    for part in cc.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        k, _, v = part.partition("=")
+        directives[k.strip()] = v.strip().strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return now
+    if "max-age" in directives:
+        try:
+            return now + max(0, int(directives["max-age"]))
+        except ValueError:
+            pass
+    exp = headers.get("Expires")
+    if exp:
+        try:
+            return parsedate_to_datetime(exp).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now + Config.MEDIA_DEFAULT_TTL_SEC
+
+
+class MediaCache:
+    """
+    共享媒体下载层：
+    - 连接池化的 requests.Session
+    - 内存 LRU + 磁盘层（按 URL 哈希寻址，可跨 worker 共享）
+    - 遵循 ETag / Last-Modified / Cache-Control，过期后条件请求复验
+    - 流式下载时强制最大字节数
+    - 进程内同 URL 并发请求合并为一次下载
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=Config.MEDIA_POOL_MAXSIZE, pool_maxsize=Config.MEDIA_POOL_MAXSIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.store = TieredCache(
+            Config.MEDIA_CACHE_MAX_BYTES,
+            Config.MEDIA_CACHE_DIR or None,
+            Config.MEDIA_CACHE_DISK_MAX_BYTES,
+        )
+        self._urls: "OrderedDict[str, str]" = OrderedDict()  # key -> url（供 /media/<key> 反查），LRU
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.fetches = 0
+        self.revalidated = 0
+        self.bytes_downloaded = 0
+
+    # ---------- URL 登记（模板改写 <img src> 时调用） ----------
+
+    def register(self, url: str) -> str:
+        key = media_key(url)
+        with self._guard:
+            new = key not in self._urls
+            if new:
+                if len(self._urls) >= Config.MEDIA_URL_INDEX_MAX:
+                    self._urls.popitem(last=False)
+                self._urls[key] = url
+            else:
+                self._urls.move_to_end(key)
+        disk = self.store.disk
+        if disk is not None:
+            # 索引条目与媒体文件同处一个按 mtime 清理的目录：已登记过的只刷新 mtime（热 URL 不会被清掉），
+            # 文件不存在（首次登记或已被清理）才重写；其它 worker 收到 /media/<key> 时靠它反查
+            if new or disk.locate("u" + key) is None:
+                disk.put("u" + key, url.encode("utf-8"))
+        return key
+
+    def lookup_url(self, key: str) -> Optional[str]:
+        with self._guard:
+            url = self._urls.get(key)
+            if url is not None:
+                self._urls.move_to_end(key)
+        if url is None and self.store.disk is not None:
+            raw = self.store.disk.get("u" + key)
+            if raw is not None:
+                url = raw.decode("utf-8")
+        return url
+
+    # ---------- 下载 ----------
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._guard:
+            lk = self._locks.get(key)
+            if lk is None:
+                if len(self._locks) > 1024:
+                    self._locks = {k: v for k, v in self._locks.items() if v.locked()}
+                lk = self._locks[key] = threading.Lock()
+            return lk
+
+    def _download(self, url: str, meta: Optional[dict]):
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        limit = Config.MEDIA_MAX_DOWNLOAD_BYTES
+        with self.session.get(url, headers=headers, timeout=Config.MEDIA_FETCH_TIMEOUT_SEC, stream=True) as resp:
+            if resp.status_code == 304 and meta is not None:
+                return resp, None
+            resp.raise_for_status()
+            cl = resp.headers.get("Content-Length")
+            if cl and cl.isdigit() and int(cl) > limit:
+                raise MediaTooLarge(f"{url}: {cl} bytes > {limit}")
+            buf = bytearray()
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                buf += chunk
+                if len(buf) > limit:
+                    raise MediaTooLarge(f"{url}: exceeds {limit} bytes")
+            return resp, bytes(buf)
+
+    def fetch(self, url: str) -> Tuple[bytes, Optional[str]]:
+        key = media_key(url)
+        with self._key_lock(key):
+            meta, body = None, None
+            blob = self.store.get(key)
+            if blob is not None:
+                meta, body = _unpack(blob)
+                if meta.get("expires", 0) > time.time():
+                    return body, meta.get("mime")
+
+            resp, new_body = self._download(url, meta)
+            now = time.time()
+            expires = _freshness_deadline(resp.headers, now)
+            if new_body is None:
+                # 304：内容未变，仅刷新过期时间
+                self.revalidated += 1
+                if expires is not None:
+                    meta["expires"] = expires
+                    self.store.put(key, _pack(meta, body))
+                return body, meta.get("mime")
+
+            self.fetches += 1
+            self.bytes_downloaded += len(new_body)
+            new_meta = {
+                "url": url,
+                "mime": resp.headers.get("Content-Type"),
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "expires": expires if expires is not None else 0,
+            }
+            if expires is not None:
+                self.store.put(key, _pack(new_meta, new_body))
+            return new_body, new_meta["mime"]
+
+    def stats(self) -> Dict[str, int]:
+        out = self.store.stats()
+        out.update(fetches=self.fetches, revalidated=self.revalidated, bytes_downloaded=self.bytes_downloaded)
+        return out
+
+
+media_cache = MediaCache()
+
+
+def is_remote(src: str) -> bool:
+    return isinstance(src, str) and src.lower().startswith(("http://", "https://"))
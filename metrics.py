@@ -0,0 +1,573 @@
+# metrics.py
+"""
+进程内指标、单请求追踪与采样剖析（无第三方依赖）：
+- Counter / Histogram（固定桶）按标签累加；回调指标在抓取/落盘时才取值（池占用、缓存命中等已有 stats()）
+- stage(name)：阶段计时，写入 qq_stage_seconds{stage} 与当前请求的追踪（Server-Timing）。
+  同一线程内嵌套的阶段按“自身耗时”计：外层扣除内层，各阶段相加约等于总耗时
+- 追踪存于 contextvar；提交到线程池的任务经 bind(fn) 包装以继承当前请求的追踪
+- 多 gunicorn worker：各进程每 METRICS_FLUSH_SEC 把累计值原子写入 METRICS_DIR/<pid>.json，
+  /metrics 汇总所有文件：counter/histogram 相加（已退出进程的计数保留，不回退），
+  gauge 只取近期仍在刷新的进程；已退出进程的快照由刷新线程并入 archive.json 后删除，文件数不随 worker 回收增长
+- 采样剖析（默认关闭）：按 PROFILE_SAMPLE_RATE 抽样请求，后台线程每 PROFILE_INTERVAL_MS 采集请求线程栈，
+  耗时超过 PROFILE_SLOW_MS 的请求把折叠栈写入 PROFILE_DIR（flamegraph.pl / speedscope 可直接读取）
+"""
+import os
+import sys
+import json
+import time
+import random
+import atexit
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from collections import Counter as _Tally
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils import Config
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}   # name -> (type, help, buckets)
+_values: Dict[Tuple[str, _Labels], list] = {}                # counter: [v]；histogram: [各桶计数..., +Inf, sum]
+_callbacks: List[Tuple[str, str, Callable]] = []             # (name, type, fn)
+
+
+def _key(labels: dict) -> _Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        _meta[name] = ("counter", help, ())
+
+    def inc(self, n: float = 1, **labels) -> None:
+        if not Config.METRICS_ENABLED:
+            return
+        k = (self.name, _key(labels))
+        with _lock:
+            v = _values.get(k)
+            if v is None:
+                _values[k] = [n]
+            else:
+                v[0] += n
+        _flusher.ensure()
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Iterable[float]):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        _meta[name] = ("histogram", help, self.buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        if not Config.METRICS_ENABLED:
+            return
+        k = (self.name, _key(labels))
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            v = _values.get(k)
+            if v is None:
+                v = _values[k] = [0] * (len(self.buckets) + 2)
+            v[i] += 1
+            v[-1] += value
+        _flusher.ensure()
+
+
+def register_callback(name: str, kind: str, help: str, fn: Callable[[], Iterable[Tuple[dict, float]]]) -> None:
+    """
+    kind 为 counter 或 gauge；fn() 返回 [(labels, value), ...]，在抓取/落盘时调用。
+    counter 型用于已有的进程内累计值（缓存命中、池回收次数等）
+    """
+    _meta[name] = (kind, help, ())
+    _callbacks.append((name, kind, fn))
+
+
+# ----------------- 指标定义 -----------------
+
+_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram("qq_stage_seconds", "Self time spent in each render stage", _SECONDS)
+STAGE_ERRORS = Counter("qq_stage_errors_total", "Render stages that raised")
+REQUEST_SECONDS = Histogram("qq_request_seconds", "Request wall time until the response body is fully sent", _SECONDS)
+RENDERS = Counter("qq_renders_total", "Rendered quotes by output format and source (cache|native|browser)")
+OUTPUT_BYTES = Histogram("qq_output_bytes", "Encoded output size per quote",
+                         tuple(1024 * 4 ** i for i in range(9)))  # 1 KiB .. 64 MiB
+OUTPUT_FRAMES = Histogram("qq_output_frames", "Frames per animated output",
+                          (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+
+
+# ----------------- 追踪与阶段计时 -----------------
+
+class Trace:
+    """单个请求内各阶段的累计自身耗时（秒），可被多个线程并发写入"""
+
+    __slots__ = ("started", "stages", "notes", "_lock")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.notes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        with self._lock:
+            parts = [f"{k};dur={v * 1000.0:.1f}" for k, v in self.stages.items()]
+            parts += [f'{k};desc="{v}"' for k, v in self.notes.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000.0:.1f}")
+        return ", ".join(parts)
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("qq_trace", default=None)
+_local = threading.local()
+
+
+def begin_trace() -> Tuple[Trace, contextvars.Token]:
+    tr = Trace()
+    return tr, _trace.set(tr)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    try:
+        _trace.reset(token)
+    except ValueError:
+        pass  # 在另一个上下文中结束（流式响应），追踪随上下文一起丢弃
+
+
+def note(key: str, value: str) -> None:
+    """给当前请求附加描述项（如 cache=hit），出现在 Server-Timing 中"""
+    tr = _trace.get()
+    if tr is not None:
+        tr.notes[key] = value
+
+
+def bind(fn: Callable) -> Callable:
+    """让提交到线程池的任务继承当前请求的追踪：executor.submit(bind(fn), ...)；同一包装可被多个线程并发调用"""
+    tr = _trace.get()
+    if tr is None:
+        return fn
+
+    def run(*a, **kw):
+        token = _trace.set(tr)
+        try:
+            return fn(*a, **kw)
+        finally:
+            _trace.reset(token)
+    return run
+
+
+def _stack() -> list:
+    s = getattr(_local, "stack", None)
+    if s is None:
+        s = _local.stack = []
+    return s
+
+
+def record(name: str, seconds: float) -> None:
+    """记录一段已在别处测得的耗时（浏览器 timings 等）；计入外层阶段的子耗时"""
+    s = _stack()
+    if s:
+        s[-1].child += seconds
+    STAGE_SECONDS.observe(seconds, stage=name)
+    tr = _trace.get()
+    if tr is not None:
+        tr.add(name, seconds)
+
+
+class stage:
+    """
+    with stage("decode"): ...
+    只记录自身耗时：同线程内嵌套的 stage/record 从外层扣除
+    """
+
+    __slots__ = ("name", "t0", "child")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _open(self) -> None:
+        _stack().append(self)
+        self.child = 0.0
+        self.t0 = time.perf_counter()
+
+    def _close(self) -> float:
+        """出栈并返回自身耗时"""
+        dt = time.perf_counter() - self.t0
+        s = _stack()
+        s.pop()
+        if s:
+            s[-1].child += dt
+        return dt - self.child
+
+    def _emit(self, seconds: float) -> None:
+        STAGE_SECONDS.observe(seconds, stage=self.name)
+        tr = _trace.get()
+        if tr is not None:
+            tr.add(self.name, seconds)
+
+    def __enter__(self):
+        self._open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        spent = self._close()
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.name)
+        self._emit(spent)
+        return False
+
+
+def timed_iter(it: Iterable, name: str) -> Iterator:
+    """
+    惰性流水线的阶段计时：只统计 next() 内部的自身耗时（不含消费方处理/网络写出），
+    迭代结束或被关闭时记录一次
+    """
+    it = iter(it)
+    st = stage(name)
+    total = 0.0
+    try:
+        while True:
+            st._open()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                total += st._close()
+            yield item
+    finally:
+        st._emit(total)
+
+
+def drain() -> list:
+    """取出并清空本进程的累计值（编码子进程每个任务结束后回传给父进程）"""
+    with _lock:
+        out = [(name, labels, v) for (name, labels), v in _values.items()]
+        _values.clear()
+    return out
+
+
+def merge(values: Iterable, stages: Optional[Dict[str, float]] = None) -> None:
+    """并入子进程 drain() 的累计值；stages（子进程内的阶段自身耗时）只计入当前请求的追踪"""
+    with _lock:
+        for name, labels, v in values:
+            cur = _values.get((name, labels))
+            if cur is None:
+                _values[(name, labels)] = list(v)
+            else:
+                for i, x in enumerate(v):
+                    cur[i] += x
+    if values:
+        _flusher.ensure()
+    tr = _trace.get()
+    if tr is not None and stages:
+        for name, seconds in stages.items():
+            tr.add(name, seconds)
+
+
+# ----------------- 多进程快照与 Prometheus 文本 -----------------
+
+def _snapshot() -> dict:
+    with _lock:
+        values = [[name, list(labels), list(v)] for (name, labels), v in _values.items()]
+    gauges, counters = [], []
+    for name, kind, fn in _callbacks:
+        try:
+            rows = [[name, list(_key(lb)), [float(val)]] for lb, val in fn()]
+        except Exception:
+            continue
+        (gauges if kind == "gauge" else counters).extend(rows)
+    return {"pid": os.getpid(), "ts": time.time(), "values": values + counters, "gauges": gauges}
+
+
+class _Flusher:
+    """后台线程定期写出本进程快照；首次观测时才启动（gunicorn fork 之后）"""
+
+    def __init__(self):
+        self.started = False
+        self.path = None
+
+    def ensure(self) -> None:
+        if self.started or not Config.METRICS_DIR:
+            return
+        with _lock:
+            if self.started:
+                return
+            self.started = True
+        try:
+            os.makedirs(Config.METRICS_DIR, exist_ok=True)
+            self.path = os.path.join(Config.METRICS_DIR, f"{os.getpid()}.json")
+            with _dir_lock(Config.METRICS_DIR, exclusive=True):
+                if os.path.exists(self.path):
+                    # 同 pid 的前一个进程（容器重启后 pid 复用）：改名保留其计数
+                    os.replace(self.path, os.path.join(Config.METRICS_DIR, f"dead-{os.getpid()}-{time.time_ns()}.json"))
+        except OSError:
+            self.path = None
+            return
+        atexit.register(self.flush)
+        threading.Thread(target=self._loop, name="metrics-flush", daemon=True).start()
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(Config.METRICS_FLUSH_SEC)
+            self.flush()
+            _compact(Config.METRICS_DIR, self.path)
+
+    def flush(self, snap: dict = None) -> None:
+        if self.path is None:
+            return
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(snap or _snapshot(), f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+_flusher = _Flusher()
+
+_ARCHIVE = "archive.json"
+
+
+@contextmanager
+def _dir_lock(directory: str, exclusive: bool, blocking: bool = True) -> Iterator[bool]:
+    """
+    METRICS_DIR 的目录锁（flock）：改名、合并、删除快照取排他锁，/metrics 读取取共享锁，
+    保证一次抓取不会把同一份计数读两遍（原文件 + archive.json）或一遍都没读到。产出是否持有锁
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield False
+        return
+    try:
+        f = open(os.path.join(directory, ".compact.lock"), "a")
+    except OSError:
+        yield False
+        return
+    with f:
+        try:
+            fcntl.flock(f, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            yield False
+            return
+        yield True  # 关闭文件即释放
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # 进程存在但无权发信号
+    return True
+
+
+def _add_rows(acc: Dict[Tuple[str, _Labels], list], rows) -> None:
+    for name, labels, v in rows:
+        k = (name, tuple(tuple(p) for p in labels))
+        cur = acc.get(k)
+        if cur is None:
+            acc[k] = list(v)
+        elif len(cur) == len(v):
+            acc[k] = [a + b for a, b in zip(cur, v)]
+
+
+def _compact(directory: str, own_path: Optional[str]) -> int:
+    """
+    把已退出进程的快照（dead-*.json、pid 已不存在的 <pid>.json）累加进 archive.json 并删除原文件；
+    各进程的刷新线程都会调用，持排他锁进行，拿不到锁（另一进程在合并或正被抓取）就留给下一轮。返回并入的文件数
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    victims = []
+    for fn in names:
+        path = os.path.join(directory, fn)
+        if not fn.endswith(".json") or fn == _ARCHIVE or path == own_path:
+            continue
+        stem = fn[:-len(".json")]
+        if fn.startswith("dead-") or (stem.isdigit() and not _pid_alive(int(stem))):
+            victims.append(path)
+    if not victims:
+        return 0
+    with _dir_lock(directory, exclusive=True, blocking=False) as held:
+        if not held:
+            return 0
+        archive = os.path.join(directory, _ARCHIVE)
+        values: Dict[Tuple[str, _Labels], list] = {}
+        try:
+            with open(archive) as f:
+                _add_rows(values, json.load(f).get("values", ()))
+        except (OSError, ValueError):
+            pass
+        folded = []
+        for path in victims:
+            try:
+                with open(path) as f:
+                    _add_rows(values, json.load(f).get("values", ()))
+            except FileNotFoundError:
+                continue  # 已被另一进程并入
+            except (OSError, ValueError):
+                pass  # 写坏的快照（进程在写入中途被杀）：无法恢复，直接删除
+            folded.append(path)
+        tmp = f"{archive}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"pid": 0, "ts": time.time(), "gauges": [],
+                           "values": [[name, list(labels), v] for (name, labels), v in values.items()]},
+                          f, separators=(",", ":"))
+            os.replace(tmp, archive)
+        except OSError:
+            return 0
+        for path in folded:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(folded)
+
+
+def _merged() -> Tuple[Dict[Tuple[str, _Labels], list], Dict[Tuple[str, _Labels], float]]:
+    _flusher.ensure()
+    own = _snapshot()
+    snaps = [own]
+    if _flusher.path is not None:
+        _flusher.flush(own)
+        stale = time.time() - max(15.0, 3 * Config.METRICS_FLUSH_SEC)
+        with _dir_lock(Config.METRICS_DIR, exclusive=False):
+            for fn in os.listdir(Config.METRICS_DIR):
+                path = os.path.join(Config.METRICS_DIR, fn)
+                if not fn.endswith(".json") or path == _flusher.path:
+                    continue
+                try:
+                    with open(path) as f:
+                        snap = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if fn.startswith("dead-") or snap.get("ts", 0) < stale:
+                    snap["gauges"] = []  # 已退出的进程：保留累计值，丢弃瞬时值
+                snaps.append(snap)
+    values: Dict[Tuple[str, _Labels], list] = {}
+    gauges: Dict[Tuple[str, _Labels], float] = {}
+    for snap in snaps:
+        _add_rows(values, snap.get("values", ()))
+        for name, labels, v in snap.get("gauges", ()):
+            k = (name, tuple(tuple(p) for p in labels))
+            gauges[k] = gauges.get(k, 0.0) + v[0]
+    return values, gauges
+
+
+def _fmt_labels(labels, extra: str = "") -> str:
+    parts = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{%s}" % ",".join(parts) if parts else ""
+
+
+def _fmt_num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def exposition() -> str:
+    """Prometheus 文本格式（0.0.4）"""
+    values, gauges = _merged()
+    rows: Dict[str, list] = {}
+    for (name, labels), v in values.items():
+        rows.setdefault(name, []).append((labels, v))
+    for (name, labels), v in gauges.items():
+        rows.setdefault(name, []).append((labels, [v]))
+    out = []
+    for name in sorted(rows):
+        kind, help, buckets = _meta.get(name, ("untyped", "", ()))
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, v in sorted(rows[name]):
+            if kind != "histogram":
+                out.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v[0])}")
+                continue
+            cum = 0
+            for le, n in zip(buckets + (float("inf"),), v[:-1]):
+                cum += n
+                bound = 'le="%s"' % ("+Inf" if le == float("inf") else _fmt_num(le))
+                out.append(f"{name}_bucket{_fmt_labels(labels, bound)} {_fmt_num(cum)}")
+            out.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_num(v[-1])}")
+            out.append(f"{name}_count{_fmt_labels(labels)} {_fmt_num(cum)}")
+    return "\n".join(out) + "\n"
+
+
+# ----------------- 采样剖析 -----------------
+
+class SamplingProfiler:
+    """
+    对抽中的请求线程周期性采集 sys._current_frames() 的栈，按折叠栈计数；
+    请求结束时若超过 PROFILE_SLOW_MS 则写出。只采样请求线程本身（线程池里的下载/解码不在其中，
+    它们的耗时见 qq_stage_seconds）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[int, _Tally] = {}
+        self._started = False
+
+    def start(self) -> Optional[int]:
+        """抽中则返回当前线程 id，供 stop() 使用"""
+        if Config.PROFILE_SAMPLE_RATE <= 0 or random.random() >= Config.PROFILE_SAMPLE_RATE:
+            return None
+        tid = threading.get_ident()
+        with self._lock:
+            self._active[tid] = _Tally()
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._loop, name="profiler", daemon=True).start()
+        return tid
+
+    def stop(self, tid: int, elapsed_ms: float, label: str) -> Optional[str]:
+        with self._lock:
+            stacks = self._active.pop(tid, None)
+        if not stacks or elapsed_ms < Config.PROFILE_SLOW_MS:
+            return None
+        try:
+            os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+            path = os.path.join(Config.PROFILE_DIR, f"{int(time.time() * 1000)}-{os.getpid()}-{label}-{int(elapsed_ms)}ms.folded")
+            with open(path, "w") as f:
+                for st, n in stacks.most_common():
+                    f.write(f"{st} {n}\n")
+            return path
+        except OSError:
+            return None
+
+    def _loop(self) -> None:
+        interval = max(1, Config.PROFILE_INTERVAL_MS) / 1000.0
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for tid, tally in self._active.items():
+                    f = frames.get(tid)
+                    if f is not None:
+                        tally[_fold(f)] += 1
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,386 @@
+# native.py
+"""
+纯 Pillow 渲染纯文本语录（头像 + 昵称 + 气泡 + 可选回复块），跳过 Firefox。
+布局按 templates/main-template.html 的 CSS 逐项复刻（#app 内边距 10、头像 100 + 外边距 20、
+昵称 25px、气泡内边距 20 / 圆角 10、正文 35px、回复块 25px/30px 且最多两行）。
+
+只处理能与浏览器输出对齐的 payload：无图片、字符均为无需复杂整形的文字且 MiSans 自带字形；
+其余一律交回浏览器（supports() 为 False）。
+
+默认不启用（RENDER_ENGINE=browser）：与 Firefox 的视觉回归 tests/test_native_visual.py 须在装有
+MiSans、Firefox 与 geckodriver 的镜像中通过后才改为 auto；tests/test_native.py 覆盖与字体无关的部分。
+"""
+import io
+import os
+import re
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from utils import Config
+from metrics import bind, stage
+
+# ---------- 与模板 CSS 对应的尺寸 ----------
+APP_PAD = 10
+APP_MAX_W = 800
+AVATAR = 100
+AVATAR_MARGIN = 20
+NICK_SIZE, NICK_PAD, NICK_MARGIN, NICK_BOX_H = 25, 5, 25, 20
+BODY_PAD, BODY_RADIUS, BODY_MARGIN = 20, 10, 15
+MSG_SIZE = 35
+REPLY_PAD, REPLY_RADIUS, REPLY_GAP = 10, 10, 10
+REPLY_NICK_SIZE, REPLY_MSG_SIZE, REPLY_MAX_LINES = 25, 30, 2
+REPLY_ICON, REPLY_ICON_PAD_TOP, REPLY_FIRST_GAP = 30, 3, 5
+
+BG = (0xF1, 0xF1, 0xF1)
+BODY_BG = (0xFF, 0xFF, 0xFF)
+REPLY_BG = (0xF5, 0xF5, 0xF5)
+NICK_COLOR = (0x94, 0x97, 0xA3)
+TEXT_COLOR = (0, 0, 0)
+BROKEN_BG = (0xE5, 0xE5, 0xE5)  # 与 img.broken 一致
+
+_SS = 4  # 圆角/圆形遮罩的超采样倍数
+
+_ALLOWED_KEYS = {"user_id", "user_nickname", "message", "reply"}
+_ALLOWED_REPLY_KEYS = {"user_nickname", "message"}
+
+# 无需复杂整形（连字/重排/组合附加符号）的区段：拉丁/希腊/西里尔、常用标点与符号、中日韩、全角
+_SIMPLE_RANGES = (
+    (0x0020, 0x02FF), (0x0370, 0x052F), (0x1E00, 0x1EFF), (0x2000, 0x2BFF),
+    (0x3000, 0x9FFF), (0xAC00, 0xD7AF), (0xF900, 0xFAFF), (0xFF00, 0xFFEF),
+)
+# Firefox 对这些码位会改用彩色 emoji 字体
+_EMOJI_HINT = re.compile("[\u200d\ufe0e\ufe0f\u2600-\u27bf\u2b00-\u2bff]")
+
+# 断行：中日韩字符之间可断；避头标点随前一字符，避尾标点随后一字符；其余按空格分词
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CLOSE = "，。、！？；：）」』》】〉”’…,.!?;:)\\]}%"
+_OPEN = "（「『《【〈“‘(\\[{"
+_TOKEN_RE = re.compile(
+    rf"[{_OPEN}]*[{_CJK}][{_CLOSE}]*"      # 单个中日韩字符（连同前后禁则标点）
+    rf"|[^\s{_CJK}]+[ ]*"                    # 非中日韩词 + 其后空格（行尾空格悬挂）
+    r"|[ ]+"
+)
+
+_avatar_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="avatar")
+
+
+@lru_cache(maxsize=None)
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(Config.NATIVE_FONT_PATH, size)
+
+
+@lru_cache(maxsize=None)
+def _line_height(size: int) -> int:
+    asc, desc = _font(size).getmetrics()
+    return asc + desc
+
+
+def available() -> bool:
+    return os.path.isfile(Config.NATIVE_FONT_PATH)
+
+
+@lru_cache(maxsize=1)
+def _notdef_mask() -> bytes:
+    return bytes(_font(MSG_SIZE).getmask("\U0010fffd"))
+
+
+@lru_cache(maxsize=8192)
+def _has_glyph(ch: str) -> bool:
+    """字体缺字时 Pillow 绘制 .notdef，比较位图即可判断（逐字符记忆化）"""
+    if ch == " ":
+        return True
+    return bytes(_font(MSG_SIZE).getmask(ch)) != _notdef_mask()
+
+
+def _simple_text(s) -> bool:
+    if not isinstance(s, str) or _EMOJI_HINT.search(s):
+        return False
+    for ch in s:
+        if ch == "\n":
+            continue
+        cp = ord(ch)
+        if not any(lo <= cp <= hi for lo, hi in _SIMPLE_RANGES) or not _has_glyph(ch):
+            return False
+    return True
+
+
+def supports(payload) -> bool:
+    """纯文本（可带纯文本回复）且字形齐全、条数不超过 NATIVE_MAX_MESSAGES 时可走原生渲染"""
+    if not available() or not isinstance(payload, list) or not payload:
+        return False
+    if len(payload) > Config.NATIVE_MAX_MESSAGES:
+        return False
+    for block in payload:
+        if not isinstance(block, dict) or not set(block) <= _ALLOWED_KEYS:
+            return False
+        if not _simple_text(str(block.get("user_nickname", ""))):
+            return False
+        if "message" in block and not _simple_text(block["message"]):
+            return False
+        reply = block.get("reply")
+        if reply is not None:
+            if not isinstance(reply, dict) or not set(reply) <= _ALLOWED_REPLY_KEYS:
+                return False
+            if not _simple_text(str(reply.get("user_nickname", ""))):
+                return False
+            if "message" in reply and not _simple_text(reply["message"]):
+                return False
+    return True
+
+
+# ---------- 文字排版 ----------
+
+@lru_cache(maxsize=65536)
+def _advance(text: str, size: int) -> float:
+    return _font(size).getlength(text)
+
+
+def _line_advance(text: str, size: int) -> float:
+    """逐分词前进宽度之和，即 _draw_line 的落笔方式（分词间不做字距调整）"""
+    return sum(_advance(tok, size) for tok in _TOKEN_RE.findall(text))
+
+
+def _width(text: str, size: int) -> int:
+    """绘制后占用的整像素宽度"""
+    return int(math.ceil(_line_advance(text, size) - 1e-6))
+
+
+@lru_cache(maxsize=4096)
+def _token_mask(tok: str, size: int):
+    """分词的字形位图（相对基线原点的偏移 + L 模式遮罩）；中日韩逐字成词，命中率很高"""
+    f = _font(size)
+    x0, y0, x1, y1 = f.getbbox(tok, anchor="ls")
+    if x1 <= x0 or y1 <= y0:
+        return None
+    im = Image.new("L", (x1 - x0, y1 - y0), 0)
+    ImageDraw.Draw(im).text((-x0, -y0), tok, font=f, fill=255, anchor="ls")
+    return x0, y0, im
+
+
+def _draw_line(canvas: Image.Image, x: int, baseline: int, line: str, size: int, color) -> None:
+    """按分词贴缓存位图；分词起点取累计前进宽度（与断行时的宽度计算一致）"""
+    pen = float(x)
+    for tok in _TOKEN_RE.findall(line):
+        m = _token_mask(tok.rstrip(" "), size) if tok.strip(" ") else None
+        if m is not None:
+            ox, oy, im = m
+            px, py = int(round(pen)) + ox, baseline + oy
+            canvas.paste(color, (px, py, px + im.width, py + im.height), im)
+        pen += _advance(tok, size)
+
+
+def _max_content(text: str, size: int) -> int:
+    return max((_width(p.rstrip(" "), size) for p in text.split("\n")), default=0)
+
+
+def _break_long(token: str, size: int, max_w: int) -> List[str]:
+    """单个词比行宽还长（word-break: break-word）：逐字符切开"""
+    out, cur = [], ""
+    for ch in token:
+        if cur and _width((cur + ch).rstrip(" "), size) > max_w:
+            out.append(cur)
+            cur = ch
+        else:
+            cur += ch
+    if cur:
+        out.append(cur)
+    return out
+
+
+def _wrap(text: str, size: int, max_w: int) -> List[str]:
+    """
+    white-space: pre-wrap + word-break: break-word 的贪心断行；换行符强制断行。
+    行宽按分词的浮点前进宽度累加（与 _draw_line 的落笔位置一致），只在与 max_w 比较时取整；
+    分词宽度记忆化，getlength 在大字号下每次约 1ms
+    """
+    lines: List[str] = []
+    for para in text.split("\n"):
+        line, line_adv = "", 0.0
+        for tok in _TOKEN_RE.findall(para) or [""]:
+            if math.ceil(line_adv + _advance(tok.rstrip(" "), size) - 1e-6) <= max_w:
+                line += tok
+                line_adv += _advance(tok, size)
+                continue
+            if line:
+                lines.append(line)
+            pieces = _break_long(tok, size, max_w) if _width(tok.rstrip(" "), size) > max_w else [tok]
+            lines.extend(pieces[:-1])
+            line, line_adv = pieces[-1], _line_advance(pieces[-1], size)
+        lines.append(line)
+    return lines
+
+
+def _ellipsize(line: str, size: int, max_w: int) -> str:
+    if _width(line.rstrip(" "), size) <= max_w:
+        return line
+    while line and _width(line.rstrip(" ") + "…", size) > max_w:
+        line = line[:-1]
+    return line.rstrip(" ") + "…"
+
+
+# ---------- 图形 ----------
+
+@lru_cache(maxsize=256)
+def _rounded_mask(w: int, h: int, r: int) -> Image.Image:
+    big = Image.new("L", (w * _SS, h * _SS), 0)
+    ImageDraw.Draw(big).rounded_rectangle((0, 0, w * _SS - 1, h * _SS - 1), radius=r * _SS, fill=255)
+    return big.resize((w, h), Image.LANCZOS)
+
+
+@lru_cache(maxsize=1)
+def _circle_mask() -> Image.Image:
+    big = Image.new("L", (AVATAR * _SS, AVATAR * _SS), 0)
+    ImageDraw.Draw(big).ellipse((0, 0, AVATAR * _SS - 1, AVATAR * _SS - 1), fill=255)
+    return big.resize((AVATAR, AVATAR), Image.LANCZOS)
+
+
+def _fill_rounded(canvas: Image.Image, box: Tuple[int, int, int, int], radius: int, color) -> None:
+    x, y, w, h = box
+    if w <= 0 or h <= 0:
+        return
+    canvas.paste(color, (x, y, x + w, y + h), _rounded_mask(w, h, min(radius, w // 2, h // 2)))
+
+
+@lru_cache(maxsize=1)
+def _reply_icon() -> Image.Image:
+    """回复块右上角图标（模板内 16x16 SVG：横线 + 向上箭头），按 30px 超采样绘制"""
+    s = REPLY_ICON * _SS / 16.0
+    big = Image.new("L", (REPLY_ICON * _SS, REPLY_ICON * _SS), 0)
+    d = ImageDraw.Draw(big)
+    d.rounded_rectangle((3 * s, 2 * s, 13 * s, 3 * s), radius=0.5 * s, fill=255)
+    w = max(1, int(round(1 * s)))
+    d.line([(4.5 * s, 7.5 * s), (8 * s, 4 * s), (11.5 * s, 7.5 * s)], fill=255, width=w, joint="curve")
+    d.line([(8 * s, 4.5 * s), (8 * s, 13.5 * s)], fill=255, width=w)
+    return big.resize((REPLY_ICON, REPLY_ICON), Image.LANCZOS)
+
+
+def _avatar_url(user_id) -> str:
+    return f"https://q1.qlogo.cn/g?b=qq&nk={user_id}&s=640"
+
+
+@lru_cache(maxsize=256)
+def _decode_avatar(content: bytes) -> Image.Image:
+    im = Image.open(io.BytesIO(content))
+    im.seek(0)
+    return im.convert("RGB").resize((AVATAR, AVATAR), Image.LANCZOS)
+
+
+def _load_avatar(user_id, fetch: Callable[[str], bytes]) -> Optional[Image.Image]:
+    try:
+        return _decode_avatar(fetch(_avatar_url(user_id)))
+    except Exception:
+        return None  # 与浏览器一致：加载失败画灰底占位
+
+
+def _media_fetch(url: str) -> bytes:
+    from media import media_cache
+    with stage("fetch"):
+        return media_cache.fetch(url)[0]
+
+
+# ---------- 布局 ----------
+
+class _Dialog:
+    """单条消息的排版结果（坐标均相对该条 .dialog 左上角）"""
+
+    def __init__(self, block: dict):
+        self.user_id = block.get("user_id")
+        self.nickname = str(block.get("user_nickname", ""))
+        msg = block.get("message")
+        reply = block.get("reply")
+
+        body_max = APP_MAX_W - (AVATAR + 2 * AVATAR_MARGIN) - BODY_MARGIN - 2 * BODY_PAD
+        want = _max_content(msg, MSG_SIZE) if msg is not None else 0
+        if reply is not None:
+            self.reply_nick = str(reply.get("user_nickname", ""))
+            self.reply_msg = reply.get("message")
+            inner = max(_width(self.reply_nick, REPLY_NICK_SIZE) + REPLY_ICON,
+                        _max_content(self.reply_msg, REPLY_MSG_SIZE) if self.reply_msg is not None else 0)
+            want = max(want, inner + 2 * REPLY_PAD)
+        self.content_w = min(want, body_max)
+
+        self.msg_lines = _wrap(msg, MSG_SIZE, self.content_w) if msg is not None else []
+        self.reply_h = 0
+        if reply is not None:
+            inner_w = self.content_w - 2 * REPLY_PAD
+            self.reply_nick = _ellipsize(self.reply_nick, REPLY_NICK_SIZE, max(0, inner_w - REPLY_ICON))
+            self.reply_lines = []
+            if self.reply_msg is not None:
+                lines = _wrap(self.reply_msg, REPLY_MSG_SIZE, inner_w)
+                if len(lines) > REPLY_MAX_LINES:
+                    lines = lines[:REPLY_MAX_LINES]
+                    lines[-1] = _ellipsize(lines[-1].rstrip(" ") + "…", REPLY_MSG_SIZE, inner_w)
+                self.reply_lines = lines
+            self.reply_first_h = max(_line_height(REPLY_NICK_SIZE), REPLY_ICON + REPLY_ICON_PAD_TOP)
+            self.reply_h = (2 * REPLY_PAD + self.reply_first_h + REPLY_FIRST_GAP
+                            + len(self.reply_lines) * _line_height(REPLY_MSG_SIZE))
+
+        content_h = len(self.msg_lines) * _line_height(MSG_SIZE)
+        if self.reply_h:
+            content_h += self.reply_h + REPLY_GAP
+        self.body_w = self.content_w + 2 * BODY_PAD
+        self.body_h = content_h + 2 * BODY_PAD
+        # 昵称上下外边距 25（与气泡上外边距 15 折叠），气泡下外边距 15
+        self.body_y = NICK_MARGIN + NICK_BOX_H + 2 * NICK_PAD + NICK_MARGIN
+        col_w = max(_width(self.nickname, NICK_SIZE) + NICK_MARGIN, self.body_w + BODY_MARGIN)
+        self.width = min(AVATAR + 2 * AVATAR_MARGIN + col_w, APP_MAX_W)
+        self.height = max(AVATAR + 2 * AVATAR_MARGIN, self.body_y + self.body_h + BODY_MARGIN)
+
+    def draw(self, canvas: Image.Image, x0: int, y0: int, avatar) -> None:
+        ax, ay = x0 + AVATAR_MARGIN, y0 + AVATAR_MARGIN
+        if avatar is None:
+            canvas.paste(BROKEN_BG, (ax, ay, ax + AVATAR, ay + AVATAR), _circle_mask())
+        else:
+            canvas.paste(avatar, (ax, ay), _circle_mask())
+
+        col_x = x0 + AVATAR + 2 * AVATAR_MARGIN
+        _draw_line(canvas, col_x, y0 + NICK_MARGIN + NICK_PAD + _font(NICK_SIZE).getmetrics()[0],
+                   self.nickname, NICK_SIZE, NICK_COLOR)
+
+        by = y0 + self.body_y
+        _fill_rounded(canvas, (col_x, by, self.body_w, self.body_h), BODY_RADIUS, BODY_BG)
+        cx, cy = col_x + BODY_PAD, by + BODY_PAD
+
+        if self.reply_h:
+            _fill_rounded(canvas, (cx, cy, self.content_w, self.reply_h), REPLY_RADIUS, REPLY_BG)
+            rx, ry = cx + REPLY_PAD, cy + REPLY_PAD
+            inner_w = self.content_w - 2 * REPLY_PAD
+            top = ry + (self.reply_first_h - _line_height(REPLY_NICK_SIZE)) // 2
+            _draw_line(canvas, rx, top + _font(REPLY_NICK_SIZE).getmetrics()[0],
+                       self.reply_nick, REPLY_NICK_SIZE, TEXT_COLOR)
+            icon_y = ry + (self.reply_first_h - REPLY_ICON - REPLY_ICON_PAD_TOP) // 2 + REPLY_ICON_PAD_TOP
+            canvas.paste(TEXT_COLOR, (rx + inner_w - REPLY_ICON, icon_y), _reply_icon())
+            asc = _font(REPLY_MSG_SIZE).getmetrics()[0]
+            ly = ry + self.reply_first_h + REPLY_FIRST_GAP
+            for line in self.reply_lines:
+                _draw_line(canvas, rx, ly + asc, line, REPLY_MSG_SIZE, TEXT_COLOR)
+                ly += _line_height(REPLY_MSG_SIZE)
+            cy += self.reply_h + REPLY_GAP
+
+        asc = _font(MSG_SIZE).getmetrics()[0]
+        for line in self.msg_lines:
+            _draw_line(canvas, cx, cy + asc, line, MSG_SIZE, TEXT_COLOR)
+            cy += _line_height(MSG_SIZE)
+
+
+def render_png(payload: list, fetch: Callable[[str], bytes] = None) -> bytes:
+    """payload 须已通过 supports()；fetch(url) -> bytes 用于取头像，默认走共享媒体缓存"""
+    fetch = fetch or _media_fetch
+    dialogs = [_Dialog(b) for b in payload]
+    uids = list(dict.fromkeys(d.user_id for d in dialogs))
+    avatars = dict(zip(uids, _avatar_executor.map(bind(lambda u: _load_avatar(u, fetch)), uids)))
+
+    w = max(d.width for d in dialogs) + 2 * APP_PAD
+    h = sum(d.height for d in dialogs) + 2 * APP_PAD
+    canvas = Image.new("RGB", (w, h), BG)
+    y = APP_PAD
+    for d in dialogs:
+        d.draw(canvas, APP_PAD, y, avatars.get(d.user_id))
+        y += d.height
+    out = io.BytesIO()
+    canvas.save(out, "PNG", compress_level=Config.NATIVE_PNG_COMPRESS_LEVEL)
+    return out.getvalue()
@@ -0,0 +1,226 @@
+# quantize.py
+"""
+GIF 全局调色板量化：
+- 全局调色板 = 静态底图采样 + 各动图资产的调色板（按资产内容记忆化，跨请求复用）
+- 逐帧映射为向量化最近色查找（只算帧内出现过的颜色），不再每帧跑一次中位切分
+- 可选有序抖动（Bayer 4x4），只作用于动图所在区域，文字与气泡保持干净
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils import Config
+
+# 4x4 Bayer 矩阵，归一化到 [-0.5, 0.5)
+_BAYER4 = (np.array([
+    [0, 8, 2, 10],
+    [12, 4, 14, 6],
+    [3, 11, 1, 9],
+    [15, 7, 13, 5],
+], dtype=np.float32) + 0.5) / 16.0 - 0.5
+
+
+class _MemoLRU:
+    """按条目数限额的小型记忆化 LRU（带命中计数）"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(0, int(max_entries))
+        self._data: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            v = self._data.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key: str, value) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._data)}
+
+
+_asset_palettes = _MemoLRU(Config.GIF_PALETTE_CACHE_ENTRIES)
+
+
+# ----------------- 调色板构建 -----------------
+
+def _median_cut(pixels: np.ndarray, colors: int) -> Tuple[np.ndarray, np.ndarray]:
+    """对 (N, 3) 像素做中位切分，返回 (调色板 (k, 3), 每色像素数 (k,))"""
+    strip = Image.fromarray(np.ascontiguousarray(pixels.reshape(1, -1, 3)), "RGB")
+    q = strip.quantize(colors=max(2, min(256, colors)), method=Image.Quantize.MEDIANCUT)
+    idx = np.asarray(q).reshape(-1)
+    counts = np.bincount(idx, minlength=256)
+    pal = np.frombuffer(bytes(q.getpalette()[:768]), dtype=np.uint8).reshape(-1, 3)
+    used = np.nonzero(counts[:len(pal)])[0]
+    return pal[used].copy(), counts[used]
+
+
+def _sample_opaque(frames: List[Image.Image], budget: int, max_frames: int = 8) -> np.ndarray:
+    """均匀抽取若干帧，按步长取不透明像素，总量约为 budget"""
+    n = len(frames)
+    picks = sorted({int(i * n / min(n, max_frames)) for i in range(min(n, max_frames))})
+    per_frame = max(1, budget // len(picks))
+    out = []
+    for i in picks:
+        a = np.asarray(frames[i].convert("RGBA"))
+        px = a[..., :3][a[..., 3] > 0]
+        if len(px) > per_frame:
+            px = px[::int(np.ceil(len(px) / per_frame))]
+        out.append(px)
+    return np.concatenate(out) if out else np.zeros((0, 3), np.uint8)
+
+
+def asset_palette(asset) -> Tuple[np.ndarray, np.ndarray]:
+    """单个动图资产的调色板；按 (内容哈希, 渲染尺寸) 记忆化，同一张图后续请求不再量化"""
+    key = f"{asset.content_hash}:{asset.display_size[0]}x{asset.display_size[1]}"
+    hit = _asset_palettes.get(key) if asset.content_hash else None
+    if hit is not None:
+        return hit
+    px = _sample_opaque(asset.frames_rgba, Config.GIF_PALETTE_SAMPLE // 2)
+    if len(px) == 0:
+        px = np.zeros((1, 3), np.uint8)
+    res = _median_cut(px, Config.GIF_ASSET_PALETTE_COLORS)
+    if asset.content_hash:
+        _asset_palettes.put(key, res)
+    return res
+
+
+def _nearest(palette_f: np.ndarray, pal_sq: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """(N, 3) 颜色 -> 最近调色板下标（分块矩阵运算，避免 N×K 距离矩阵过大）"""
+    out = np.empty(len(colors), dtype=np.uint8)
+    chunk = 16384
+    for s in range(0, len(colors), chunk):
+        c = colors[s:s + chunk].astype(np.float32)
+        # |c - p|^2 = |c|^2 - 2 c·p + |p|^2，|c|^2 对 argmin 无影响
+        out[s:s + chunk] = np.argmin(pal_sq[None, :] - 2.0 * (c @ palette_f.T), axis=1)
+    return out
+
+
+class GlobalPalette:
+    """
+    一份调色板；负责把 RGB(A) 帧映射为 P 模式。
+    只对帧内实际出现的颜色求最近色（np.unique 去重），结果按 24 bit 颜色记忆在实例上，
+    后续帧只需查找新出现的颜色
+    """
+
+    def __init__(self, colors: np.ndarray):
+        self.colors = colors.astype(np.uint8)
+        self._pal_f = self.colors.astype(np.float32)
+        self._pal_sq = (self._pal_f * self._pal_f).sum(axis=1)
+        self._known = np.zeros(0, dtype=np.uint32)   # 已解析的颜色（升序）
+        self._known_idx = np.zeros(0, dtype=np.uint8)
+        bits = max(1, int(len(self.colors) - 1).bit_length())
+        self.palette_bytes = self.colors.tobytes().ljust(3 * (1 << bits), b"\x00")
+
+    def indices(self, rgb: np.ndarray, origin: Tuple[int, int] = (0, 0),
+                dither_mask: Optional[np.ndarray] = None, strength: float = 0.0) -> np.ndarray:
+        """rgb: (h, w, 3) uint8；dither_mask 与 rgb 同尺寸（已按 origin 裁好）"""
+        if dither_mask is not None and strength > 0 and dither_mask.any():
+            h, w = rgb.shape[:2]
+            x0, y0 = origin
+            ys = (np.arange(h) + y0) % 4
+            xs = (np.arange(w) + x0) % 4
+            # 阈值按画布坐标取，保证同一像素在各帧抖动一致（不闪烁）
+            noise = _BAYER4[ys[:, None], xs[None, :]] * strength
+            noise = np.where(dither_mask, noise, 0.0)[..., None]
+            rgb = np.clip(rgb.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+        packed = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+        uniq, inv = np.unique(packed.reshape(-1), return_inverse=True)
+        pos = np.searchsorted(self._known, uniq)
+        hit = pos < len(self._known)
+        hit[hit] = self._known[pos[hit]] == uniq[hit]
+        idx = np.empty(len(uniq), dtype=np.uint8)
+        idx[hit] = self._known_idx[pos[hit]]
+        if not hit.all():
+            new = uniq[~hit]
+            rgb_new = np.stack([(new >> 16) & 255, (new >> 8) & 255, new & 255], axis=1)
+            idx[~hit] = _nearest(self._pal_f, self._pal_sq, rgb_new)
+            order = np.argsort(np.concatenate([self._known, new]), kind="stable")
+            self._known = np.concatenate([self._known, new])[order]
+            self._known_idx = np.concatenate([self._known_idx, idx[~hit]])[order]
+        return idx[inv].reshape(packed.shape)
+
+    def to_p_image(self, im: Image.Image, origin: Tuple[int, int] = (0, 0),
+                   dither_mask: Optional[np.ndarray] = None, strength: float = 0.0) -> Image.Image:
+        rgb = np.asarray(im.convert("RGB"))
+        p = Image.fromarray(self.indices(rgb, origin, dither_mask, strength), "P")
+        p.putpalette(self.palette_bytes)
+        return p
+
+
+def build_global_palette(base: Image.Image, assets: List, colors: int = None) -> GlobalPalette:
+    """
+    底图采样约占一半预算，其余按资产平分，资产像素由其（记忆化的）调色板按频次展开，
+    合并后做一次中位切分
+    """
+    colors = colors or Config.GIF_COLORS
+    budget = Config.GIF_PALETTE_SAMPLE
+    parts = [_sample_opaque([base], budget // 2 if assets else budget, max_frames=1)]
+    if assets:
+        per_asset = max(1, (budget // 2) // len(assets))
+        for a in assets:
+            pal, counts = asset_palette(a)
+            reps = np.maximum(1, np.round(counts * per_asset / max(1, counts.sum()))).astype(np.intp)
+            parts.append(np.repeat(pal, reps, axis=0))
+    pixels = np.concatenate(parts)
+    pal, _ = _median_cut(pixels, colors)
+    return GlobalPalette(pal)
+
+
+def _animated_mask(canvas_size: Tuple[int, int], placements: Dict[str, Tuple[int, int, int, int]],
+                   assets: List) -> np.ndarray:
+    W, H = canvas_size
+    mask = np.zeros((H, W), dtype=bool)
+    for a in assets:
+        if a.placeholder_id not in placements:
+            continue
+        x, y, w, h = placements[a.placeholder_id]
+        mask[max(0, y):min(H, y + h), max(0, x):min(W, x + w)] = True
+    return mask
+
+
+def quantize_frames_global(
+    frames: Iterable[Image.Image],
+    rects: List[Tuple[int, int, int, int]],
+    base: Image.Image,
+    placements: Dict[str, Tuple[int, int, int, int]],
+    assets: List,
+    dither: bool = None,
+) -> Tuple[Iterator[Image.Image], bytes]:
+    """
+    把子矩形帧序列映射到同一调色板；返回 (惰性产出的 P 模式帧, 全局调色板字节)。
+    调色板只取自底图与资产，不需要预先拿到输出帧
+    """
+    if dither is None:
+        dither = Config.GIF_DITHER
+    gp = build_global_palette(base, assets)
+    mask = _animated_mask(base.size, placements, assets) if dither else None
+    strength = float(Config.GIF_DITHER_STRENGTH) if dither else 0.0
+
+    def gen():
+        for im, (x0, y0, x1, y1) in zip(frames, rects):
+            m = mask[y0:y1, x0:x1] if mask is not None else None
+            yield gp.to_p_image(im, (x0, y0), m, strength)
+
+    return gen(), gp.palette_bytes
+
+
+def palette_cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"assets": _asset_palettes.stats()}
@@ -4,10 +4,148 @@ from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+from PIL import Image
 from utils import Config
+from metrics import record
+from encoders import StitchedPng
 
-import threading
+import io
+import os
+import base64
+import math
 import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+_worker_ids = itertools.count(1)
+
+
+_INJECT_JS = """
+  const app = document.getElementById('app');
+  app.classList.toggle('batch', !!arguments[1]);
+  app.innerHTML = arguments[0];
+  window.scrollTo(0, 0);
+"""
+
+
+# 收集 root 内所有占位元素（动图）相对 root 的坐标与尺寸
+_BOXES_JS = """
+  const root = arguments[0];
+  const rootRect = root.getBoundingClientRect();
+  const list = [];
+  root.querySelectorAll('[data-anim-id]').forEach(el => {
+    const r = el.getBoundingClientRect();
+    list.push({
+      id: el.getAttribute('data-anim-id'),
+      x: Math.round(r.left - rootRect.left),
+      y: Math.round(r.top - rootRect.top),
+      w: Math.round(r.width),
+      h: Math.round(r.height)
+    });
+  });
+  return list;
+"""
+
+
+def _boxes_map(boxes, scale: float = 1.0) -> Dict[str, tuple]:
+    """占位坐标（元素内 CSS px）映射到截图像素；scale 来自 _capture"""
+    if scale == 1.0:
+        return {b["id"]: (b["x"], b["y"], b["w"], b["h"]) for b in boxes}
+    return {
+        b["id"]: (int(round(b["x"] * scale)), int(round(b["y"] * scale)),
+                  max(1, int(round(b["w"] * scale))), max(1, int(round(b["h"] * scale))))
+        for b in boxes
+    }
+
+
+# 元素在文档中的位置（CSS px）与视口信息
+_RECT_JS = """
+  const r = arguments[0].getBoundingClientRect();
+  return {x: r.left + window.scrollX, y: r.top + window.scrollY, w: r.width, h: r.height,
+          dpr: window.devicePixelRatio || 1, vw: window.innerWidth, vh: window.innerHeight};
+"""
+
+_SCROLL_JS = """
+  window.scrollTo(0, arguments[0]);
+  return window.scrollY;
+"""
+
+
+class CaptureTooLarge(ValueError):
+    """截图超出 CAPTURE_MAX_HEIGHT / CAPTURE_MAX_PIXELS 且不允许（或无法）缩小"""
+
+
+def _fit_scale(w: int, h: int) -> float:
+    """输出上限：超限时返回等比缩小系数；CAPTURE_OVERSIZE=error 或需缩到 1/4 以下时抛 CaptureTooLarge"""
+    s = min(1.0, Config.CAPTURE_MAX_HEIGHT / float(h), math.sqrt(Config.CAPTURE_MAX_PIXELS / float(w * h)))
+    if s < 1.0 and (Config.CAPTURE_OVERSIZE == "error" or s < 0.25):
+        raise CaptureTooLarge(
+            f"rendered quote is {w}x{h} px, over the capture limit "
+            f"({Config.CAPTURE_MAX_HEIGHT} px high / {Config.CAPTURE_MAX_PIXELS} px total)"
+        )
+    return s
+
+
+def _capture(d, el, timings: dict) -> Tuple[bytes, float]:
+    """
+    截取元素，返回 (PNG, 缩放比)；缩放比把元素内 CSS 坐标映射到输出像素。
+    矮元素直接用元素截图；高于 CAPTURE_TILE_THRESHOLD_PX 或超出输出上限时改为分块：
+    按视口高度滚动、截取视口、裁出元素所在行并逐条带写入 PNG，Firefox 与本进程都不必持有整张长图
+    """
+    r = d.execute_script(_RECT_JS, el)
+    dpr = float(r["dpr"] or 1)
+    w, h = max(1, int(round(r["w"] * dpr))), max(1, int(round(r["h"] * dpr)))
+    s = _fit_scale(w, h)
+    tall = Config.CAPTURE_TILE_THRESHOLD_PX > 0 and r["h"] > Config.CAPTURE_TILE_THRESHOLD_PX
+    if s == 1.0 and not tall:
+        return el.screenshot_as_png, dpr
+    if r["x"] + r["w"] > r["vw"]:
+        # 比视口宽的元素无法横向拼接，只能整体截（不缩放）
+        if s < 1.0:
+            raise CaptureTooLarge(f"rendered quote is {w}x{h} px and wider than the viewport")
+        return el.screenshot_as_png, dpr
+    return _capture_tiles(d, r, dpr, s, timings), dpr * s
+
+
+def _capture_tiles(d, r: dict, dpr: float, s: float, timings: dict) -> bytes:
+    x0, y0 = int(round(r["x"] * dpr)), int(round(r["y"] * dpr))
+    w, h = max(1, int(round(r["w"] * dpr))), max(1, int(round(r["h"] * dpr)))
+    out_w, out_h = max(1, int(round(w * s))), max(1, int(round(h * s)))
+    out = StitchedPng(out_w, out_h)
+    done = written = tiles = 0  # 已拼接的元素行（设备像素） / 已写出的输出行
+    try:
+        while done < h:
+            sy = d.execute_script(_SCROLL_JS, (y0 + done) / dpr)  # 到底时浏览器会把滚动位置夹在文档末尾
+            tile = Image.open(io.BytesIO(d.get_screenshot_as_png()))
+            top = y0 + done - int(round(float(sy) * dpr))  # 元素第 done 行在视口截图中的位置
+            n = min(tile.height - top, h - done)
+            if top < 0 or n <= 0:
+                raise RuntimeError(f"tiled capture stalled at row {done}/{h}")
+            strip = tile.crop((x0, top, x0 + w, top + n))
+            del tile
+            end = out_h if done + n == h else int(round((done + n) * s))
+            if end > written:
+                if s != 1.0:
+                    strip = strip.resize((out_w, end - written), resample=Image.LANCZOS)
+                out.add(strip)
+                written = end
+            done += n
+            tiles += 1
+    finally:
+        d.execute_script("window.scrollTo(0, 0);")
+    timings["capture_tiles"] = tiles
+    return out.finish()
+
+
+_READY_JS = """
+  const done = arguments[arguments.length - 1];
+  if (typeof window.__quoteReady !== 'function') { done({missing: true}); return; }
+  window.__quoteReady(arguments[0], arguments[1]).then(done, () => done({error: true}));
+"""
 
 
 class _BrowserWorker:
@@ -16,7 +154,75 @@ class _BrowserWorker:
         opts.add_argument("--headless")
         service = Service(executable_path=geckodriver_path) if geckodriver_path else None
         self.driver = webdriver.Firefox(options=opts, service=service) if service else webdriver.Firefox(options=opts)
-        self.lock = threading.Lock()
+        # 固定视口：排版不随无头浏览器默认窗口变化；视口高度即长图分块截图的块高
+        self.driver.set_window_size(Config.CAPTURE_VIEWPORT_WIDTH, Config.CAPTURE_TILE_HEIGHT)
+        self.wid = next(_worker_ids)
+        self.created = time.monotonic()
+        self.idle_since = self.created
+        self.renders = 0
+        self.shell_loaded = False  # inject 模式：常驻外壳页（CSS/字体已加载）
+        # 就绪脚本自带截止时间，这里只留余量兜底
+        self.driver.set_script_timeout(Config.READY_TIMEOUT_SEC + 5)
+
+    def load(self, unique_id=None, html=None, timings=None, batch=False):
+        """
+        把一条语录装入浏览器并等待就绪：
+        - html 为空：导航到 /quote/?id=...（经 Flask 回环渲染）
+        - html 非空：外壳页常驻，仅用 execute_script 替换 #app 内容
+        - batch=True：html 为多个 .quote-app 容器，#app 退化为无样式的纵向排列
+        - 随后等待页面就绪信号（字体 + 所有 <img> 解码完成或超时兜底）
+        各阶段耗时（毫秒）写入 timings：navigate_ms / layout_ms / images_ms
+        """
+        if timings is None:
+            timings = {}
+        d = self.driver
+        start = time.perf_counter()
+        try:
+            if html is None:
+                self.shell_loaded = False
+                d.get(f"http://127.0.0.1:{Config.FLASK_RUN_PORT}/quote/?id={unique_id}")
+            else:
+                if not self.shell_loaded:
+                    d.get(f"http://127.0.0.1:{Config.FLASK_RUN_PORT}/shell/")
+                    self.shell_loaded = True
+                d.execute_script(_INJECT_JS, html, batch)
+            t_nav = time.perf_counter()
+            WebDriverWait(d, Config.READY_TIMEOUT_SEC).until(EC.presence_of_element_located((By.ID, "app")))
+            app_el = d.find_element(By.ID, "app")
+            t_layout = time.perf_counter()
+        except Exception:
+            self.shell_loaded = False  # 页面状态未知，下次重新加载外壳页
+            raise
+        timings["navigate_ms"] = (t_nav - start) * 1000.0
+        timings["layout_ms"] = (t_layout - t_nav) * 1000.0
+        timings["ready"] = self._wait_ready(Config.READY_TIMEOUT_SEC - (t_layout - start))
+        timings["images_ms"] = (time.perf_counter() - t_layout) * 1000.0
+        for k in ("navigate", "layout", "images"):
+            record(k, timings[k + "_ms"] / 1000.0)
+        return app_el
+
+    def _wait_ready(self, remain_sec: float) -> dict:
+        """调用页面内 window.__quoteReady；超时不抛错，按已有画面截图"""
+        deadline_ms = max(0, int(remain_sec * 1000))
+        try:
+            return self.driver.execute_async_script(
+                _READY_JS, Config.READY_IMAGE_TIMEOUT_MS, deadline_ms
+            ) or {}
+        except TimeoutException:
+            return {"deadline_hit": True}
+
+    def healthy(self) -> bool:
+        """探活：会话失效/浏览器崩溃时 WebDriver 调用会抛错"""
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def rss_bytes(self) -> Optional[int]:
+        try:
+            return _proc_tree_rss_bytes(self.driver.service.process.pid)
+        except Exception:
+            return None
 
     def close(self):
         try:
@@ -25,69 +231,335 @@ class _BrowserWorker:
             pass
 
 
+def _proc_tree_rss_bytes(root_pid: int) -> Optional[int]:
+    """geckodriver 及其所有子孙进程（Firefox 主进程/内容进程）RSS 之和；非 Linux 返回 None"""
+    if not os.path.isdir("/proc"):
+        return None
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    page = os.sysconf("SC_PAGE_SIZE")
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read()
+            with open(f"/proc/{name}/statm", "rb") as f:
+                pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        # comm 字段可能含空格，取最后一个 ')' 之后再切分
+        ppid = int(stat[stat.rindex(b")") + 2:].split()[1])
+        pid = int(name)
+        children.setdefault(ppid, []).append(pid)
+        rss[pid] = pages * page
+    if root_pid not in rss:
+        return None
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return total
+
+
+def _ms(sec: Optional[float]) -> Optional[float]:
+    return round(sec * 1000.0, 1) if sec is not None else None
+
+
+class _Waiter:
+    __slots__ = ("event", "worker")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.worker = None
+
+
 class ScreenshotPool:
-    def __init__(self, size: int):
-        self._workers = [_BrowserWorker(Config.GECKODRIVER_PATH) for _ in range(size)]
-        self._cv = threading.Condition()
-        self._busy = set()
-
-    def acquire(self, timeout=Config.WORKER_ACQUIRE_TIMEOUT_SEC):
-        with self._cv:
-            end = time.time() + timeout
-            while True:
-                for i, w in enumerate(self._workers):
-                    if i not in self._busy:
-                        self._busy.add(i)
-                        return i, w
-                remain = end - time.time()
-                if remain <= 0:
-                    raise TimeoutError("No free browser worker")
-                self._cv.wait(timeout=remain)
-
-    def release(self, idx: int):
-        with self._cv:
-            self._busy.discard(idx)
-            self._cv.notify()
+    """
+    自愈 + 弹性浏览器池：
+    - min_size 个 worker 启动即创建，其余按需懒加载，最多 max_size 个
+    - FIFO 公平获取：释放的 worker 直接交给最早排队的等待者
+    - 空闲超过 WORKER_HEALTHCHECK_IDLE_SEC 的 worker 交出前先探活；渲染出错的 worker 归还时探活
+    - 渲染 WORKER_MAX_RENDERS 次或进程树 RSS 超过 WORKER_MAX_RSS_MB 后回收重建
+    - 超出 min_size 且空闲超过 WORKER_IDLE_TTL_SEC 的 worker 自动关闭
+    - 构造不阻塞：warmup 个 worker 在后台线程中并行启动，启动失败的常驻名额按退避重试；
+      ready() 表示至少有一个浏览器可用，首个浏览器就绪与首次渲染完成时回调 on_milestone('browser'|'render')
+    """
+
+    def __init__(self, size: int = None, min_size: int = None, warmup: int = None,
+                 on_milestone: Optional[Callable[[str], None]] = None):
+        self.max_size = max(1, size if size is not None else Config.WORKER_POOL_SIZE)
+        self.min_size = min(self.max_size, max(0, min_size if min_size is not None else Config.WORKER_POOL_MIN))
+        self.warmup = min(self.max_size, max(0, warmup if warmup is not None else Config.WORKER_WARMUP))
+        self.on_milestone = on_milestone
+        self.created = time.monotonic()
+        self._milestones: Dict[str, float] = {}  # 'browser' / 'render' -> 距池创建的秒数
+        self._lock = threading.Lock()
+        self._idle: Deque[_BrowserWorker] = deque()
+        self._busy: Set[_BrowserWorker] = set()
+        self._waiters: Deque[_Waiter] = deque()
+        self._starting = 0
+        self._closed = False
+        # 指标
+        self.acquired = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.timeouts = 0
+        self.recycled = 0
+        self.replaced = 0
+        self.spawn_failures = 0
+        with self._lock:
+            for _ in range(self.warmup):
+                self._spawn_async()
+
+    # ---------- 生命周期 ----------
+
+    def _spawn_async(self) -> None:
+        """调用方须持有 self._lock"""
+        self._starting += 1
+        threading.Thread(target=self._spawn, name="browser-spawn", daemon=True).start()
+
+    def _spawn(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                w = _BrowserWorker(Config.GECKODRIVER_PATH)
+                break
+            except Exception:
+                with self._lock:
+                    self.spawn_failures += 1
+                    # 常驻名额（含本线程占用的 starting）不足时退避重试，否则放弃，由后续请求按需再建
+                    if self._closed or self._total() > max(self.min_size, len(self._waiters)):
+                        self._starting -= 1
+                        return
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+        with self._lock:
+            self._starting -= 1
+            if self._closed:
+                w.close()
+                return
+            self._checkin(w)
+        self._milestone("browser")
+
+    def _milestone(self, name: str) -> None:
+        """记录启动里程碑（每种只记首次）并回调；调用方不得持有 self._lock"""
+        with self._lock:
+            if name in self._milestones:
+                return
+            self._milestones[name] = time.monotonic() - self.created
+        if self.on_milestone is not None:
+            try:
+                self.on_milestone(name)
+            except Exception:
+                pass
+
+    def ready(self) -> bool:
+        """至少有一个浏览器已启动（空闲或正在渲染）"""
+        with self._lock:
+            return bool(self._idle or self._busy)
+
+    def _total(self) -> int:
+        return len(self._idle) + len(self._busy) + self._starting
+
+    def _checkin(self, w: "_BrowserWorker") -> None:
+        """交给队首等待者，否则放回空闲队列。调用方须持有 self._lock"""
+        w.idle_since = time.monotonic()  # 直接交接也刷新：刚用过的 worker 不必在 acquire 时探活
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if waiter.event.is_set():
+                continue  # 已超时离开
+            waiter.worker = w
+            self._busy.add(w)
+            waiter.event.set()
+            return
+        self._idle.append(w)
+
+    def _retire(self, w: "_BrowserWorker") -> None:
+        """关闭 worker，并按需补位。调用方须持有 self._lock"""
+        threading.Thread(target=w.close, daemon=True).start()
+        need = len(self._waiters) > 0 or self._total() < self.min_size
+        if need and not self._closed and self._total() < self.max_size:
+            self._spawn_async()
+
+    def _reap_idle(self) -> None:
+        """调用方须持有 self._lock"""
+        now = time.monotonic()
+        while len(self._idle) and self._total() > self.min_size:
+            w = self._idle[0]
+            if now - w.idle_since < Config.WORKER_IDLE_TTL_SEC:
+                break
+            self._idle.popleft()
+            threading.Thread(target=w.close, daemon=True).start()
+
+    # ---------- 获取 / 归还 ----------
+
+    def acquire(self, timeout=Config.WORKER_ACQUIRE_TIMEOUT_SEC) -> "_BrowserWorker":
+        t0 = time.monotonic()
+        end = t0 + timeout
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("ScreenshotPool is shut down")
+                w = None
+                if self._idle and not self._waiters:
+                    w = self._idle.pop()  # LIFO：热 worker 优先，冷的留在队头等待回收
+                    self._busy.add(w)
+                else:
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+                    if self._total() < self.max_size and self._starting < len(self._waiters):
+                        self._spawn_async()
+            if w is None:
+                remain = end - time.monotonic()
+                if remain > 0:
+                    waiter.event.wait(timeout=remain)
+                with self._lock:
+                    if waiter.worker is None:
+                        waiter.event.set()  # 标记离开，_checkin 会跳过
+                        try:
+                            self._waiters.remove(waiter)
+                        except ValueError:
+                            pass
+                        self.timeouts += 1
+                        record("acquire", time.monotonic() - t0)
+                        raise TimeoutError("No free browser worker")
+                    w = waiter.worker
+            # 长时间空闲的 worker 先探活，失效则替换后重试
+            if time.monotonic() - w.idle_since > Config.WORKER_HEALTHCHECK_IDLE_SEC and not w.healthy():
+                with self._lock:
+                    self._busy.discard(w)
+                    self.replaced += 1
+                    self._retire(w)
+                continue
+            waited = (time.monotonic() - t0) * 1000.0
+            record("acquire", waited / 1000.0)
+            with self._lock:
+                self.acquired += 1
+                self.wait_ms_total += waited
+                self.wait_ms_max = max(self.wait_ms_max, waited)
+            return w
+
+    def release(self, w: "_BrowserWorker", failed: bool = False) -> None:
+        w.renders += 1
+        recycle = w.renders >= Config.WORKER_MAX_RENDERS
+        dead = failed and not w.healthy()
+        if not recycle and not dead and Config.WORKER_MAX_RSS_MB > 0 \
+                and w.renders % Config.WORKER_RSS_CHECK_EVERY == 0:
+            rss = w.rss_bytes()
+            recycle = rss is not None and rss > Config.WORKER_MAX_RSS_MB * 1024 * 1024
+        with self._lock:
+            self._busy.discard(w)
+            if self._closed:
+                threading.Thread(target=w.close, daemon=True).start()
+                return
+            if dead:
+                self.replaced += 1
+                self._retire(w)
+            elif recycle:
+                self.recycled += 1
+                self._retire(w)
+            else:
+                self._checkin(w)
+            self._reap_idle()
+        if not failed and "render" not in self._milestones:
+            self._milestone("render")
+
+    @contextmanager
+    def lease(self, timeout=Config.WORKER_ACQUIRE_TIMEOUT_SEC):
+        w = self.acquire(timeout)
+        failed = False
+        try:
+            yield w
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(w, failed=failed)
 
     def shutdown(self):
-        for w in self._workers:
+        with self._lock:
+            self._closed = True
+            workers = list(self._idle) + list(self._busy)
+            self._idle.clear()
+        for w in workers:
             w.close()
 
-    def render_with_boxes(self, unique_id: str):
-        idx, worker = self.acquire()
-        try:
+    def stats(self) -> dict:
+        with self._lock:
+            workers = list(self._idle) + list(self._busy)
+            now = time.monotonic()
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "total": len(workers),
+                "busy": len(self._busy),
+                "idle": len(self._idle),
+                "starting": self._starting,
+                "queue_depth": len(self._waiters),
+                "acquired": self.acquired,
+                "wait_ms_avg": round(self.wait_ms_total / self.acquired, 2) if self.acquired else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 2),
+                "timeouts": self.timeouts,
+                "recycled": self.recycled,
+                "replaced": self.replaced,
+                "spawn_failures": self.spawn_failures,
+                "warmup": self.warmup,
+                "ready": bool(workers),
+                "first_browser_ms": _ms(self._milestones.get("browser")),
+                "first_render_ms": _ms(self._milestones.get("render")),
+                "workers": [
+                    {"id": w.wid, "renders": w.renders, "age_sec": round(now - w.created, 1), "busy": w in self._busy}
+                    for w in workers
+                ],
+            }
+
+    def render_with_boxes(self, unique_id: str = None, html: str = None, timings=None, acquire_timeout=None):
+        if timings is None:
+            timings = {}
+        with self.lease(acquire_timeout or Config.WORKER_ACQUIRE_TIMEOUT_SEC) as worker:
             d = worker.driver
-            d.get(f"http://127.0.0.1:{Config.FLASK_RUN_PORT}/quote/?id={unique_id}")
-            WebDriverWait(d, 20).until(EC.presence_of_element_located((By.ID, "app")))
-            app_el = d.find_element(By.ID, "app")
-            # 收集所有占位元素（动图）相对 #app 的坐标与尺寸
-            js = """
-              const app = document.getElementById('app');
-              const appRect = app.getBoundingClientRect();
-              const list = [];
-              app.querySelectorAll('[data-anim-id]').forEach(el => {
-                const r = el.getBoundingClientRect();
-                list.push({
-                  id: el.getAttribute('data-anim-id'),
-                  x: Math.round(r.left - appRect.left),
-                  y: Math.round(r.top - appRect.top),
-                  w: Math.round(r.width),
-                  h: Math.round(r.height)
-                });
-              });
-              return list;
-            """
-            boxes = d.execute_script(js)
-            png = app_el.screenshot_as_png
-            boxes_map = {b["id"]: (b["x"], b["y"], b["w"], b["h"]) for b in boxes}
-            return png, boxes_map
-        finally:
-            self.release(idx)
+            app_el = worker.load(unique_id, html, timings)
+            boxes = d.execute_script(_BOXES_JS, app_el)
+            t0 = time.perf_counter()
+            png, scale = _capture(d, app_el, timings)
+            timings["capture_ms"] = (time.perf_counter() - t0) * 1000.0
+            record("capture", timings["capture_ms"] / 1000.0)
+            return png, _boxes_map(boxes, scale)
+
+    def render_batch(self, htmls: List[str], timings=None) -> list:
+        """
+        一次租用、一次就绪等待渲染多条语录：片段各包一层 .quote-app 纵向排列在常驻外壳页，
+        再逐个容器截图。返回与 htmls 对齐的列表，元素为 (png, boxes_map) 或该条的异常；
+        页面装载失败则整体抛出
+        """
+        if timings is None:
+            timings = {}
+        page = "".join(
+            f'<div class="quote-app" data-batch-idx="{i}">{h}</div>' for i, h in enumerate(htmls)
+        )
+        with self.lease() as worker:
+            d = worker.driver
+            worker.load(html=page, timings=timings, batch=True)
+            t0 = time.perf_counter()
+            out = []
+            for i in range(len(htmls)):
+                try:
+                    el = d.find_element(By.CSS_SELECTOR, f'.quote-app[data-batch-idx="{i}"]')
+                    boxes = d.execute_script(_BOXES_JS, el)
+                    png, scale = _capture(d, el, {})
+                    out.append((png, _boxes_map(boxes, scale)))
+                except Exception as e:
+                    out.append(e)
+            timings["capture_ms"] = (time.perf_counter() - t0) * 1000.0
+            record("capture", timings["capture_ms"] / 1000.0)
+            return out
 
 
 class Screenshot:
-    def __init__(self):
-        self.pool = ScreenshotPool(Config.WORKER_POOL_SIZE)
+    def __init__(self, on_milestone: Optional[Callable[[str], None]] = None):
+        self.pool = ScreenshotPool(Config.WORKER_POOL_SIZE, Config.WORKER_POOL_MIN, on_milestone=on_milestone)
 
     def __del__(self):
         try:
@@ -95,16 +567,18 @@ class Screenshot:
         except Exception:
             pass
 
-    def screenshot(self, ret_type, unique_id):
-        idx, worker = self.pool.acquire()
-        try:
-            d = worker.driver
-            d.get(f"http://127.0.0.1:{Config.FLASK_RUN_PORT}/quote/?id={unique_id}")
-            WebDriverWait(d, 20).until(EC.presence_of_element_located((By.ID, "app")))
-            app_el = d.find_element(By.ID, "app")
-            if ret_type == 'png':
-                return app_el.screenshot_as_png
-            elif ret_type == 'base64':
-                return app_el.screenshot_as_base64
-        finally:
-            self.pool.release(idx)
\ No newline at end of file
+    def screenshot(self, ret_type, unique_id=None, html=None, timings=None, acquire_timeout=None):
+        if timings is None:
+            timings = {}
+        with self.pool.lease(acquire_timeout or Config.WORKER_ACQUIRE_TIMEOUT_SEC) as worker:
+            app_el = worker.load(unique_id, html, timings)
+            t0 = time.perf_counter()
+            try:
+                png, _ = _capture(worker.driver, app_el, timings)
+                if ret_type == 'png':
+                    return png
+                elif ret_type == 'base64':
+                    return base64.b64encode(png).decode('ascii')
+            finally:
+                timings["capture_ms"] = (time.perf_counter() - t0) * 1000.0
+                record("capture", timings["capture_ms"] / 1000.0)
\ No newline at end of file
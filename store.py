@@ -0,0 +1,276 @@
+# store.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from utils import Config
+
+
+class MemoryPayloadStore:
+    """进程内存储（仅单 worker 时可用）：TTL + 条目数上限"""
+
+    def __init__(self, ttl_sec: float, max_entries: int):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max(1, max_entries)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, payload: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl_sec, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                self._data.pop(key, None)
+                return None
+            return item[1]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLitePayloadStore:
+    """
+    基于 SQLite（WAL）的共享存储：同一容器内所有 gunicorn worker 可见，
+    保证 Firefox 回访 /quote/ 落到任意 worker 都能取到数据。
+    - 每线程独立连接
+    - 写入时顺带清理过期项，并按 created 淘汰超出上限的旧条目
+    """
+
+    def __init__(self, path: str, ttl_sec: float, max_entries: int):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_entries = max(1, max_entries)
+        self._local = threading.local()
+        self._puts = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        con = self._conn()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS payloads ("
+            " id TEXT PRIMARY KEY, data TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS payloads_expires ON payloads(expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def put(self, key: str, payload: Any) -> None:
+        now = time.time()
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        con = self._conn()
+        con.execute(
+            "INSERT OR REPLACE INTO payloads(id, data, created, expires) VALUES (?, ?, ?, ?)",
+            (key, data, now, now + self.ttl_sec),
+        )
+        self._puts += 1
+        if self._puts % 64 == 0:
+            self._prune(con, now)
+
+    def _prune(self, con: sqlite3.Connection, now: float) -> None:
+        con.execute("DELETE FROM payloads WHERE expires < ?", (now,))
+        con.execute(
+            "DELETE FROM payloads WHERE id NOT IN (SELECT id FROM payloads ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT data FROM payloads WHERE id = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM payloads WHERE id = ?", (key,))
+
+
+_JOB_FIELDS = ("id", "status", "format", "priority", "created", "updated", "deadline", "http_status", "error", "mimetype")
+JOB_FINAL = ("done", "failed", "cancelled", "expired")
+
+
+class MemoryJobStore:
+    """异步任务状态与结果（仅单 worker 时可用）：TTL + 条目数上限"""
+
+    def __init__(self, ttl_sec: float, max_entries: int):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max(1, max_entries)
+        self._data: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str, meta: dict) -> None:
+        now = time.time()
+        rec = {k: meta.get(k) for k in _JOB_FIELDS}
+        rec.update(id=job_id, status=meta.get("status") or "queued", created=now, updated=now,
+                   expires=now + self.ttl_sec, cancel=False, result=None)
+        with self._lock:
+            self._data[job_id] = rec
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def update(self, job_id: str, status: str, result: Optional[bytes] = None, **fields) -> None:
+        now = time.time()
+        with self._lock:
+            rec = self._data.get(job_id)
+            if rec is None:
+                return
+            rec.update(fields, status=status, updated=now, expires=now + self.ttl_sec)
+            if result is not None:
+                rec["result"] = result
+
+    def _live(self, job_id: str) -> Optional[dict]:
+        rec = self._data.get(job_id)
+        if rec is not None and rec["expires"] < time.time():
+            self._data.pop(job_id, None)
+            return None
+        return rec
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            rec = self._live(job_id)
+            return {k: rec[k] for k in _JOB_FIELDS} if rec else None
+
+    def result(self, job_id: str) -> Optional[bytes]:
+        with self._lock:
+            rec = self._live(job_id)
+            return rec["result"] if rec else None
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """标记取消；返回标记时的状态（不存在为 None）"""
+        with self._lock:
+            rec = self._live(job_id)
+            if rec is None:
+                return None
+            if rec["status"] not in JOB_FINAL:
+                rec["cancel"] = True
+            return rec["status"]
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            rec = self._data.get(job_id)
+            return bool(rec and rec["cancel"])
+
+
+class SQLiteJobStore:
+    """
+    异步任务状态与结果的共享存储（WAL）：POST /jobs 与轮询/取消可能落到不同 gunicorn worker。
+    任务只在接收它的 worker 内执行；其余 worker 经此读取状态、结果或写入取消标记
+    """
+
+    def __init__(self, path: str, ttl_sec: float, max_entries: int):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_entries = max(1, max_entries)
+        self._local = threading.local()
+        self._creates = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        con = self._conn()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, format TEXT, priority TEXT,"
+            " created REAL NOT NULL, updated REAL NOT NULL, deadline REAL, expires REAL NOT NULL,"
+            " http_status INTEGER, error TEXT, mimetype TEXT, cancel INTEGER NOT NULL DEFAULT 0, result BLOB)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS jobs_expires ON jobs(expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def create(self, job_id: str, meta: dict) -> None:
+        now = time.time()
+        con = self._conn()
+        con.execute(
+            "INSERT OR REPLACE INTO jobs(id, status, format, priority, created, updated, deadline, expires)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, meta.get("status") or "queued", meta.get("format"), meta.get("priority"),
+             now, now, meta.get("deadline"), now + self.ttl_sec),
+        )
+        self._creates += 1
+        if self._creates % 64 == 0:
+            con.execute("DELETE FROM jobs WHERE expires < ?", (now,))
+            con.execute(
+                "DELETE FROM jobs WHERE id NOT IN (SELECT id FROM jobs ORDER BY created DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def update(self, job_id: str, status: str, result: Optional[bytes] = None, **fields) -> None:
+        now = time.time()
+        cols = ["status = ?", "updated = ?", "expires = ?"]
+        args: list = [status, now, now + self.ttl_sec]
+        for k in ("http_status", "error", "mimetype"):
+            if k in fields:
+                cols.append(f"{k} = ?")
+                args.append(fields[k])
+        if result is not None:
+            cols.append("result = ?")
+            args.append(sqlite3.Binary(result))
+        self._conn().execute(f"UPDATE jobs SET {', '.join(cols)} WHERE id = ?", (*args, job_id))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            f"SELECT {', '.join(_JOB_FIELDS)} FROM jobs WHERE id = ? AND expires >= ?", (job_id, time.time())
+        ).fetchone()
+        return dict(zip(_JOB_FIELDS, row)) if row else None
+
+    def result(self, job_id: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT result FROM jobs WHERE id = ? AND expires >= ?", (job_id, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row and row[0] is not None else None
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        con = self._conn()
+        con.execute(
+            f"UPDATE jobs SET cancel = 1 WHERE id = ? AND status NOT IN ({', '.join('?' * len(JOB_FINAL))})",
+            (job_id, *JOB_FINAL),
+        )
+        row = con.execute("SELECT status FROM jobs WHERE id = ? AND expires >= ?", (job_id, time.time())).fetchone()
+        return row[0] if row else None
+
+    def cancel_requested(self, job_id: str) -> bool:
+        row = self._conn().execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+
+def _build_payload_store():
+    if Config.PAYLOAD_STORE == "memory":
+        return MemoryPayloadStore(Config.PAYLOAD_TTL_SEC, Config.PAYLOAD_STORE_MAX_ENTRIES)
+    return SQLitePayloadStore(Config.PAYLOAD_STORE_PATH, Config.PAYLOAD_TTL_SEC, Config.PAYLOAD_STORE_MAX_ENTRIES)
+
+
+payload_store = _build_payload_store()
+
+
+def _build_job_store():
+    if Config.PAYLOAD_STORE == "memory":
+        return MemoryJobStore(Config.JOBS_RESULT_TTL_SEC, Config.JOBS_STORE_MAX_ENTRIES)
+    return SQLiteJobStore(Config.JOBS_STORE_PATH, Config.JOBS_RESULT_TTL_SEC, Config.JOBS_STORE_MAX_ENTRIES)
+
+
+job_store = _build_job_store()
@@ -0,0 +1,10 @@
+# tests/conftest.py
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("METRICS_DIR", "")
+os.environ.setdefault("WORKER_POOL_SIZE", "1")
+os.environ.setdefault("RENDER_CACHE_MAX_BYTES", "0")  # 测的是真实渲染，不走结果缓存
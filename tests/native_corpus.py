@@ -0,0 +1,44 @@
+# tests/native_corpus.py
+"""
+原生渲染与浏览器对比用的纯文本语料及像素差异计算；
+tests/test_native_visual.py 与 bench/native_render.py 共用
+"""
+import io
+import os
+
+CORPUS = {
+    "short": [{"user_id": 5435486, "user_nickname": "竹林里有冰", "message": "请大家多多 star 本项目！"}],
+    "reply": [{"user_id": 5435486, "user_nickname": "竹林里有冰", "message": "你好啊，我是你的小可爱",
+               "reply": {"user_nickname": "竹林里没冰", "message": "你好啊，我不是你的小可爱" * 6}}],
+    "long_cjk": [{"user_id": 10001, "user_nickname": "长消息", "message": "天下大势，分久必合，合久必分。" * 12}],
+    "long_latin": [{"user_id": 10002, "user_nickname": "latin", "message": "The quick brown fox jumps over the lazy dog. " * 8}],
+    "newlines": [{"user_id": 10003, "user_nickname": "多行", "message": "第一行\n  缩进的第二行\n\n空行之后 mixed English 文本"}],
+    "conversation": [
+        {"user_id": 10000 + i % 3, "user_nickname": f"用户{i % 3}", "message": f"第 {i} 条消息，内容长短不一。" * (1 + i % 4)}
+        for i in range(10)
+    ],
+}
+
+
+def image_diff(a: bytes, b: bytes, out_dir: str = None, name: str = "") -> dict:
+    """两张 PNG 在公共区域上的逐像素差异（通道最大差）；out_dir 非空时写出 native/browser/diff 三张图"""
+    import numpy as np
+    from PIL import Image
+    ia = Image.open(io.BytesIO(a)).convert("RGB")
+    ib = Image.open(io.BytesIO(b)).convert("RGB")
+    w, h = min(ia.width, ib.width), min(ia.height, ib.height)
+    da = np.asarray(ia, dtype=np.int16)[:h, :w]
+    db = np.asarray(ib, dtype=np.int16)[:h, :w]
+    d = np.abs(da - db).max(axis=2)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        ia.save(os.path.join(out_dir, f"{name}.native.png"))
+        ib.save(os.path.join(out_dir, f"{name}.browser.png"))
+        Image.fromarray((d > 32).astype("uint8") * 255).save(os.path.join(out_dir, f"{name}.diff.png"))
+    return {
+        "native_size": list(ia.size),
+        "browser_size": list(ib.size),
+        "size_match": ia.size == ib.size,
+        "mean_abs_diff": round(float(d.mean()), 3),
+        "diff_pixels_pct": round(100.0 * float((d > 32).mean()), 3),
+    }
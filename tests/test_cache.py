@@ -0,0 +1,37 @@
+# tests/test_cache.py
+"""渲染结果缓存 key：影响输出字节的配置变化后不能命中旧结果"""
+import pytest
+
+from cache import render_cache_key
+from utils import Config
+
+PAYLOAD = [{"user_id": 1, "user_nickname": "a", "message": "hi"}]
+
+KNOBS = [
+    "GIF_MIN_DELAY_MS", "GIF_ROUND_TO_MS", "GIF_PALETTE_SAMPLE", "GIF_ASSET_PALETTE_COLORS", "USE_GIFSICLE",
+    "APNG_MAX_DEN", "APNG_DELAY_TOL_MS", "RENDER_MODE",
+    "CAPTURE_VIEWPORT_WIDTH", "CAPTURE_TILE_HEIGHT", "CAPTURE_TILE_THRESHOLD_PX",
+    "CAPTURE_MAX_HEIGHT", "CAPTURE_MAX_PIXELS", "CAPTURE_OVERSIZE",
+    "NATIVE_MAX_MESSAGES", "NATIVE_PNG_COMPRESS_LEVEL",
+]
+
+
+def _changed(value):
+    if isinstance(value, bool):
+        return not value
+    if isinstance(value, (int, float)):
+        return value + 1
+    return value + "-changed"
+
+
+@pytest.mark.parametrize("name", KNOBS)
+def test_key_covers_output_settings(name, monkeypatch):
+    before = render_cache_key(PAYLOAD, "gif")
+    monkeypatch.setattr(Config, name, _changed(getattr(Config, name)))
+    assert render_cache_key(PAYLOAD, "gif") != before
+
+
+def test_key_is_stable_and_shared_by_png_and_base64():
+    assert render_cache_key(PAYLOAD, "png") == render_cache_key(list(PAYLOAD), "base64")
+    assert render_cache_key(PAYLOAD, "png") != render_cache_key(PAYLOAD, "gif")
+    assert render_cache_key(PAYLOAD, "apng", "delta") != render_cache_key(PAYLOAD, "apng", "fast")
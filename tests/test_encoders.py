@@ -0,0 +1,57 @@
+# tests/test_encoders.py
+"""动画 WebP / AVIF 编码：惰性整帧序列经临时多页 TIFF 交给 Pillow 的 save_all"""
+import io
+import warnings
+
+import pytest
+from PIL import Image
+
+from encoders import encode_webp_avif, format_available
+
+FORMATS = [f for f in ("WEBP", "AVIF") if format_available(f)]
+
+
+def _frames(n, size=(64, 48)):
+    for i in range(n):
+        im = Image.new("RGBA", size, (240, 240, 240, 255))
+        im.paste((200, 20 * i % 256, 0, 255), (4 * i, 8, 4 * i + 16, 24))
+        yield im
+
+
+def _decode(data):
+    im = Image.open(io.BytesIO(data))
+    out = []
+    for i in range(getattr(im, "n_frames", 1)):
+        im.seek(i)
+        out.append((im.convert("RGBA").getpixel((4 * i + 8, 16)), im.info.get("duration")))
+    return im.size, out
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_lazy_frames_round_trip(fmt):
+    frames = _frames(6)  # 生成器：编码器不能依赖 len()
+    size, out = _decode(encode_webp_avif(fmt, frames, [40, 50, 60, 70, 80, 90], preset="high"))
+    assert size == (64, 48)
+    assert [d for _, d in out] == [40, 50, 60, 70, 80, 90]
+    for i, (px, _) in enumerate(out):
+        assert abs(px[1] - 20 * i % 256) <= 8 and px[0] >= 180
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_zero_duration_frames_are_dropped(fmt):
+    _, out = _decode(encode_webp_avif(fmt, _frames(4), [40, 0, 30, 50], preset="high"))
+    assert [d for _, d in out] == [40, 30, 50]
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_single_frame(fmt):
+    size, out = _decode(encode_webp_avif(fmt, _frames(1), [1000]))
+    assert size == (64, 48) and len(out) == 1
+
+
+def test_format_available_without_warning():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        format_available("avif")
+        assert format_available("webp") in (True, False)
+        assert not format_available("nosuchcodec")
@@ -0,0 +1,78 @@
+# tests/test_jobs.py
+"""任务队列：动图名额始终给静态 PNG 留一个执行线程；取消排队任务时不持锁写 store"""
+import threading
+import time
+
+import pytest
+
+from jobs import Job, JobQueue
+from store import MemoryJobStore
+
+
+class _Store(MemoryJobStore):
+    def __init__(self):
+        super().__init__(ttl_sec=60, max_entries=100)
+        self.queue = None
+        self.updates_under_lock = 0
+
+    def update(self, job_id, status, result=None, **fields):
+        if self.queue is not None and self.queue._cond._is_owned():
+            self.updates_under_lock += 1
+        super().update(job_id, status, result=result, **fields)
+
+
+def _job(i, animated=False):
+    return Job(id=f"j{i}", fmt="gif" if animated else "png", payload=None,
+               deadline=time.time() + 30, animated=animated)
+
+
+@pytest.mark.parametrize("workers,cap,expected", [(1, 0, (2, 1)), (1, 5, (2, 1)), (4, 0, (4, 3)), (4, 2, (4, 2)),
+                                                  (4, 9, (4, 3))])
+def test_animated_cap_leaves_a_static_thread(workers, cap, expected):
+    q = JobQueue(lambda job: (b"", "image/png"), _Store(), workers=workers, max_animated=cap)
+    assert (q.workers, q.max_animated) == expected
+
+
+def test_static_job_runs_while_animated_jobs_block():
+    release = threading.Event()
+
+    def runner(job):
+        if job.animated:
+            release.wait(10)
+        return b"ok", "image/png"
+
+    store = _Store()
+    q = JobQueue(runner, store, workers=1, max_animated=0)
+    anims = [_job(i, animated=True) for i in range(3)]
+    static = _job(99)
+    try:
+        for job in anims + [static]:
+            q.submit(job)
+        assert static.done.wait(5), "static job starved by animated jobs"
+        assert store.get(static.id)["status"] == "done"
+        assert q.stats()["running_animated"] == 1
+    finally:
+        release.set()
+    assert all(job.done.wait(5) for job in anims)
+
+
+def test_cancel_queued_job_writes_store_outside_lock():
+    release = threading.Event()
+    store = _Store()
+    q = JobQueue(lambda job: (release.wait(10), (b"", "image/png"))[1], store, workers=2, max_animated=1)
+    store.queue = q
+    try:
+        running = [_job(1), _job(2)]
+        for job in running:
+            q.submit(job)
+        deadline = time.time() + 5
+        while q.stats()["running"] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        queued = _job(3)
+        q.submit(queued)
+        assert q.cancel(queued.id) == "queued"
+        assert queued.done.is_set()
+        assert store.get(queued.id)["status"] == "cancelled"
+        assert store.updates_under_lock == 0
+    finally:
+        release.set()
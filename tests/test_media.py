@@ -0,0 +1,40 @@
+# tests/test_media.py
+"""MediaCache 的 URL 索引：进程内 LRU 与磁盘条目（跨 worker 反查 /media/<key>）"""
+import os
+import time
+
+import pytest
+
+from utils import Config
+from media import MediaCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "MEDIA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "MEDIA_URL_INDEX_MAX", 2)
+    return MediaCache()
+
+
+def test_register_refreshes_disk_entry(cache):
+    key = cache.register("http://x/a.png")
+    path = cache.store.disk.locate("u" + key)
+    os.utime(path, (time.time() - 3600, time.time() - 3600))
+    cache.register("http://x/a.png")
+    assert os.stat(path).st_mtime > time.time() - 60  # 热 URL 不会先于冷的媒体文件被清理
+
+
+def test_register_rewrites_pruned_disk_entry(cache):
+    key = cache.register("http://x/a.png")
+    os.remove(cache.store.disk.locate("u" + key))
+    cache.register("http://x/a.png")
+    other = MediaCache()  # 另一个 worker：进程内索引为空，只能靠磁盘条目
+    assert other.lookup_url(key) == "http://x/a.png"
+
+
+def test_url_index_is_lru(cache):
+    a = cache.register("http://x/a.png")
+    b = cache.register("http://x/b.png")
+    cache.register("http://x/a.png")  # 命中：a 变为最近使用
+    cache.register("http://x/c.png")  # 超出 MEDIA_URL_INDEX_MAX=2，淘汰最久未用的 b
+    assert a in cache._urls and b not in cache._urls
@@ -0,0 +1,83 @@
+# tests/test_metrics.py
+"""多进程指标汇总：已退出进程的快照并入 archive.json，/metrics 读取与合并互斥"""
+import json
+import os
+import time
+
+import pytest
+
+import metrics
+from utils import Config
+
+HIST = "qq_test_seconds"
+COUNTER = "qq_test_total"
+
+
+def _write(directory, name, values, gauges=(), ts=None):
+    snap = {"pid": 0, "ts": time.time() if ts is None else ts, "values": values, "gauges": list(gauges)}
+    with open(os.path.join(directory, name), "w") as f:
+        json.dump(snap, f)
+
+
+@pytest.fixture
+def mdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    flusher = metrics._Flusher()
+    flusher.started, flusher.path = True, str(tmp_path / f"{os.getpid()}.json")  # 不启动后台线程
+    monkeypatch.setattr(metrics, "_flusher", flusher)
+    return str(tmp_path)
+
+
+def _dead_pid() -> int:
+    pid = 2 ** 22 + 12345
+    while metrics._pid_alive(pid):
+        pid += 1
+    return pid
+
+
+def test_compact_sums_dead_snapshots(mdir):
+    _write(mdir, "dead-11-1.json", [[COUNTER, [["a", "x"]], [3]], [HIST, [], [1, 2, 0, 3, 0.5]]],
+           gauges=[["qq_test_gauge", [], [7]]])
+    _write(mdir, f"{_dead_pid()}.json", [[COUNTER, [["a", "x"]], [4]], [HIST, [], [0, 1, 1, 2, 0.25]]])
+    _write(mdir, f"{os.getppid()}.json", [[COUNTER, [["a", "x"]], [100]]])  # 存活进程：不并入
+
+    assert metrics._compact(mdir, metrics._flusher.path) == 2
+    assert sorted(fn for fn in os.listdir(mdir) if fn.endswith(".json")) == sorted(
+        ["archive.json", f"{os.getppid()}.json"])
+    with open(os.path.join(mdir, "archive.json")) as f:
+        archive = json.load(f)
+    rows = {(name, tuple(map(tuple, labels))): v for name, labels, v in archive["values"]}
+    assert rows[(COUNTER, (("a", "x"),))] == [7]
+    assert rows[(HIST, ())] == [1, 3, 1, 5, 0.75]
+    assert archive["gauges"] == []
+
+    # 再次合并在原 archive 上累加
+    _write(mdir, "dead-12-1.json", [[COUNTER, [["a", "x"]], [10]]])
+    assert metrics._compact(mdir, metrics._flusher.path) == 1
+    values, _ = metrics._merged()
+    assert values[(COUNTER, (("a", "x"),))] == [117]
+    assert values[(HIST, ())] == [1, 3, 1, 5, 0.75]
+
+
+def test_merged_counts_each_snapshot_once_across_compaction(mdir):
+    _write(mdir, "dead-21-1.json", [[COUNTER, [], [5]]])
+    _write(mdir, "dead-22-1.json", [[COUNTER, [], [6]]])
+    before, _ = metrics._merged()
+    metrics._compact(mdir, metrics._flusher.path)
+    after, _ = metrics._merged()
+    assert before[(COUNTER, ())] == after[(COUNTER, ())] == [11]
+
+
+def test_compact_skips_while_scrape_holds_lock(mdir):
+    _write(mdir, "dead-31-1.json", [[COUNTER, [], [1]]])
+    with metrics._dir_lock(mdir, exclusive=False) as held:
+        assert held
+        assert metrics._compact(mdir, metrics._flusher.path) == 0
+    assert metrics._compact(mdir, metrics._flusher.path) == 1
+
+
+def test_stale_gauges_dropped(mdir):
+    _write(mdir, "dead-41-1.json", [], gauges=[["qq_test_gauge", [], [7]]])
+    _write(mdir, f"{os.getppid()}.json", [], gauges=[["qq_test_gauge", [], [2]]])
+    _, gauges = metrics._merged()
+    assert gauges[("qq_test_gauge", ())] == 2
@@ -0,0 +1,158 @@
+# tests/test_native.py
+"""
+原生渲染中与字体无关的部分：supports() 的准入条件、_TOKEN_RE 分词与禁则、按模板 CSS 的布局尺寸。
+字体用 Pillow 自带的默认字体（仅拉丁字形，中日韩字符按 .notdef 等宽处理），不依赖 MiSans
+"""
+import io
+
+import pytest
+from PIL import Image, ImageFont
+
+from utils import Config
+import native
+
+_CACHED = (native._font, native._line_height, native._notdef_mask, native._has_glyph,
+           native._advance, native._token_mask)
+
+
+def _clear_caches():
+    for fn in _CACHED:
+        fn.cache_clear()
+
+
+@pytest.fixture
+def font(tmp_path, monkeypatch):
+    data = getattr(ImageFont.load_default(size=10), "font_bytes", None)
+    if not data:
+        pytest.skip("Pillow built without FreeType (no bundled TrueType font)")
+    path = tmp_path / "fallback.ttf"
+    path.write_bytes(data)
+    monkeypatch.setattr(Config, "NATIVE_FONT_PATH", str(path))
+    _clear_caches()
+    yield
+    _clear_caches()
+
+
+def _quote(message="hello world", **extra):
+    return [dict({"user_id": 1, "user_nickname": "nick", "message": message}, **extra)]
+
+
+# ---------- supports() ----------
+
+def test_supports_requires_font(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "NATIVE_FONT_PATH", str(tmp_path / "missing.ttf"))
+    assert not native.supports(_quote())
+
+
+def test_supports_plain_text(font):
+    assert native.supports(_quote())
+    assert native.supports(_quote("line one\nline two", reply={"user_nickname": "r", "message": "quoted"}))
+    assert native.supports([{"user_id": 1, "user_nickname": "nick"}])  # 无 message
+
+
+@pytest.mark.parametrize("payload", [
+    [],
+    {"user_id": 1},
+    ["not a dict"],
+    _quote(image="https://example.com/a.png"),              # 模板其它字段
+    _quote(["text", {"type": "image"}]),                    # 图文混排
+    _quote("smile \u263a"),                                 # emoji 区段
+    _quote("a\u200db"),                                     # 零宽连接符
+    _quote("\u0627\u0644\u0639\u0631\u0628\u064a\u0629"),   # 需整形的文字
+    _quote("中文"),                                           # 字体缺字
+    _quote(reply={"user_nickname": "r", "message": "m", "image": "x"}),
+    _quote(reply="not a dict"),
+])
+def test_supports_rejects(font, payload):
+    assert not native.supports(payload)
+
+
+def test_supports_message_limit(font, monkeypatch):
+    monkeypatch.setattr(Config, "NATIVE_MAX_MESSAGES", 2)
+    assert native.supports(_quote() * 2)
+    assert not native.supports(_quote() * 3)
+
+
+# ---------- 分词与禁则 ----------
+
+@pytest.mark.parametrize("text,tokens", [
+    ("hello world", ["hello ", "world"]),
+    ("你好，世界。", ["你", "好，", "世", "界。"]),
+    ("他说：「好」", ["他", "说：", "「好」"]),
+    ("（注）abc", ["（注）", "abc"]),
+    ("abc中文def", ["abc", "中", "文", "def"]),
+    ("a   b", ["a   ", "b"]),
+    ("  lead", ["  ", "lead"]),
+    ("100%的", ["100%", "的"]),
+])
+def test_token_re(text, tokens):
+    assert native._TOKEN_RE.findall(text) == tokens
+    assert "".join(tokens) == text
+
+
+def test_wrap_keeps_kinsoku_punctuation(font):
+    text = "天下大势，分久必合，合久必分。（注）「引号」" * 3
+    size = native.MSG_SIZE
+    max_w = native._width("天下大势", size)
+    lines = native._wrap(text, size, max_w)
+    assert "".join(lines) == text
+    assert len(lines) > 1
+    for line in lines:
+        assert native._width(line.rstrip(" "), size) <= max_w or len(native._TOKEN_RE.findall(line)) == 1
+        assert line[0] not in native._CLOSE            # 避头：行首不出现收尾标点
+        assert line.rstrip(" ")[-1] not in native._OPEN  # 避尾：行尾不出现开头标点
+
+
+def test_wrap_words_and_newlines(font):
+    size = native.MSG_SIZE
+    max_w = native._width("quick brown", size)
+    lines = native._wrap("the quick brown fox\nx", size, max_w)
+    assert lines[-1] == "x"
+    assert all(line.rstrip(" ") in ("the quick", "the", "quick brown", "brown fox", "fox") for line in lines[:-1])
+    assert "".join(lines[:-1]) == "the quick brown fox"
+
+
+def test_wrap_breaks_overlong_word(font):
+    size = native.MSG_SIZE
+    max_w = native._width("abcd", size)
+    lines = native._wrap("abcdefghijkl", size, max_w)
+    assert "".join(lines) == "abcdefghijkl"
+    assert len(lines) > 1 and all(native._width(line, size) <= max_w for line in lines)
+
+
+# ---------- 布局尺寸 ----------
+
+def _size(png: bytes):
+    return Image.open(io.BytesIO(png)).size
+
+
+def test_layout_single_line(font):
+    png = native.render_png(_quote("hi"), fetch=lambda url: b"")  # 头像取不到：灰底占位
+    body_h = native._line_height(native.MSG_SIZE) + 2 * native.BODY_PAD
+    body_y = native.NICK_MARGIN + native.NICK_BOX_H + 2 * native.NICK_PAD + native.NICK_MARGIN
+    col_w = max(native._width("nick", native.NICK_SIZE) + native.NICK_MARGIN,
+                native._width("hi", native.MSG_SIZE) + 2 * native.BODY_PAD + native.BODY_MARGIN)
+    w = native.AVATAR + 2 * native.AVATAR_MARGIN + col_w + 2 * native.APP_PAD
+    h = max(native.AVATAR + 2 * native.AVATAR_MARGIN, body_y + body_h + native.BODY_MARGIN) + 2 * native.APP_PAD
+    assert _size(png) == (w, h)
+
+
+def test_layout_long_message_clamps_to_max_width(font):
+    d = native._Dialog(_quote("lorem ipsum dolor sit amet " * 20)[0])
+    assert d.width == native.APP_MAX_W
+    assert len(d.msg_lines) > 1
+    assert d.body_h == len(d.msg_lines) * native._line_height(native.MSG_SIZE) + 2 * native.BODY_PAD
+    png = native.render_png(_quote("lorem ipsum dolor sit amet " * 20), fetch=lambda url: b"")
+    assert _size(png)[0] == native.APP_MAX_W + 2 * native.APP_PAD
+
+
+def test_layout_reply_is_capped_at_two_lines(font):
+    d = native._Dialog(_quote("ok", reply={"user_nickname": "r", "message": "quoted text " * 40})[0])
+    assert len(d.reply_lines) == native.REPLY_MAX_LINES
+    assert d.reply_lines[-1].endswith("…")
+
+
+def test_layout_stacks_messages(font):
+    one = _size(native.render_png(_quote("hi"), fetch=lambda url: b""))
+    two = _size(native.render_png(_quote("hi") * 2, fetch=lambda url: b""))
+    assert two == (one[0], 2 * one[1] - 2 * native.APP_PAD)
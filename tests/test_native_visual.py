@@ -0,0 +1,62 @@
+# tests/test_native_visual.py
+"""
+原生渲染（native.render_png）与 Firefox 输出的视觉回归：同一批纯文本语料两边各渲染一次，
+要求尺寸一致、平均绝对差与差异像素占比在容差内。RENDER_ENGINE=auto 以本测试通过为前提。
+缺 MiSans（NATIVE_FONT_PATH）或本机 Firefox / geckodriver 时跳过。
+
+运行：python -m pytest -q tests/test_native_visual.py
+"""
+import json
+import shutil
+import threading
+
+import pytest
+
+from native_corpus import CORPUS, image_diff
+from utils import Config
+import native
+
+# 容差：抗锯齿与字形光栅化的差异集中在文字边缘
+MAX_MEAN_ABS_DIFF = 2.0
+MAX_DIFF_PIXELS_PCT = 1.5
+
+
+def _firefox_available() -> bool:
+    return bool(shutil.which("firefox")) and bool(Config.GECKODRIVER_PATH or shutil.which("geckodriver"))
+
+
+pytestmark = [
+    pytest.mark.skipif(not native.available(), reason=f"font not found: {Config.NATIVE_FONT_PATH}"),
+    pytest.mark.skipif(not _firefox_available(), reason="firefox / geckodriver not installed"),
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    import time
+    from werkzeug.serving import make_server
+    Config.RENDER_MODE = "inject"
+    import main
+    # 浏览器经回环地址访问 /shell/ 与 /media/，须在固定端口上提供服务
+    httpd = make_server("127.0.0.1", Config.FLASK_RUN_PORT, main.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    deadline = time.monotonic() + 60
+    while not main.ss.pool.ready() and time.monotonic() < deadline:
+        time.sleep(0.2)
+    try:
+        yield main.app.test_client()
+    finally:
+        httpd.shutdown()
+        main.ss.pool.shutdown()
+
+
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_native_matches_browser(client, name):
+    payload = CORPUS[name]
+    assert native.supports(payload), f"{name} should be eligible for native rendering"
+    r = client.post("/png/?engine=browser", json=json.loads(json.dumps(payload)))
+    assert r.status_code == 200
+    d = image_diff(native.render_png(json.loads(json.dumps(payload))), r.data)
+    assert d["size_match"], d
+    assert d["mean_abs_diff"] <= MAX_MEAN_ABS_DIFF, d
+    assert d["diff_pixels_pct"] <= MAX_DIFF_PIXELS_PCT, d
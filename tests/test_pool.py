@@ -0,0 +1,61 @@
+# tests/test_pool.py
+"""浏览器池的获取/归还（假浏览器，不启动 Firefox）"""
+import threading
+import time
+
+import pytest
+
+import screenshot
+from utils import Config
+
+
+class _FakeWorker:
+    def __init__(self, geckodriver_path=None):
+        self.created = time.monotonic()
+        self.idle_since = self.created
+        self.renders = 0
+        self.health_checks = 0
+
+    def healthy(self) -> bool:
+        self.health_checks += 1
+        return True
+
+    def rss_bytes(self):
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(screenshot, "_BrowserWorker", _FakeWorker)
+    monkeypatch.setattr(Config, "WORKER_HEALTHCHECK_IDLE_SEC", 0.2)
+    p = screenshot.ScreenshotPool(size=1, min_size=0, warmup=0)
+    yield p
+    p.shutdown()
+
+
+def test_direct_handoff_refreshes_idle_since(pool):
+    w = pool.acquire(timeout=5)
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.acquire(timeout=5)))
+    t.start()
+    deadline = time.monotonic() + 5
+    while not pool._waiters and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.3)  # 持有时间超过探活阈值
+    pool.release(w)  # 直接交给等待者
+    t.join(5)
+    assert got == [w]
+    assert w.health_checks == 0  # 刚用过的 worker 不探活
+    pool.release(w)
+
+
+def test_idle_worker_is_health_checked(pool):
+    w = pool.acquire(timeout=5)
+    pool.release(w)
+    time.sleep(0.3)
+    assert pool.acquire(timeout=5) is w
+    assert w.health_checks == 1
+    pool.release(w)
@@ -0,0 +1,170 @@
+# tests/test_probe.py
+"""容器头探测（anim.probe_image）：手工构造的 GIF / PNG / WebP 字节，含截断与未知块"""
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image, UnidentifiedImageError, features
+
+import anim
+from anim import ImageProbe, probe_image
+
+
+# ---------- GIF ----------
+
+def _gif(w=3, h=2, frames=1, gct=True, extras=b""):
+    out = b"GIF89a" + struct.pack("<HHBBB", w, h, 0x80 if gct else 0, 0, 0)
+    if gct:
+        out += b"\x00" * 6  # 2 色全局调色板
+    out += extras
+    for _ in range(frames):
+        out += b"\x21\xf9\x04\x00\x0a\x00\x00\x00"           # Graphic Control Extension
+        out += b"\x2c" + struct.pack("<HHHHB", 0, 0, w, h, 0)  # Image Descriptor
+        out += b"\x02" + b"\x02\x44\x01" + b"\x00"             # LZW 最小码长 + 数据子块
+    return out + b"\x3b"
+
+
+def test_gif_static_and_animated():
+    assert probe_image(_gif()) == ImageProbe(False, (3, 2))
+    assert probe_image(_gif(frames=2)) == ImageProbe(True, (3, 2))
+    assert probe_image(_gif(frames=2, gct=False)) == ImageProbe(True, (3, 2))
+
+
+def test_gif_skips_unknown_extensions():
+    extras = (b"\x21\xfe\x05hello\x00"                            # Comment
+              + b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00"    # Application（循环次数）
+              + b"\x21\x99\x02ab\x01c\x00")                       # 未知标签
+    assert probe_image(_gif(frames=1, extras=extras)) == ImageProbe(False, (3, 2))
+    assert probe_image(_gif(frames=2, extras=extras)) == ImageProbe(True, (3, 2))
+
+
+def test_gif_local_color_table():
+    b = bytearray(_gif(frames=2, gct=False))
+    i = b.index(b"\x2c")
+    b[i + 9] = 0x80                       # 带 2 色局部调色板
+    b[i + 10:i + 10] = b"\x00" * 6
+    assert probe_image(bytes(b)) == ImageProbe(True, (3, 2))
+
+
+@pytest.mark.parametrize("cut", [13, 19, 25, 30, 33])
+def test_gif_truncated_after_header(cut):
+    b = _gif(frames=1)[:cut]
+    assert anim._probe_gif(b) == ImageProbe(False, (3, 2))
+
+
+def test_gif_truncated_in_second_descriptor():
+    b = _gif(frames=2)
+    second = b.rindex(b"\x2c")
+    assert anim._probe_gif(b[:second + 3]) == ImageProbe(True, (3, 2))
+
+
+def test_gif_truncated_header_falls_back():
+    with pytest.raises(ValueError):
+        anim._probe_gif(b"GIF89a\x03\x00")
+    with pytest.raises(UnidentifiedImageError):
+        probe_image(b"GIF89a\x03\x00")
+
+
+# ---------- PNG ----------
+
+def _chunk(ctype: bytes, data: bytes = b"") -> bytes:
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data))
+
+
+_SIG = b"\x89PNG\r\n\x1a\n"
+_IHDR = _chunk(b"IHDR", struct.pack(">IIBBBBB", 5, 4, 8, 6, 0, 0, 0))
+_IDAT = _chunk(b"IDAT", zlib.compress(b"\x00" * 21 * 4))
+_IEND = _chunk(b"IEND")
+
+
+def _actl(frames):
+    return _chunk(b"acTL", struct.pack(">II", frames, 0))
+
+
+def test_png_static_and_apng():
+    assert probe_image(_SIG + _IHDR + _IDAT + _IEND) == ImageProbe(False, (5, 4))
+    assert probe_image(_SIG + _IHDR + _actl(3) + _IDAT + _IEND) == ImageProbe(True, (5, 4))
+    assert probe_image(_SIG + _IHDR + _actl(1) + _IDAT + _IEND) == ImageProbe(False, (5, 4))
+
+
+def test_png_skips_unknown_chunks():
+    extra = _chunk(b"tEXt", b"k\x00v") + _chunk(b"prVt", b"\x00" * 7) + _chunk(b"sRGB", b"\x00")
+    assert probe_image(_SIG + _IHDR + extra + _actl(2) + _IDAT + _IEND) == ImageProbe(True, (5, 4))
+
+
+def test_png_actl_after_idat_is_ignored():
+    assert probe_image(_SIG + _IHDR + _IDAT + _actl(2) + _IEND) == ImageProbe(False, (5, 4))
+
+
+@pytest.mark.parametrize("extra", [b"", b"\x00\x00", _actl(2)[:10], _chunk(b"tEXt", b"abc")[:9]],
+                         ids=["eof", "partial_length", "partial_actl", "partial_text"])
+def test_png_truncated_after_ihdr(extra):
+    assert anim._probe_png(_SIG + _IHDR + extra) == ImageProbe(False, (5, 4))
+
+
+def test_png_chunk_length_past_end():
+    bogus = struct.pack(">I", 0x7FFFFFFF) + b"zzZz"
+    assert anim._probe_png(_SIG + _IHDR + bogus + _actl(2)) == ImageProbe(False, (5, 4))
+
+
+def test_png_bad_first_chunk_falls_back():
+    with pytest.raises(ValueError):
+        anim._probe_png(_SIG + _chunk(b"tEXt", b"x" * 16) + _IHDR)
+    with pytest.raises(ValueError):
+        anim._probe_png(_SIG + _IHDR[:12])
+
+
+# ---------- WebP ----------
+
+def _riff(chunks: bytes) -> bytes:
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WEBP" + chunks
+
+
+def _vp8x(w, h, flags=0):
+    data = bytes([flags, 0, 0, 0]) + (w - 1).to_bytes(3, "little") + (h - 1).to_bytes(3, "little")
+    return b"VP8X" + struct.pack("<I", len(data)) + data
+
+
+def test_webp_vp8x():
+    assert probe_image(_riff(_vp8x(300, 200, flags=0x02))) == ImageProbe(True, (300, 200))
+    assert probe_image(_riff(_vp8x(300, 200, flags=0x10))) == ImageProbe(False, (300, 200))  # 仅 ALPHA
+
+
+def test_webp_simple_lossy_and_lossless():
+    vp8 = b"\x00\x00\x00" + b"\x9d\x01\x2a" + struct.pack("<HH", 640 | 0x4000, 480)  # 带缩放位
+    assert probe_image(_riff(b"VP8 " + struct.pack("<I", len(vp8)) + vp8)) == ImageProbe(False, (640, 480))
+    bits = (17 - 1) | ((9 - 1) << 14)
+    vp8l = b"\x2f" + bits.to_bytes(4, "little")
+    assert probe_image(_riff(b"VP8L" + struct.pack("<I", len(vp8l)) + vp8l)) == ImageProbe(False, (17, 9))
+
+
+@pytest.mark.parametrize("data", [
+    _riff(_vp8x(300, 200))[:26],                                     # 截断的 VP8X
+    _riff(b"VP8 " + struct.pack("<I", 10) + b"\x00" * 10),           # 缺起始码
+    _riff(b"VP8L" + struct.pack("<I", 5) + b"\x00" * 5),             # 缺签名
+    _riff(b"ALPH" + struct.pack("<I", 4) + b"\x00" * 4),             # 未知首块
+], ids=["truncated_vp8x", "vp8_no_start_code", "vp8l_no_signature", "unknown_chunk"])
+def test_webp_malformed_header_raises_for_fallback(data):
+    with pytest.raises(ValueError):
+        anim._probe_webp(data)
+
+
+# ---------- 与 Pillow 交叉验证 ----------
+
+def _encode(fmt, frames, **kw):
+    b = io.BytesIO()
+    frames[0].save(b, fmt, save_all=len(frames) > 1, append_images=frames[1:], **kw)
+    return b.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["GIF", "PNG", "WEBP"])
+@pytest.mark.parametrize("n", [1, 3])
+def test_matches_pillow(fmt, n):
+    if fmt == "WEBP" and not features.check("webp"):
+        pytest.skip("Pillow built without WebP")
+    frames = [Image.new("RGBA", (37, 21), (i * 80, 0, 0, 255)) for i in range(n)]
+    data = _encode(fmt, frames, duration=100, **({"lossless": True} if fmt == "WEBP" else {}))
+    im = Image.open(io.BytesIO(data))
+    assert probe_image(data) == ImageProbe(bool(getattr(im, "is_animated", False)), im.size)
+    assert probe_image(data).animated == (n > 1)
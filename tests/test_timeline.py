@@ -0,0 +1,130 @@
+# tests/test_timeline.py
+"""事件时间线：循环长度选择、k 路归并的帧索引、输出帧预算合并；以及 anim 中按 ticks 二分查帧"""
+from fractions import Fraction
+from itertools import accumulate
+
+import pytest
+
+import anim
+from timeline import build_timeline, choose_loop_ticks
+
+
+def _cum(durations):
+    return list(accumulate(durations))
+
+
+def _expand(tl):
+    """把时间线展开为逐 tick 的帧索引组合"""
+    out = []
+    for key, d in zip(tl.keys, tl.ticks):
+        out.extend([key] * d)
+    return out
+
+
+def _expected_key(cums, t):
+    return tuple(next((j for j, c in enumerate(cum) if t % cum[-1] < c), 0) for cum in cums)
+
+
+# ---------- 循环长度 ----------
+
+@pytest.mark.parametrize("tolerance", [0.0, 0.02])
+def test_exact_lcm_for_coprime_periods(tolerance):
+    assert choose_loop_ticks([3, 7], 100, tolerance) == (21, [7, 3], 0.0)
+    assert choose_loop_ticks([1000, 1010], 200000, tolerance) == (101000, [101, 100], 0.0)
+
+
+def test_drift_search_only_beyond_budget():
+    loop, repeats, drift = choose_loop_ticks([1000, 1010], 60000, 0.02)
+    assert loop < 101000 and 0 < drift <= 0.02
+    assert all(abs(loop - k * p) / (k * p) <= drift + 1e-12 for k, p in zip(repeats, [1000, 1010]))
+
+
+def test_drift_search_falls_back_to_smallest_error():
+    loop, repeats, drift = choose_loop_ticks([1000, 1010], 60000, 0.0)
+    assert loop <= 60000 and drift > 0
+    others = [choose_loop_ticks([1000, 1010], 60000, tol)[2] for tol in (0.001, 0.005)]
+    assert all(drift <= e for e in others)
+
+
+# ---------- 事件流 ----------
+
+def test_merge_frame_indices_match_every_tick():
+    cums = [_cum([1, 2]), _cum([2, 2]), _cum([3, 1, 1])]
+    tl = build_timeline(cums, [c[-1] for c in cums], max_ticks=1000, tolerance=0.02)
+    assert tl.loop_ticks == 60 and tl.drift == 0.0
+    assert tl.repeats == [20, 15, 12]
+    per_tick = _expand(tl)
+    assert len(per_tick) == tl.loop_ticks
+    assert per_tick == [_expected_key(cums, t) for t in range(tl.loop_ticks)]
+
+
+def test_events_are_monotonic_and_distinct():
+    cums = [_cum([3, 5, 2]), _cum([7, 4])]
+    tl = build_timeline(cums, [c[-1] for c in cums], max_ticks=10000, tolerance=0.0)
+    assert all(d > 0 for d in tl.ticks)  # 起点严格递增
+    assert sum(tl.ticks) == tl.loop_ticks == 110
+    assert all(a != b for a, b in zip(tl.keys, tl.keys[1:]))
+
+
+def test_scaled_loop_covers_loop_length():
+    cums = [_cum([1000]), _cum([1010])]
+    tl = build_timeline(cums, [1000, 1010], max_ticks=60000, tolerance=0.02)
+    assert sum(tl.ticks) == tl.loop_ticks < 101000
+    assert all(d > 0 for d in tl.ticks)
+
+
+def test_no_assets():
+    tl = build_timeline([], [], max_ticks=500, tolerance=0.02)
+    assert tl.keys == [()] and tl.ticks == [500]
+
+
+# ---------- 输出帧预算 ----------
+
+@pytest.mark.parametrize("max_frames", [1, 2, 5, 17])
+def test_budget_merge_keeps_total_duration(max_frames):
+    cums = [_cum([1, 2, 3, 1]), _cum([2, 5]), _cum([1] * 11)]
+    periods = [c[-1] for c in cums]
+    full = build_timeline(cums, periods, max_ticks=100000, tolerance=0.0)
+    assert len(full.keys) > max_frames
+    tl = build_timeline(cums, periods, max_ticks=100000, tolerance=0.0, max_frames=max_frames)
+    assert len(tl.keys) <= max_frames
+    assert sum(tl.ticks) == tl.loop_ticks == full.loop_ticks
+    assert all(d > 0 for d in tl.ticks)
+    assert all(a != b for a, b in zip(tl.keys, tl.keys[1:]))
+    assert set(tl.keys) <= set(full.keys)
+
+
+def test_budget_merge_drops_shortest_first():
+    cums = [_cum([10, 1, 10, 10])]
+    tl = build_timeline(cums, [31], max_ticks=1000, tolerance=0.0, max_frames=3)
+    assert tl.keys == [(0,), (2,), (3,)]
+    assert tl.ticks == [11, 10, 10]  # 1 tick 的第 1 帧并入前一帧
+
+
+# ---------- anim：按 ticks 查帧 ----------
+
+def _asset(durations):
+    return anim.AnimatedAsset(
+        placeholder_id="a", display_size=(1, 1), frames_rgba=[],
+        durations_frac=[Fraction(d) for d in durations], cum_ticks=[], period_ticks=0,
+    )
+
+
+def test_frame_index_at_known_ticks():
+    a = _asset([Fraction(1, 10), Fraction(1, 20), Fraction(1, 4)])
+    G = anim._build_global_denominator([a])
+    anim._fill_ticks_with_G([a], G)
+    assert G == 20 and a.cum_ticks == [2, 3, 8] and a.period_ticks == 8
+    expected = {0: 0, 1: 0, 2: 1, 3: 2, 7: 2, 8: 0, 10: 1, 19: 2}
+    assert {t: anim._frame_index_at(a, t) for t in expected} == expected
+
+
+def test_frame_index_at_matches_timeline():
+    assets = [_asset([Fraction(1, 10), Fraction(3, 20)]), _asset([Fraction(1, 8)] * 3)]
+    G = anim._build_global_denominator(assets)
+    anim._fill_ticks_with_G(assets, G)
+    tl = build_timeline([a.cum_ticks for a in assets], [a.period_ticks for a in assets],
+                        max_ticks=60 * G, tolerance=0.02)
+    assert tl.drift == 0.0
+    for t, key in enumerate(_expand(tl)):
+        assert key == tuple(anim._frame_index_at(a, t) for a in assets)
@@ -0,0 +1,151 @@
+# timeline.py
+"""
+事件时间线引擎（纯整数 ticks，不依赖像素）：
+- 循环长度：精确 LCM 不超过 TIMELINE_MAX_SECONDS 时直接采用（速度不变）；超长时选“误差最短公共周期”——
+  各资产各自播放整数轮，轮数取最接近的整数并等比微调播放速度，取速度误差不超过 TIMELINE_MAX_DRIFT 的
+  最短长度，不再硬截断（截断会让动图在循环处跳帧）
+- 事件流：各资产的换帧时刻本身有序，k 路归并（heapq.merge）直接得到全局事件序列与帧索引组合
+- 输出帧预算：超出 TIMELINE_MAX_EVENTS 时，优先把最短的区间并入前一帧（总时长不变）
+"""
+import heapq
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass
+class Timeline:
+    keys: List[Tuple[int, ...]]   # 每个输出帧：各资产的帧索引
+    ticks: List[int]              # 每个输出帧的时长（ticks）
+    loop_ticks: int               # 循环总长（ticks）
+    repeats: List[int]            # 各资产在一个循环内播放的轮数
+    drift: float                  # 最大相对速度误差（0 = 精确）
+
+
+def _lcm(a: int, b: int) -> int:
+    from math import gcd
+    return a // gcd(a, b) * b
+
+
+def choose_loop_ticks(periods: Sequence[int], max_ticks: int, tolerance: float) -> Tuple[int, List[int], float]:
+    """
+    返回 (循环长度, 各资产轮数, 最大相对速度误差)。
+    精确 LCM 在预算内时直接采用（播放速度不变）；超出预算才在各资产周期的整数倍（<= max_ticks）中搜索，
+    误差可接受时取最短者，否则取误差最小者（同误差取更短）
+    """
+    periods = [max(1, int(p)) for p in periods]
+    max_ticks = max(max_ticks, max(periods))
+    lcm = 1
+    for p in periods:
+        lcm = _lcm(lcm, p)
+        if lcm > max_ticks:
+            break
+    if lcm <= max_ticks:
+        return lcm, [lcm // p for p in periods], 0.0
+
+    cands = np.unique(np.concatenate([
+        np.arange(1, max_ticks // p + 1, dtype=np.int64) * p for p in periods
+    ]))
+    p = np.asarray(periods, dtype=np.int64)
+    k = np.maximum(1, np.rint(cands[:, None] / p[None, :])).astype(np.int64)
+    err = (np.abs(cands[:, None] - k * p[None, :]) / (k * p[None, :])).max(axis=1)
+    ok = np.nonzero(err <= tolerance)[0]
+    i = int(ok[0]) if len(ok) else int(np.lexsort((cands, err))[0])
+    L = int(cands[i])
+    return L, [int(v) for v in k[i]], float(err[i])
+
+
+def _asset_stream(idx: int, cum: Sequence[int], period: int, repeats: int, loop: int) -> Iterator[Tuple[int, int, int]]:
+    """单个资产的 (换帧时刻, 资产下标, 帧索引) 流；按 loop / (repeats * period) 等比伸缩到循环长度"""
+    starts = [0] + list(cum[:-1])
+    span = repeats * period
+    for r in range(repeats):
+        off = r * period
+        for j, s in enumerate(starts):
+            yield (off + s) * loop // span, idx, j
+
+
+def _merge_shortest(keys: List[Tuple[int, ...]], ticks: List[int], max_frames: int):
+    """
+    帧数超出预算时反复删除当前最短的一帧，其时长并入前一帧（首帧则并入后一帧）；
+    删除后若左右两帧画面相同则一并合并。堆 + 双向链表，O(n log n)
+    """
+    n = len(keys)
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    nxt[-1] = -1
+    alive = [True] * n
+    count = n
+    heap = [(d, i) for i, d in enumerate(ticks)]
+    heapq.heapify(heap)
+
+    def unlink(i):
+        p, q = prev[i], nxt[i]
+        if p != -1:
+            nxt[p] = q
+        if q != -1:
+            prev[q] = p
+        alive[i] = False
+
+    while count > max_frames and heap:
+        d, i = heapq.heappop(heap)
+        if not alive[i] or ticks[i] != d:
+            continue  # 过期条目
+        target = prev[i] if prev[i] != -1 else nxt[i]
+        if target == -1:
+            break
+        ticks[target] += ticks[i]
+        p, q = prev[i], nxt[i]
+        unlink(i)
+        count -= 1
+        if p != -1 and q != -1 and keys[p] == keys[q]:
+            ticks[p] += ticks[q]
+            unlink(q)
+            count -= 1
+            target = p
+        heapq.heappush(heap, (ticks[target], target))
+    order = [i for i in range(n) if alive[i]]
+    return [keys[i] for i in order], [ticks[i] for i in order]
+
+
+def build_timeline(
+    cums: Sequence[Sequence[int]],
+    periods: Sequence[int],
+    max_ticks: int,
+    tolerance: float,
+    max_frames: Optional[int] = None,
+) -> Timeline:
+    """cums[i] 为资产 i 单轮内的累计 ticks（cum_ticks），periods[i] 为其单轮总 ticks"""
+    if not periods:
+        return Timeline([()], [max(1, max_ticks)], max(1, max_ticks), [], 0.0)
+    loop, repeats, drift = choose_loop_ticks(periods, max_ticks, tolerance)
+    streams = [_asset_stream(i, c, max(1, p), k, loop) for i, (c, p, k) in enumerate(zip(cums, periods, repeats))]
+
+    state = [0] * len(periods)
+    starts: List[int] = []
+    keys: List[Tuple[int, ...]] = []
+    for t, i, j in heapq.merge(*streams):
+        state[i] = j
+        if starts and starts[-1] == t:
+            keys[-1] = tuple(state)  # 同一时刻的多个换帧合成一个事件
+            continue
+        starts.append(t)
+        keys.append(tuple(state))
+
+    # 画面不变（帧索引组合相同）的相邻事件合并
+    out_keys: List[Tuple[int, ...]] = []
+    out_ticks: List[int] = []
+    for n, (t, key) in enumerate(zip(starts, keys)):
+        end = starts[n + 1] if n + 1 < len(starts) else loop
+        if end <= t:
+            continue
+        if out_keys and out_keys[-1] == key:
+            out_ticks[-1] += end - t
+        else:
+            out_keys.append(key)
+            out_ticks.append(end - t)
+
+    if max_frames and len(out_keys) > max_frames:
+        out_keys, out_ticks = _merge_shortest(out_keys, out_ticks, max(1, max_frames))
+    return Timeline(out_keys, out_ticks, loop, repeats, drift)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config(object):
     FLASK_RUN_PORT = int(os.environ.get('FLASK_RUN_PORT') or 5000)
@@ -14,8 +15,9 @@ class Config(object):
     MAX_IMAGE_RENDER_H = int(os.environ.get('MAX_IMAGE_RENDER_H') or 500)
 
     # 事件时间线护栏（避免极端 LCM 爆炸）
-    TIMELINE_MAX_EVENTS = int(os.environ.get('TIMELINE_MAX_EVENTS') or 5000)
-    TIMELINE_MAX_SECONDS = float(os.environ.get('TIMELINE_MAX_SECONDS') or 60.0)
+    TIMELINE_MAX_EVENTS = int(os.environ.get('TIMELINE_MAX_EVENTS') or 5000)  # 输出帧预算，超出时优先合并最短区间
+    TIMELINE_MAX_SECONDS = float(os.environ.get('TIMELINE_MAX_SECONDS') or 60.0)  # 循环长度上限
+    TIMELINE_MAX_DRIFT = float(os.environ.get('TIMELINE_MAX_DRIFT') or 0.02)  # 精确 LCM 超出上限时，为缩短循环允许的最大播放速度误差
 
     # APNG 精度（分母上限 + 容许误差）
     APNG_MAX_DEN = int(os.environ.get('APNG_MAX_DEN') or 1000)      # 单帧 delay 分母上限
@@ -25,6 +27,132 @@ class Config(object):
     GIF_MIN_DELAY_MS = int(os.environ.get('GIF_MIN_DELAY_MS') or 20)  # 常见浏览器对 <20ms 会夹紧
     GIF_ROUND_TO_MS = int(os.environ.get('GIF_ROUND_TO_MS') or 10)    # GIF 1/100s 精度，10ms 对齐
     GIF_COLORS = int(os.environ.get('GIF_COLORS') or 256)
+    GIF_PALETTE = os.environ.get('GIF_PALETTE') or 'global'  # global（底图+资产统一调色板）| local（逐帧自适应）
+    GIF_DITHER = (os.environ.get('GIF_DITHER', '0') == '1')  # 动图区域有序抖动
+    GIF_DITHER_STRENGTH = float(os.environ.get('GIF_DITHER_STRENGTH') or 16)  # Bayer 抖动幅度（0-255 色阶）
+    GIF_PALETTE_SAMPLE = int(os.environ.get('GIF_PALETTE_SAMPLE') or 65536)  # 构建全局调色板的采样像素数
+    GIF_ASSET_PALETTE_COLORS = int(os.environ.get('GIF_ASSET_PALETTE_COLORS') or 128)  # 单资产记忆化调色板色数
+    GIF_PALETTE_CACHE_ENTRIES = int(os.environ.get('GIF_PALETTE_CACHE_ENTRIES') or 512)
 
     # 外部优化工具（可选，无则忽略）
-    USE_GIFSICLE = (os.environ.get('USE_GIFSICLE', '1') == '1')  # 若容器内已安装则自动使用
\ No newline at end of file
+    USE_GIFSICLE = (os.environ.get('USE_GIFSICLE', '1') == '1')  # 若容器内已安装则自动使用
+
+    # 渲染结果缓存（内容寻址：payload + 格式 + 模板版本 + 相关 Config）
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES') or 64 * 1024 * 1024)  # 内存层上限，0 关闭
+    RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR') or ''  # 磁盘层目录（可跨 worker 共享），空则不启用
+    RENDER_CACHE_DISK_MAX_BYTES = int(os.environ.get('RENDER_CACHE_DISK_MAX_BYTES') or 1024 * 1024 * 1024)
+
+    # 媒体下载缓存（anim 取图与浏览器 <img> 经 /media/<key> 共用）
+    MEDIA_PROXY = (os.environ.get('MEDIA_PROXY', '1') == '1')  # 模板 <img src> 改写为本地 /media/<key>
+    MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES') or 128 * 1024 * 1024)
+    MEDIA_CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'qq-quote-media')
+    MEDIA_CACHE_DISK_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_DISK_MAX_BYTES') or 1024 * 1024 * 1024)
+    MEDIA_MAX_DOWNLOAD_BYTES = int(os.environ.get('MEDIA_MAX_DOWNLOAD_BYTES') or 20 * 1024 * 1024)
+    MEDIA_FETCH_TIMEOUT_SEC = float(os.environ.get('MEDIA_FETCH_TIMEOUT_SEC') or 15)
+    MEDIA_DEFAULT_TTL_SEC = int(os.environ.get('MEDIA_DEFAULT_TTL_SEC') or 3600)  # 无缓存头时的默认有效期
+    MEDIA_POOL_MAXSIZE = int(os.environ.get('MEDIA_POOL_MAXSIZE') or 16)
+    MEDIA_URL_INDEX_MAX = int(os.environ.get('MEDIA_URL_INDEX_MAX') or 10000)
+
+    # 已解码动图帧缓存（key = 内容哈希 + 渲染尺寸 + 圆角）
+    ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES') or 256 * 1024 * 1024)  # 内存层上限，0 关闭
+    ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR') or ''  # mmap 磁盘层目录（可跨 worker 共享），空则不启用
+    ASSET_CACHE_DISK_MAX_BYTES = int(os.environ.get('ASSET_CACHE_DISK_MAX_BYTES') or 2 * 1024 * 1024 * 1024)
+
+    # 资产准备并发（下载 + 解码 + 缩放）
+    ASSET_PREPARE_WORKERS = int(os.environ.get('ASSET_PREPARE_WORKERS') or 8)  # 全局线程池大小
+    ASSET_PREPARE_PER_REQUEST = int(os.environ.get('ASSET_PREPARE_PER_REQUEST') or 4)  # 单请求同时在途数
+    ASSET_PREPARE_DEADLINE_SEC = float(os.environ.get('ASSET_PREPARE_DEADLINE_SEC') or 20)  # 超时未完成则退回静态
+
+    # 模板数据存储（/quote/ 回访可能落到任意 gunicorn worker，需跨进程可见）
+    PAYLOAD_STORE = os.environ.get('PAYLOAD_STORE') or 'sqlite'  # sqlite（跨 worker 共享）| memory（仅单 worker）
+    PAYLOAD_STORE_PATH = os.environ.get('PAYLOAD_STORE_PATH') or os.path.join(tempfile.gettempdir(), 'qq-quote-payloads.sqlite3')
+    PAYLOAD_TTL_SEC = float(os.environ.get('PAYLOAD_TTL_SEC') or 300)
+    PAYLOAD_STORE_MAX_ENTRIES = int(os.environ.get('PAYLOAD_STORE_MAX_ENTRIES') or 10000)
+
+    # 渲染方式：navigate（每次导航 /quote/）| inject（常驻外壳页 + execute_script 替换 #app）
+    RENDER_MODE = os.environ.get('RENDER_MODE') or 'navigate'
+
+    # 渲染引擎：auto（纯文本语录走 Pillow 原生渲染，其余走浏览器）| browser（全部走浏览器）；可按请求以 ?engine= 覆盖
+    # 默认 browser：auto 须先在装有 MiSans 与 Firefox 的环境通过 tests/test_native_visual.py
+    RENDER_ENGINE = os.environ.get('RENDER_ENGINE') or 'browser'
+    NATIVE_FONT_PATH = os.environ.get('NATIVE_FONT_PATH') or '/usr/local/share/fonts/MiSans-Regular.ttf'  # 缺失则全部走浏览器
+    NATIVE_MAX_MESSAGES = int(os.environ.get('NATIVE_MAX_MESSAGES') or 50)  # 超过则交给浏览器
+    NATIVE_PNG_COMPRESS_LEVEL = int(os.environ.get('NATIVE_PNG_COMPRESS_LEVEL') or 6)
+
+    # 批量渲染 /batch/：每页装入多条语录，一次就绪等待后逐个截图
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS') or 100)  # 单次请求条目上限，超出返回 413
+    BATCH_PAGE_ITEMS = int(os.environ.get('BATCH_PAGE_ITEMS') or 8)  # 每个页面（一次 worker 租用）装入的条目数
+    BATCH_PARALLEL_PAGES = int(os.environ.get('BATCH_PARALLEL_PAGES') or 2)  # 单次请求同时占用的 worker 数
+
+    # 异步任务 /jobs：进程内有界优先级队列（interactive 优先于 bulk），状态与结果经 PAYLOAD_STORE 同类存储跨 worker 共享
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS') or WORKER_POOL_SIZE)  # 任务执行线程数（至少 2，保证静态 PNG 总有线程可用）
+    JOBS_MAX_QUEUED = int(os.environ.get('JOBS_MAX_QUEUED') or 64)  # 排队上限，满则 429 + Retry-After
+    JOBS_MAX_ANIMATED = int(os.environ.get('JOBS_MAX_ANIMATED') or 0)  # 同时执行的动图任务上限，0 或超过时取执行线程数 - 1
+    JOBS_DEFAULT_DEADLINE_SEC = float(os.environ.get('JOBS_DEFAULT_DEADLINE_SEC') or 120)  # 未指定时的截止（自提交起）
+    JOBS_MAX_DEADLINE_SEC = float(os.environ.get('JOBS_MAX_DEADLINE_SEC') or 600)
+    JOBS_MAX_WAIT_SEC = float(os.environ.get('JOBS_MAX_WAIT_SEC') or 25)  # 长轮询单次最长等待（须小于 GUNICORN_TIMEOUT）
+    JOBS_RESULT_TTL_SEC = float(os.environ.get('JOBS_RESULT_TTL_SEC') or 600)  # 结束后状态与结果保留时长
+    JOBS_STORE_PATH = os.environ.get('JOBS_STORE_PATH') or os.path.join(tempfile.gettempdir(), 'qq-quote-jobs.sqlite3')
+    JOBS_STORE_MAX_ENTRIES = int(os.environ.get('JOBS_STORE_MAX_ENTRIES') or 2000)
+
+    # 指标与追踪：/metrics（Prometheus 文本格式）；各 gunicorn worker 定期把累计值写入 METRICS_DIR，抓取时汇总
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED', '1') == '1')
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'qq-quote-metrics'))  # 空 = 只报告当前进程
+    METRICS_FLUSH_SEC = float(os.environ.get('METRICS_FLUSH_SEC') or 5)
+    SERVER_TIMING = (os.environ.get('SERVER_TIMING', '0') == '1')  # 响应附带各阶段耗时 Server-Timing 头
+    # 慢请求采样剖析（默认关闭）：抽样请求的线程栈，超过 PROFILE_SLOW_MS 的写出折叠栈
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)  # 0-1，被剖析请求的比例
+    PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS') or 2000)
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS') or 10)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'qq-quote-profiles')
+
+    # 页面就绪检测（字体 + 图片解码）
+    READY_TIMEOUT_SEC = float(os.environ.get('READY_TIMEOUT_SEC') or 20)  # 单次渲染总截止
+    READY_IMAGE_TIMEOUT_MS = int(os.environ.get('READY_IMAGE_TIMEOUT_MS') or 8000)  # 单图超时，超时按破图占位
+
+    # 长图分块截图：固定视口，按视口高度滚动截取条带并增量拼接，内存与对话长度无关
+    CAPTURE_VIEWPORT_WIDTH = int(os.environ.get('CAPTURE_VIEWPORT_WIDTH') or 1024)  # 浏览器视口宽度（CSS px）
+    CAPTURE_TILE_HEIGHT = int(os.environ.get('CAPTURE_TILE_HEIGHT') or 2048)  # 视口高度 = 单块高度（CSS px）
+    CAPTURE_TILE_THRESHOLD_PX = int(os.environ.get('CAPTURE_TILE_THRESHOLD_PX') or 4096)  # 元素高于此值改为分块（0 = 仅超限时）
+    CAPTURE_MAX_HEIGHT = int(os.environ.get('CAPTURE_MAX_HEIGHT') or 30000)  # 输出图高度上限（像素）
+    CAPTURE_MAX_PIXELS = int(os.environ.get('CAPTURE_MAX_PIXELS') or 25_000_000)  # 输出图像素上限
+    CAPTURE_OVERSIZE = os.environ.get('CAPTURE_OVERSIZE') or 'downscale'  # 超限处理：downscale（等比缩小，最小 1/4）| error（413）
+
+    # 浏览器池弹性与自愈（WORKER_POOL_SIZE 为上限）
+    WORKER_POOL_MIN = int(os.environ.get('WORKER_POOL_MIN') or 1)  # 常驻数量（回收/崩溃后补足）
+    # 启动时在后台并行预热的浏览器数，不阻塞应用导入；小于 WORKER_POOL_MIN 时其余按需创建
+    WORKER_WARMUP = int(os.environ.get('WORKER_WARMUP') or WORKER_POOL_MIN)
+    WORKER_IDLE_TTL_SEC = float(os.environ.get('WORKER_IDLE_TTL_SEC') or 300)  # 超出下限的空闲 worker 关闭时间
+    WORKER_HEALTHCHECK_IDLE_SEC = float(os.environ.get('WORKER_HEALTHCHECK_IDLE_SEC') or 30)  # 空闲超过该时长交出前先探活
+    WORKER_MAX_RENDERS = int(os.environ.get('WORKER_MAX_RENDERS') or 500)  # 渲染次数达到后回收重建
+    WORKER_MAX_RSS_MB = int(os.environ.get('WORKER_MAX_RSS_MB') or 1500)  # 进程树 RSS 上限，0 关闭
+    WORKER_RSS_CHECK_EVERY = int(os.environ.get('WORKER_RSS_CHECK_EVERY') or 20)  # 每 N 次渲染检查一次 RSS
+
+    # 动图流水线内存护栏（超限时降级：资产均匀跳帧、输出画布等比缩小）
+    ASSET_MAX_FRAMES = int(os.environ.get('ASSET_MAX_FRAMES') or 300)  # 单个动图保留的最多帧数
+    ASSET_MAX_DECODED_MB = int(os.environ.get('ASSET_MAX_DECODED_MB') or 256)  # 单个动图解码后像素上限
+    ANIM_MAX_CANVAS_PIXELS = int(os.environ.get('ANIM_MAX_CANVAS_PIXELS') or 12_000_000)  # 输出画布像素上限
+    ANIM_MAX_MEMORY_MB = int(os.environ.get('ANIM_MAX_MEMORY_MB') or 1024)  # 单次合成工作集（解码帧 + 画布 + 补丁缓存）
+
+    # APNG 编码器：delta（子矩形帧，自研封装）| fast（同 delta，低压缩级别）| apngasm（整帧交给 apngasm 优化）
+    # 可按请求以 ?encoder= 覆盖
+    APNG_ENCODER = os.environ.get('APNG_ENCODER') or 'delta'
+    APNG_COMPRESS_LEVEL = int(os.environ.get('APNG_COMPRESS_LEVEL') or 6)  # zlib 压缩级别 0-9
+    APNG_FAST_COMPRESS_LEVEL = int(os.environ.get('APNG_FAST_COMPRESS_LEVEL') or 1)
+    # APNG 边编码边分块写回响应（首字节更早）；后续帧出错时只能中断连接，默认关闭：整体编码完再响应
+    APNG_STREAM = (os.environ.get('APNG_STREAM', '0') == '1')
+
+    # WebP/AVIF 动图：质量/速度预设 fast | balanced | small | high（encoders.ANIM_PRESETS），可按请求以 ?preset= 覆盖
+    WEBP_PRESET = os.environ.get('WEBP_PRESET') or 'balanced'
+    AVIF_PRESET = os.environ.get('AVIF_PRESET') or 'balanced'
+    # /anim/ 按 Accept 协商输出格式；客户端偏好相同（如 image/*）时按此顺序取第一个（本机不支持的格式跳过）
+    ANIM_FORMAT_ORDER = [f.strip() for f in (os.environ.get('ANIM_FORMAT_ORDER') or 'webp,avif,apng,gif').split(',') if f.strip()]
+
+    # 动图合成/编码进程池：合成与编码移出 gunicorn worker，吞吐随 CPU 核数扩展、与浏览器池容量解耦
+    # 每个 gunicorn worker 的编码子进程数；默认按核数均分给各 gunicorn worker，0 = 在请求线程内合成
+    ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS')
+                         or max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('GUNICORN_WORKERS') or 1))))
+    ENCODE_MAX_QUEUED = int(os.environ.get('ENCODE_MAX_QUEUED') or 32)  # 等待空闲子进程的任务上限，满则 503
+    ENCODE_ACQUIRE_TIMEOUT_SEC = float(os.environ.get('ENCODE_ACQUIRE_TIMEOUT_SEC') or 30)  # 等待空闲子进程的最长时间
+    ENCODE_TIMEOUT_SEC = float(os.environ.get('ENCODE_TIMEOUT_SEC') or 90)  # 单个任务在子进程内的耗时上限，超时杀掉重建
+    ENCODE_WORKER_MAX_JOBS = int(os.environ.get('ENCODE_WORKER_MAX_JOBS') or 200)  # 子进程处理 N 个任务后回收